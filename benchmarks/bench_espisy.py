@@ -0,0 +1,235 @@
+"""Benchmarks of the hot paths of espisy against simulated ESPEasy units
+
+Usage: python benchmarks/bench_espisy.py [--quick] [--only scan,refresh,...] [--output results.json]
+                                         [--compare baseline.json]
+
+refresh, device, commands and settings run against an in-process espisy.simulator.FakeTransport with a fixed latency
+per request, so the results only depend on espisy and the CPU. scan needs real sockets for the TCP probe, so it runs
+against a espisy.simulator.Simulator whose units listen on loopback addresses (Linux routes all of 127.0.0.0/8 to
+the loopback interface).
+
+The results are printed as JSON. --compare prints the ratio new / baseline of every metric of an older run.
+"""
+
+import argparse
+import ipaddress
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from espisy.core import ESP  # noqa: E402
+from espisy.fleet import Fleet  # noqa: E402
+from espisy.settings import SQLiteSettingsStore, YAMLSettingsStore  # noqa: E402
+from espisy.simulator import FakeTransport, SimulatedUnit, Simulator  # noqa: E402
+
+
+def percentiles(samples: list) -> dict:
+    """Returns mean, p50, p99 and max of <samples> in milliseconds"""
+    samples = sorted(samples)
+    return {"mean_ms": statistics.fmean(samples) * 1000,
+            "p50_ms": samples[len(samples) // 2] * 1000,
+            "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+            "max_ms": samples[-1] * 1000}
+
+
+def clear_register():
+    for ip in list(ESP._device_register):
+        ESP.remove(ip)
+
+
+def bench_scan(quick: bool, latency: float) -> list:
+    """ESP.scan_network against subnet size and share of hosts that are ESPs"""
+
+    results = []
+    for prefix in ((26, 24) if quick else (24, 22, 20)):
+        for density in (0.05, 0.25):
+            network = ipaddress.ip_network(f"127.42.0.0/{prefix}")
+            hosts = list(network.hosts())
+            stride = max(1, round(1 / density))
+            simulator = Simulator(shared_port=True)
+            for number, host in enumerate(hosts[::stride], 1):
+                simulator.add(SimulatedUnit(f"ESP_{number:05d}", latency=latency), host=str(host))
+            with simulator:
+                start = time.perf_counter()
+                found = ESP.scan_network(network, port=simulator.port, timeout=1, concurrency=64)
+                elapsed = time.perf_counter() - start
+            clear_register()
+            results.append({"benchmark": "scan_network",
+                            "params": {"hosts": len(hosts), "units": len(simulator.units), "latency_ms": latency * 1000},
+                            "metrics": {"seconds": elapsed, "found": len(found),
+                                        "hosts_per_s": len(hosts) / elapsed}})
+    return results
+
+
+def bench_refresh(quick: bool, latency: float) -> list:
+    """ESP.refresh of a single ESP and Fleet.refresh_all"""
+
+    transport = FakeTransport.fleet(50 if quick else 500, sleep=True, latency=latency)
+    esps = [ESP.add(ip, transport=transport) for ip in transport.units]
+    samples = []
+    for _ in range(100 if quick else 1000):
+        start = time.perf_counter()
+        esps[0].refresh()
+        samples.append(time.perf_counter() - start)
+    results = [{"benchmark": "refresh", "params": {"latency_ms": latency * 1000},
+                "metrics": percentiles(samples)}]
+    fleet = Fleet(concurrency=32)
+    start = time.perf_counter()
+    fleet.refresh_all()
+    elapsed = time.perf_counter() - start
+    results.append({"benchmark": "refresh_all", "params": {"esps": len(esps), "concurrency": 32,
+                                                           "latency_ms": latency * 1000},
+                    "metrics": {"seconds": elapsed, "esps_per_s": len(esps) / elapsed}})
+    clear_register()
+    return results
+
+
+def bench_device(quick: bool, latency: float) -> list:
+    """Reading device properties from the stored state"""
+
+    esp = ESP("10.0.0.1", state=SimulatedUnit().state)
+    dht = esp.device("DHT", device_type="DHT")
+    door = esp.device("door", device_type="Switch")
+    results = []
+    count = 100000 if quick else 1000000
+    for name, read in (("Thermometer.temperature", lambda: dht.temperature),
+                       ("Switch.pinstate", lambda: door.pinstate),
+                       ("Device.state", lambda: dht.state)):
+        start = time.perf_counter()
+        for _ in range(count):
+            read()
+        elapsed = time.perf_counter() - start
+        results.append({"benchmark": "device_access", "params": {"property": name},
+                        "metrics": {"ops_per_s": count / elapsed, "ns_per_op": elapsed / count * 1e9}})
+    return results
+
+
+def bench_commands(quick: bool, latency: float) -> list:
+    """Latency of the commands of an ESP"""
+
+    transport = FakeTransport.fleet(1, sleep=True, latency=latency)
+    esp = ESP(next(iter(transport.units)), transport=transport)
+    results = []
+    for name, command in (("gpio_on", lambda: esp.gpio_on(2)),
+                          ("gpio_off", lambda: esp.gpio_off(2)),
+                          ("send_command", lambda: esp.send_command("control?cmd=event,bench"))):
+        samples = []
+        for _ in range(100 if quick else 1000):
+            start = time.perf_counter()
+            command()
+            samples.append(time.perf_counter() - start)
+        results.append({"benchmark": "command", "params": {"command": name, "latency_ms": latency * 1000},
+                        "metrics": percentiles(samples)})
+    pins = list(range(16))
+    for name, read in (("gpio_state", lambda: [esp.gpio_state(pin) for pin in pins]),
+                       ("gpio_states", lambda: esp.gpio_states(pins))):
+        samples = []
+        for _ in range(10 if quick else 100):
+            start = time.perf_counter()
+            read()
+            samples.append(time.perf_counter() - start)
+        results.append({"benchmark": "read_gpios", "params": {"method": name, "pins": len(pins),
+                                                              "latency_ms": latency * 1000},
+                        "metrics": percentiles(samples)})
+    return results
+
+
+def bench_settings(quick: bool, latency: float) -> list:
+    """save_settings, load_settings, save_all and load_all against the size of the register"""
+
+    results = []
+    for size in ((10, 100) if quick else (10, 100, 1000)):
+        transport = FakeTransport.fleet(size)
+        esps = [ESP.add(ip, transport=transport) for ip in transport.units]
+        for esp in esps:
+            esp.device("DHT", device_type="DHT")
+            esp.device("door", device_type="Switch")
+            esp.device("led", device_type="GPIO", settings={"pin": 2})
+        with tempfile.TemporaryDirectory() as directory:
+            for store in (YAMLSettingsStore(os.path.join(directory, "esp.yaml")),
+                          SQLiteSettingsStore(os.path.join(directory, "esp.sqlite"))):
+                ESP.settings_store = store
+                metrics = {}
+                start = time.perf_counter()
+                ESP.save_all()
+                metrics["save_all_s"] = time.perf_counter() - start
+                start = time.perf_counter()
+                ESP.load_all()
+                metrics["load_all_s"] = time.perf_counter() - start
+                sample = esps[:10]
+                start = time.perf_counter()
+                for esp in sample:
+                    esp.save_settings()
+                metrics["save_settings_ms"] = (time.perf_counter() - start) / len(sample) * 1000
+                start = time.perf_counter()
+                for esp in sample:
+                    esp.load_settings()
+                metrics["load_settings_ms"] = (time.perf_counter() - start) / len(sample) * 1000
+                results.append({"benchmark": "settings", "params": {"store": type(store).__name__, "esps": size},
+                                "metrics": metrics})
+                if hasattr(store, "close"):
+                    store.close()
+        ESP.settings_store = None
+        clear_register()
+    return results
+
+
+BENCHMARKS = {"scan": bench_scan, "refresh": bench_refresh, "device": bench_device, "commands": bench_commands,
+              "settings": bench_settings}
+
+
+def compare(results: list, baseline: list) -> list:
+    """Returns the ratio new / baseline of every metric that is in both runs"""
+
+    def key(result):
+        return result["benchmark"], json.dumps(result["params"], sort_keys=True)
+
+    old = {key(result): result["metrics"] for result in baseline}
+    ratios = []
+    for result in results:
+        metrics = old.get(key(result))
+        if metrics is None:
+            continue
+        ratios.append({"benchmark": result["benchmark"], "params": result["params"],
+                       "ratio": {name: value / metrics[name] for name, value in result["metrics"].items()
+                                 if metrics.get(name)}})
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and fewer iterations")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="comma separated benchmarks to run")
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds per simulated request")
+    parser.add_argument("--output", help="file to write the results to")
+    parser.add_argument("--compare", help="results of an older run to compare with")
+    args = parser.parse_args()
+
+    # scans load the settings of every ESP they find, so the benchmark must not touch ~/.espisy
+    with tempfile.TemporaryDirectory() as directory:
+        from espisy.constants import configure
+        configure(settings_dir=directory)
+        results = []
+        for name in args.only.split(","):
+            results.extend(BENCHMARKS[name](args.quick, args.latency))
+    report = {"meta": {"python": platform.python_version(), "platform": platform.platform(),
+                       "quick": args.quick, "latency_ms": args.latency * 1000, "time": time.time()},
+              "results": results}
+    if args.compare:
+        with open(args.compare) as baseline:
+            report["comparison"] = compare(results, json.load(baseline)["results"])
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Measures the time to import espisy in a fresh interpreter
+
+Usage: python benchmarks/bench_import.py [--runs 10] [--module espisy.core]
+Prints the results as JSON.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+def import_time(module: str) -> float:
+    """Returns the seconds a fresh interpreter needs to import <module>, minus the start of the interpreter"""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(result.stdout)
+
+
+def loaded_modules(module: str) -> list:
+    """Returns the top level modules that are loaded by importing <module>"""
+    code = (f"import sys; before = set(sys.modules); import {module}; "
+            "print('\\n'.join(sorted({m.split('.')[0] for m in set(sys.modules) - before})))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--module", default="espisy.core")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    times = [import_time(args.module) for _ in range(args.runs)]
+    print(json.dumps({
+        "benchmark": "import",
+        "module": args.module,
+        "runs": args.runs,
+        "min_ms": min(times) * 1000,
+        "median_ms": statistics.median(times) * 1000,
+        "max_ms": max(times) * 1000,
+        "loaded_modules": loaded_modules(args.module),
+        "wall_s": time.perf_counter() - start,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,603 @@
+"""Asyncio counterpart of the ESP module to control ESPEasy devices without blocking the event loop
+
+Requires aiohttp, which is installed with ``pip install espisy[async]``.
+The device classes of espisy.devices are shared with the synchronous API. Methods of a device that send a request
+(e.g. GPIO.on or Display.text) return awaitables when the parent is an AsyncESP.
+"""
+
+import asyncio
+import ipaddress
+import logging
+import time
+import weakref
+from typing import AsyncIterator, Union
+
+import aiohttp
+
+from .core import ESP, _gpio_answer, _gpio_status_answer, _json_answer, _state_answer
+from .errors import NoGPIOError
+from .instrumentation import instrumentation, is_timeout
+from .breaker import CircuitBreaker
+from .gpiocache import GPIOCache, may_change_gpios
+from .network import async_probe_host
+from .scheduler import is_read
+from .state import State
+from .transport import Response
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTransport():
+    """Pooled asyncio HTTP transport shared by AsyncESP instances
+
+    The aiohttp session is created on first use, because it is bound to the running event loop.
+    """
+
+    def __init__(self, limit: int = 1024, pool_size: int = 2, timeout: float = 3):
+        """Initializing the transport
+
+        Parameters
+        ----------
+        limit : int, optional
+            Maximum number of requests in flight for the whole transport, by default 1024
+        pool_size : int, optional
+            Maximum number of connections per ESP. ESPEasy only handles a few connections, by default 2
+        timeout : float, optional
+            Default timeout in seconds for every request that does not pass its own, by default 3
+        """
+
+        self.limit = limit
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Returns the aiohttp session and creates it if necessary"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.pool_size)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def get(self, url: str, timeout: float = None) -> Response:
+        """Sends a GET request over the pooled session
+
+        Parameters
+        ----------
+        url : str
+            Complete url, e.g. http://192.168.0.2/json
+        timeout : float, optional
+            Deadline in seconds for the whole request, by default the timeout of the transport
+
+        Returns
+        -------
+        Response
+            The completely read answer of the ESP
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+        async with self.session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as answer:
+            content = await answer.read()
+            return Response(url, answer.status, content, answer.get_encoding() if content else "utf-8")
+
+    async def close(self):
+        """Closes all pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+_default_transports = weakref.WeakKeyDictionary()
+
+
+def get_default_async_transport() -> AsyncTransport:
+    """Returns the transport that is shared by all AsyncESPs of the running event loop
+
+    The transport is closed when the loop shuts down its async generators, which asyncio.run does before it returns.
+    Other loops have to call AsyncESP.close_default_transport.
+    """
+
+    loop = asyncio.get_running_loop()
+    entry = _default_transports.get(loop)
+    if entry is None:
+        transport = AsyncTransport()
+        closer = _close_at_shutdown(transport)
+        # starting the generator registers it with the loop, which closes it in loop.shutdown_asyncgens
+        asyncio.ensure_future(closer.__anext__())
+        entry = _default_transports[loop] = (transport, closer)
+    return entry[0]
+
+
+async def _close_at_shutdown(transport: AsyncTransport):
+    """Internal async generator that closes <transport> when it is closed by the shutdown of the event loop"""
+    try:
+        yield
+    finally:
+        await transport.close()
+
+
+class AsyncRequestScheduler():
+    """asyncio counterpart of espisy.scheduler.RequestScheduler
+
+    Caps the requests in flight to an ESP, coalesces identical reads and sends writes in the order they were issued.
+    Cancelling a waiter does not cancel a read that other waiters share.
+    """
+
+    def __init__(self, max_concurrency: int = 2):
+        """Initializing the scheduler
+
+        Parameters
+        ----------
+        max_concurrency : int, optional
+            Maximum number of requests in flight to the ESP, by default 2
+        """
+
+        self.max_concurrency = max_concurrency
+        self.coalesced = 0
+        self._slots = None
+        self._write_lock = None
+        self._generation = 0
+        self._reads = {}
+
+    async def request(self, path: str, function, *args, **kwargs):
+        """Returns await function(*args, **kwargs), scheduled as request for <path>. See RequestScheduler.request"""
+
+        if self._slots is None:
+            # created on first use, so that they belong to the running event loop
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._write_lock = asyncio.Lock()
+        if not is_read(path):
+            # asyncio.Lock wakes up its waiters in order
+            async with self._write_lock:
+                try:
+                    return await self._run(function, *args, **kwargs)
+                finally:
+                    self._generation += 1
+        in_flight = self._reads.get(path)
+        if in_flight is not None and in_flight[0] == self._generation:
+            self.coalesced += 1
+            return await asyncio.shield(in_flight[1])
+        task = asyncio.ensure_future(self._run(function, *args, **kwargs))
+        self._reads[path] = (self._generation, task)
+        task.add_done_callback(lambda task: self._read_done(path, task))
+        return await asyncio.shield(task)
+
+    async def _run(self, function, *args, **kwargs):
+        async with self._slots:
+            return await function(*args, **kwargs)
+
+    def _read_done(self, path: str, task: asyncio.Task):
+        if self._reads.get(path, (None, None))[1] is task:
+            del self._reads[path]
+        if not task.cancelled():
+            # retrieve the exception, also if all waiters were cancelled
+            task.exception()
+
+
+class AsyncESP(ESP):
+    """Asyncio counterpart of espisy.core.ESP
+
+    All methods that talk to the ESP are coroutines and accept a per-call timeout. Cancelling the awaiting task cancels
+    the request. The device classes, the device type mapping and the settings persistence are shared with ESP.
+    Create instances with ``await AsyncESP.connect(ip)`` or ``await AsyncESP.add(ip)``.
+
+    AsyncESPs without a transport share one AsyncTransport per event loop. asyncio.run closes it when the main
+    coroutine returns. Programs that run the loop otherwise call ``await AsyncESP.close_default_transport()`` before
+    they close it, or aiohttp warns about an unclosed client session.
+    """
+
+    _device_register = {}
+    _name_ip_map = {}
+
+    def __init__(self, ip: str, transport: AsyncTransport = None, state: Union[State, bytes, dict] = None,
+                 cache: bool = False, breaker: CircuitBreaker = None, scheduler: AsyncRequestScheduler = None,
+                 gpio_max_age: float = 0):
+        """Initializing the AsyncESP without any request
+
+        Parameters
+        ----------
+        ip : str
+            The local ip where the ESP is reachable.
+        transport : AsyncTransport, optional
+            Transport used for all requests to the ESP, by default the shared transport of the running event loop
+        state : dict, optional
+            An already fetched /json answer of the ESP, by default None
+        cache : bool, optional
+            If True, refresh only requests /json when the state is older than the TTL of the ESP, by default False
+        breaker : CircuitBreaker, optional
+            Circuit breaker and adaptive timeout of the ESP, by default a espisy.breaker.CircuitBreaker
+        scheduler : AsyncRequestScheduler, optional
+            Limits the requests in flight to the ESP and coalesces reads, by default 2 requests in flight
+        gpio_max_age : float, optional
+            Seconds gpio_state and gpio_states answer from the GPIO cache, see ESP. By default 0, always requested
+        """
+
+        self.ip = ip
+        self.transport = transport
+        self.cache = cache
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.scheduler = scheduler if scheduler is not None else AsyncRequestScheduler()
+        self._init_state()
+        self.gpio_cache = GPIOCache(gpio_max_age)
+        self.name = None
+        if state is not None:
+            self._update_state(state)
+            self.name = self._state.unit_name
+
+    @property
+    def state(self) -> State:
+        """Returns the state of the device.
+
+        The method does not refresh via http request, but uses the stored information
+        """
+        return self._state
+
+    @state.setter
+    def state(self, value):
+        logger.error("Setting not permitted. Use await refresh() instead")
+
+    @classmethod
+    async def connect(cls, ip: str, transport: AsyncTransport = None, timeout: float = None) -> "AsyncESP":
+        """Classmethod. Creates an AsyncESP and fetches its state, without adding it to the device register
+
+        Parameters
+        ----------
+        ip : str
+            The local ip where the ESP is reachable.
+        transport : AsyncTransport, optional
+            Transport used for all requests to the ESP, by default the shared transport of the running event loop
+        timeout : float, optional
+            Deadline for the request in seconds, by default the timeout of the transport
+
+        Returns
+        -------
+        AsyncESP
+            The ESP with its state
+        """
+
+        esp = cls(ip, transport=transport)
+        await esp.refresh(timeout=timeout)
+        return esp
+
+    async def refresh(self, timeout: float = None, max_age: float = None):
+        """Refreshes the state of the esp by requesting http://<self.ip>/json.
+
+        Tasks that refresh the same ESP at once share a single request. Cancelling one of them does not cancel the
+        request for the others.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Deadline in seconds, by default the timeout of the transport
+        max_age : float, optional
+            Only refresh if the state is older than <max_age> seconds. By default the TTL of the ESP if caching is
+            enabled, otherwise the state is always refreshed.
+        """
+
+        if max_age is None and self.cache:
+            max_age = self.ttl
+        if max_age is not None and self.age is not None and self.age < max_age:
+            return
+        in_flight = self._refresh_in_flight
+        if in_flight is None:
+            in_flight = self._refresh_in_flight = asyncio.ensure_future(self._fetch_state(timeout))
+            in_flight.add_done_callback(self._refresh_done)
+        await asyncio.wait_for(asyncio.shield(in_flight), timeout)
+
+    async def _fetch_state(self, timeout: float = None):
+        """Internal coroutine that requests /json and stores the answer"""
+        self._update_state(_state_answer(await self._get("json", timeout=timeout)))
+        if self.name is None:
+            self.name = self._state.unit_name
+
+    def _refresh_done(self, in_flight: asyncio.Future):
+        """Internal callback that clears the shared refresh request"""
+        self._refresh_in_flight = None
+        if not in_flight.cancelled():
+            in_flight.exception()
+
+    async def _get(self, path: str, timeout: float = None) -> Response:
+        """Sends a GET request for http://<self.ip>/<path>, queued by the scheduler and guarded by the circuit breaker
+
+        Parameters
+        ----------
+        path : str
+            Everything that comes behind http://<self.ip>/
+        timeout : float, optional
+            Deadline for the request in seconds, by default the adaptive timeout of the breaker or the timeout of the
+            transport
+
+        Returns
+        -------
+        Response
+            The answer of the ESP
+        """
+
+        return await self.scheduler.request(path, self._request, path, timeout)
+
+    async def _request(self, path: str, timeout: float = None) -> Response:
+        """Internal coroutine that sends the request of _get once the scheduler lets it through"""
+
+        transport = self.transport if self.transport is not None else get_default_async_transport()
+        url = f"http://{self.ip}/{path}"
+        breaker = self.breaker
+        breaker.before_request()
+        if timeout is None:
+            timeout = breaker.timeout(getattr(transport, "timeout", None))
+        start = time.perf_counter()
+        try:
+            if instrumentation.enabled:
+                answer = await instrumentation.acall(self.ip, path, transport.get, url, timeout=timeout)
+            else:
+                answer = await transport.get(url, timeout=timeout)
+        except Exception as error:
+            breaker.record_failure(timeout=is_timeout(error))
+            raise
+        except BaseException:
+            breaker.record_cancelled()
+            raise
+        breaker.record_success(time.perf_counter() - start)
+        return answer
+
+    async def gpio_on(self, gpio: int, timeout: float = None):
+        """Turn a GPIO on. See ESP.gpio_on"""
+
+        if gpio == None:
+            raise NoGPIOError
+        return self._gpio_written(gpio, _gpio_answer(await self._get(f"control?cmd=GPIO,{gpio},1", timeout=timeout)))
+
+    async def gpio_off(self, gpio: int, timeout: float = None):
+        """Turn a GPIO off. See ESP.gpio_off"""
+
+        if gpio == None:
+            raise NoGPIOError
+        return self._gpio_written(gpio, _gpio_answer(await self._get(f"control?cmd=GPIO,{gpio},0", timeout=timeout)))
+
+    async def gpio_state(self, gpio: int, timeout: float = None, max_age: float = None):
+        """Returns the state of the given GPIO. See ESP.gpio_state"""
+
+        if gpio == None:
+            raise NoGPIOError
+        state = self.gpio_cache.get(gpio, max_age)
+        if state is None:
+            state = await self._fetch_gpio_state(gpio, timeout)
+        return state
+
+    async def gpio_states(self, gpios: list, timeout: float = None, max_age: float = None) -> dict:
+        """Returns the states of several GPIOs as {gpio: state}. See ESP.gpio_states
+
+        The scheduler of the ESP limits the requests in flight, <timeout> applies to every request.
+        """
+
+        gpios = list(dict.fromkeys(gpios))
+        if None in gpios:
+            raise NoGPIOError
+        states = {gpio: self.gpio_cache.get(gpio, max_age) for gpio in gpios}
+        missing = [gpio for gpio, state in states.items() if state is None]
+        fetched = await asyncio.gather(*(self._fetch_gpio_state(gpio, timeout) for gpio in missing))
+        states.update(zip(missing, fetched))
+        return states
+
+    async def _fetch_gpio_state(self, gpio: int, timeout: float = None):
+        """Internal coroutine that requests the state of a GPIO and stores it in the GPIO cache"""
+        state = _gpio_status_answer(await self._get(f"control?cmd=status,gpio,{gpio}", timeout=timeout))
+        self.gpio_cache.update(gpio, state)
+        return state
+
+    async def _toggle(self, gpio: int, timeout: float = None):
+        """Toggles a switch or GPIO. See ESP._toggle"""
+
+        if gpio == None:
+            raise NoGPIOError("No GPIO mapped to the switch")
+        answer = _json_answer(await self._get(f"control?cmd=gpiotoggle,{gpio}", timeout=timeout))
+        return self._gpio_written(gpio, answer)
+
+    async def event(self, event: str, timeout: float = None) -> Response:
+        """Triggers a event that can be fetched by a rule defined in ESPEasy. See ESP.event"""
+
+        self.gpio_cache.invalidate()
+        return await self._get(f"control?cmd=event,{event}", timeout=timeout)
+
+    async def send_command(self, cmd: str, timeout: float = None):
+        """Send a command to the ESPEasy device. See ESP.send_command"""
+
+        if may_change_gpios(cmd):
+            self.gpio_cache.invalidate()
+        return _json_answer(await self._get(cmd, timeout=timeout))
+
+    @classmethod
+    async def add(cls, ip: str, transport: AsyncTransport = None, timeout: float = None) -> "AsyncESP":
+        """Classmethod. Creates an AsyncESP and adds it to the device register
+
+        Parameters
+        ----------
+        ip : str
+            ip address of the ESP device
+        transport : AsyncTransport, optional
+            Transport used for all requests to the ESP, by default the shared transport of the running event loop
+        timeout : float, optional
+            Deadline for the request in seconds, by default the timeout of the transport
+
+        Returns
+        -------
+        AsyncESP
+            The ESP that was added
+        """
+
+        esp = await cls.connect(ip, transport=transport, timeout=timeout)
+        cls._name_ip_map.update({esp.name: ip})
+        cls._device_register.update({ip: esp})
+        return esp
+
+    @classmethod
+    async def close_default_transport(cls):
+        """Classmethod. Closes the transport shared by the AsyncESPs of the running event loop
+
+        asyncio.run does this on its own. A new transport is created when an AsyncESP without transport sends the
+        next request.
+        """
+
+        entry = _default_transports.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            # closing the generator closes the transport
+            await entry[1].aclose()
+
+    @classmethod
+    async def scan_network(cls, network: ipaddress.IPv4Network = None, timeout: float = 3,
+                           concurrency: int = 256, deadline: float = None, port: int = 80,
+                           probe_timeout: float = 0.1) -> list:
+        """Scans the network for any ESPEasy device and creates AsyncESP instances
+
+        See ESP.scan_network. Every host is probed on <port> and only asked for /json if it accepted the connection.
+        All hosts are scanned on the running event loop with at most <concurrency> hosts in flight.
+        Use iter_scan to get the ESPs while the scan is still running.
+
+        Parameters
+        ----------
+        network : ipaddress.IPv4Network, optional
+            Pass the network or leave it as None and configure it in esp.yaml, by default None
+        timeout : float, optional
+            the time for each request to wait for an answer, by default 3
+        concurrency : int, optional
+            Maximum number of requests in flight, by default 256
+        deadline : float, optional
+            Time in seconds after which the scan stops, by default the whole network is scanned
+        port : int, optional
+            The port of the ESPEasy web server. ESPs with another port than 80 get the ip "<ip>:<port>", by default 80
+        probe_timeout : float, optional
+            Time in seconds that the TCP probe waits for each host to accept the connection, by default 0.1
+
+        Returns
+        -------
+        list
+            The AsyncESPs that were added, ordered by their address
+        """
+
+        if network == None:
+            network = cls._configured_network()
+            if network == None:
+                return []
+        found = [item async for item in cls._scan(network, timeout, concurrency, deadline, port, probe_timeout)]
+        return [esp for host, esp in sorted(found, key=lambda item: item[0])]
+
+    @classmethod
+    async def iter_scan(cls, network: ipaddress.IPv4Network = None, timeout: float = 3, concurrency: int = 256,
+                        deadline: float = None, port: int = 80, probe_timeout: float = 0.1, limit: int = None,
+                        name: str = None) -> AsyncIterator["AsyncESP"]:
+        """Scans the network like scan_network, but yields every AsyncESP as soon as it was added
+
+        See ESP.iter_scan. The scan is cancelled as soon as the async generator is closed.
+
+        Parameters
+        ----------
+        network : ipaddress.IPv4Network, optional
+            Pass the network or leave it as None and configure it in esp.yaml, by default None
+        timeout, concurrency, deadline, port, probe_timeout
+            See scan_network
+        limit : int, optional
+            Stop after <limit> ESPs were found, by default None
+        name : str, optional
+            Stop when the ESP with the unit name <name> was found. If it is already registered, it is yielded without
+            scanning. By default None
+
+        Yields
+        -------
+        AsyncESP
+            The AsyncESPs that were added by this scan
+        """
+
+        if name is not None and name in cls._name_ip_map:
+            yield cls.get(name)
+            return
+        if network == None:
+            network = cls._configured_network()
+            if network == None:
+                return
+        count = 0
+        scan = cls._scan(network, timeout, concurrency, deadline, port, probe_timeout)
+        try:
+            async for host, esp in scan:
+                yield esp
+                count += 1
+                if (limit is not None and count >= limit) or (name is not None and esp.name == name):
+                    return
+        finally:
+            await scan.aclose()
+
+    @classmethod
+    async def _scan(cls, network: ipaddress.IPv4Network, timeout: float, concurrency: int, deadline: float,
+                    port: int, probe_timeout: float) -> AsyncIterator[tuple]:
+        """Internal async generator that runs the scan and yields (host, AsyncESP) as soon as an ESP was added
+
+        Every worker probes a host on <port> and only asks it for /json if it accepted the connection.
+        """
+
+        address = "{host}" if port == 80 else "{host}:" + str(port)
+        hosts = iter(network.hosts())
+        found = asyncio.Queue()
+
+        async def worker(transport):
+            for host in hosts:
+                if not await async_probe_host(host, port=port, timeout=probe_timeout):
+                    continue
+                esp = await cls._connect_validate_ipv4_address(address.format(host=host), timeout, transport)
+                if esp is not None:
+                    found.put_nowait((host, esp))
+
+        async def scan(transport):
+            try:
+                await asyncio.wait_for(asyncio.gather(*(worker(transport) for _ in range(concurrency))), deadline)
+            except asyncio.TimeoutError:
+                logger.warning(f"Scan of {network} stopped after reaching the deadline of {deadline}s")
+            finally:
+                found.put_nowait(None)
+
+        async with AsyncTransport(limit=concurrency, pool_size=1, timeout=timeout) as scan_transport:
+            task = asyncio.ensure_future(scan(scan_transport))
+            try:
+                while True:
+                    item = await found.get()
+                    if item is None:
+                        break
+                    yield item
+                task.result()
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    @classmethod
+    async def _connect_validate_ipv4_address(cls, host: str, timeout: float, transport: AsyncTransport):
+        """Internal function to request <host>/json and check if the answer is ESPEasy-like"""
+        try:
+            url = f"http://{host}/json"
+            if instrumentation.enabled:
+                answer = await instrumentation.acall(host, "json", transport.get, url, timeout=timeout)
+            else:
+                answer = await transport.get(url, timeout=timeout)
+            state = State(answer.content)
+            name = state.unit_name
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError, AttributeError, TypeError) as error:
+            logger.debug(f"did not find a device at {host}: {error!r}")
+            return None
+        if not name:
+            return None
+        if name in cls._name_ip_map:
+            logger.info(
+                f"{name} already exists. Please rename the ESPEasy device at {host} and scan again.")
+            return None
+        esp = cls(host, state=state)
+        cls._name_ip_map.update({name: esp.ip})
+        cls._device_register.update({esp.ip: esp})
+        try:
+            # the settings store reads files or a database, which must not block the event loop
+            await asyncio.to_thread(esp.load_settings)
+        except Exception as e:
+            logger.exception(f"An Exception occured: {e}")
+        return esp
@@ -0,0 +1,188 @@
+"""Circuit breaker and adaptive timeouts per ESP
+
+Every ESP has a CircuitBreaker that measures the round trip time of its requests. The timeout of a request is
+derived from it like the retransmission timeout of TCP (RFC 6298): smoothed rtt + 4 * rtt variance, so a healthy ESP
+that answers in 50 ms is given up after a fraction of a second instead of the full timeout of the transport.
+
+After <failure_threshold> failed requests in a row the circuit opens and all requests fail immediately with
+espisy.errors.CircuitOpenError. After <reset_timeout> seconds one request is let through as probe (half-open). If it
+succeeds the circuit closes, otherwise it opens again and the reset timeout doubles up to <max_reset_timeout>.
+"""
+
+import threading
+import time
+
+from .errors import CircuitOpenError
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker():
+    """Tracks the health and round trip time of one ESP"""
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 5, max_reset_timeout: float = 300,
+                 adaptive_timeout: bool = True, min_timeout: float = 1, min_samples: int = 3):
+        """Initializing the breaker
+
+        Parameters
+        ----------
+        failure_threshold : int, optional
+            Number of failed requests in a row that open the circuit. None never opens it, by default 3
+        reset_timeout : float, optional
+            Seconds until an open circuit lets a probe through, by default 5
+        max_reset_timeout : float, optional
+            Upper limit of the reset timeout, which doubles with every failed probe, by default 300
+        adaptive_timeout : bool, optional
+            Derive the timeout of requests from the measured round trip times, by default True
+        min_timeout : float, optional
+            Lower limit of the adaptive timeout in seconds, by default 1
+        min_samples : int, optional
+            Number of successful requests before the adaptive timeout is used, by default 3
+        """
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.adaptive_timeout = adaptive_timeout
+        self.min_timeout = min_timeout
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._open_for = reset_timeout
+        self._probing = False
+        self._samples = 0
+        self._srtt = None
+        self._rttvar = None
+        self._backoff = 1
+
+    def __repr__(self):
+        return f"CircuitBreaker(state={self.state!r}, failures={self._failures}, srtt={self._srtt})"
+
+    @property
+    def state(self) -> str:
+        """Returns "closed", "open" or "half_open". An open circuit whose reset timeout passed is half-open."""
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self._open_for:
+            return HALF_OPEN
+        return self._state
+
+    @property
+    def available(self) -> bool:
+        """Returns False while requests would fail immediately. Schedulers can skip the ESP until then."""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            return state == CLOSED or (state == HALF_OPEN and not self._probing)
+
+    @property
+    def retry_after(self) -> float:
+        """Returns the seconds until the next probe is let through, 0 if requests are let through now"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0
+            return max(0, self._opened_at + self._open_for - time.monotonic())
+
+    @property
+    def failures(self) -> int:
+        """Returns the number of failed requests in a row"""
+        return self._failures
+
+    @property
+    def rtt(self) -> float:
+        """Returns the smoothed round trip time in seconds or None if nothing was measured yet"""
+        return self._srtt
+
+    def timeout(self, default: float = None) -> float:
+        """Returns the timeout for the next request
+
+        Parameters
+        ----------
+        default : float, optional
+            Timeout of the transport, the upper limit of the adaptive timeout, by default None
+
+        Returns
+        -------
+        float
+            The adaptive timeout or <default> if there are not enough measurements
+        """
+
+        if not self.adaptive_timeout or self._samples < self.min_samples:
+            return default
+        timeout = max(self.min_timeout, self._srtt + 4 * self._rttvar) * self._backoff
+        if default is not None:
+            timeout = min(timeout, default)
+        return timeout
+
+    def before_request(self):
+        """Raises CircuitOpenError if the request has to fail fast. Lets one probe through a half-open circuit."""
+
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            retry_after = max(0, self._opened_at + self._open_for - time.monotonic())
+        raise CircuitOpenError(f"Circuit open after {self._failures} failed requests", retry_after=retry_after)
+
+    def record_success(self, seconds: float):
+        """Records a successful request that took <seconds> and closes the circuit"""
+
+        with self._lock:
+            if self._srtt is None:
+                self._srtt = seconds
+                self._rttvar = seconds / 2
+            else:
+                self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - seconds)
+                self._srtt = 0.875 * self._srtt + 0.125 * seconds
+            self._samples += 1
+            self._backoff = 1
+            self._failures = 0
+            self._state = CLOSED
+            self._probing = False
+            self._open_for = self.reset_timeout
+
+    def record_failure(self, timeout: bool = False):
+        """Records a failed request and opens the circuit after too many failures
+
+        Parameters
+        ----------
+        timeout : bool, optional
+            True if the request timed out. The adaptive timeout is doubled until the next success, by default False
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._failures += 1
+            if timeout:
+                self._backoff = min(self._backoff * 2, 64)
+            if self._probing:
+                # the probe of a half-open circuit failed
+                self._probing = False
+                self._open_for = min(self._open_for * 2, self.max_reset_timeout)
+                self._state, self._opened_at = OPEN, now
+            elif self.failure_threshold is not None and self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self._state, self._opened_at = OPEN, now
+
+    def record_cancelled(self):
+        """Records a request that was cancelled before it finished. A half-open circuit lets the next probe through."""
+        with self._lock:
+            self._probing = False
+
+    def reset(self):
+        """Closes the circuit and forgets the failures"""
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+            self._open_for = self.reset_timeout
+            self._backoff = 1
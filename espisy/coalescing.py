@@ -0,0 +1,215 @@
+"""Last-write-wins coalescing of the commands of an ESP
+
+With write coalescing enabled (ESP(..., coalesce_writes=True)), the commands of an ESP return a Future instead of the
+answer and are sent by a background worker, one after another. While a command waits, a newer command for the same
+target replaces it:
+
+* GPIO,<pin>,<value> replaces every pending command of the pin, gpiotoggle,<pin> inverts it. Two pending toggles
+  cancel out and no request is sent.
+* LCD,<row>,<column>,<text> replaces the pending text of the same length at the same row and column.
+* LCDCMD,on and LCDCMD,off replace each other, repeated LCDCMD,clear are sent once.
+* The same for the OLED and OLEDCMD commands of the SSD1306 plugin.
+
+All other commands are never merged, but keep their place in the order. A command that replaced another one moves to
+the end of the queue, so the ESP always ends up in the state of the last command. The futures of merged commands
+resolve with the answer of the request that was finally sent (None if no request was necessary).
+A command whose futures were all cancelled while it waited is not sent.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool of the workers of all coalescers. It is created on first use."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="espisy-writes")
+    return _executor
+
+
+def command_key(path: str):
+    """Returns the target of a command that can be merged with other commands for it, or None"""
+
+    if not path.startswith("control?cmd="):
+        return None
+    args = path[12:].split(",", 3)
+    command = args[0].lower()
+    if command in ("lcd", "oled") and len(args) > 3:
+        # a shorter text would leave the end of the replaced text on the display
+        return (command, args[1], args[2], len(args[3]))
+    if command in ("lcdcmd", "oledcmd") and len(args) == 2:
+        argument = args[1].lower()
+        if argument in ("on", "off"):
+            return (command, "light")
+        if argument == "clear":
+            return (command, "clear")
+    return None
+
+
+class _PendingWrite():
+    """A command that waits for the worker, with the futures of all commands it replaced"""
+
+    __slots__ = ("path", "parse", "futures", "pin", "value", "toggles")
+
+    def __init__(self, path: str = None, parse: Callable = None):
+        self.path = path
+        self.parse = parse
+        self.futures = []
+        self.pin = None
+        self.value = None
+        self.toggles = 0
+
+
+class WriteCoalescer():
+    """Queue of the pending commands of one ESP"""
+
+    def __init__(self, send: Callable):
+        """Initializing the coalescer
+
+        Parameters
+        ----------
+        send : Callable
+            Function that sends a request for a path and returns the answer, e.g. ESP._get
+        """
+
+        self.send = send
+        self.merged = 0
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._running = False
+        self._idle = threading.Event()
+        self._idle.set()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, path: str, parse: Callable, key=None) -> Future:
+        """Queues a command
+
+        Parameters
+        ----------
+        path : str
+            Everything that comes behind http://<ip>/
+        parse : Callable
+            Function that turns the answer into the result of the future
+        key : optional
+            Target of the command. A pending command with the same key is replaced. By default command_key(path).
+
+        Returns
+        -------
+        Future
+            Resolves with the parsed answer when the command (or a command that replaced it) was sent
+        """
+
+        if key is None:
+            key = command_key(path)
+        if key is None:
+            # never merged, every command gets its own key
+            key = object()
+        future = Future()
+        with self._lock:
+            write = self._take(key)
+            write.path, write.parse = path, parse
+            write.pin, write.value, write.toggles = None, None, 0
+            write.futures.append(future)
+            self._pending[key] = write
+            self._start()
+        return future
+
+    def gpio(self, pin: int, value: int = None) -> Future:
+        """Queues GPIO,<pin>,<value> or gpiotoggle,<pin> if <value> is None
+
+        Returns
+        -------
+        Future
+            Resolves with the answer to the command that was finally sent for the pin
+        """
+
+        future = Future()
+        with self._lock:
+            write = self._take(("gpio", pin))
+            if write.pin is None:
+                # a new pending write for the pin
+                write.pin, write.value, write.toggles = pin, None, 0
+            if value is not None:
+                write.value, write.toggles = 1 if value else 0, 0
+            elif write.value is not None:
+                write.value = 1 - write.value
+            else:
+                write.toggles += 1
+            write.futures.append(future)
+            self._pending[("gpio", pin)] = write
+            self._start()
+        return future
+
+    def _take(self, key) -> _PendingWrite:
+        """Internal function that removes and returns the pending write of <key>. Must be called with the lock."""
+        write = self._pending.pop(key, None)
+        if write is None:
+            return _PendingWrite()
+        self.merged += 1
+        return write
+
+    def _start(self):
+        """Internal function that starts the worker if it is not running. Must be called with the lock."""
+        if not self._running:
+            self._running = True
+            self._idle.clear()
+            _get_executor().submit(self._work)
+
+    def _work(self):
+        """Internal function that sends the pending writes until there are none left"""
+
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._running = False
+                    self._idle.set()
+                    return
+                key, write = self._pending.popitem(last=False)
+            try:
+                # cancelled futures are dropped, the others can no longer be cancelled
+                futures = [future for future in write.futures if future.set_running_or_notify_cancel()]
+                if not futures:
+                    logger.debug(f"Dropped {write.path or f'the write of GPIO {write.pin}'}, it was cancelled")
+                    continue
+                try:
+                    result = self._send(write)
+                except BaseException as e:
+                    for future in futures:
+                        future.set_exception(e)
+                else:
+                    for future in futures:
+                        future.set_result(result)
+            except Exception:
+                # the worker must keep going, otherwise the queue and flush would hang
+                logger.exception(f"Settling the futures of {write.path or write.pin} failed")
+
+    def _send(self, write: _PendingWrite):
+        from .core import _gpio_answer, _json_answer
+
+        if write.pin is None:
+            return write.parse(self.send(write.path))
+        if write.value is not None:
+            return _gpio_answer(self.send(f"control?cmd=GPIO,{write.pin},{write.value}"))
+        if write.toggles % 2:
+            return _json_answer(self.send(f"control?cmd=gpiotoggle,{write.pin}"))
+        # the toggles cancelled out
+        return None
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until all pending writes were sent. Returns False if <timeout> seconds passed before."""
+        return self._idle.wait(timeout)
@@ -1,29 +1,97 @@
+"""Configuration of espisy
+
+The configuration is read lazily on first use, so importing espisy has no side effects.
+The ini file and the settings directory can be overridden with the environment variables ESPISY_CONFIG and
+ESPISY_SETTINGS_DIR or with configure().
+"""
+
 import configparser
 import logging
 import os
-import sys
+import threading
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
-sh = logging.StreamHandler()
-formatter = logging.Formatter(
-    "%(asctime)s %(name)s.%(funcName)s, line %(lineno)s \t %(levelname)s: %(message)s")
-sh.setFormatter(formatter)
-logger.addHandler(sh)
-logger.setLevel(logging.WARNING)
 
 filepath = os.path.dirname(__file__)
 
-# read configuration
-config = configparser.ConfigParser()
-config_file_name = os.path.join(filepath, 'esp.ini')
-logger.debug(f"Trying to read ini file from {config_file_name}")
-_config_correct = config.read(config_file_name)
-if _config_correct:
-    logger.debug(f"read sections:\n {config.sections()}")
-else:
-    sys.exit(f"""\033[91mFATAL: Could not read config file. Please check if {config_file_name} exists and is readable.
-Search for inifile at https://espisy.readthedocs.io for more information\033[0m""")
+_config = None
+_config_file_name = None
+_settings_dir = None
+_config_lock = threading.Lock()
+
+
+def configure(config_file: str = None, settings_dir: str = None):
+    """Overrides the configuration. Values that are not passed are taken from the environment or esp.ini again.
+
+    Parameters
+    ----------
+    config_file : str, optional
+        Path of the ini file, by default $ESPISY_CONFIG or the esp.ini of the package
+    settings_dir : str, optional
+        Directory of esp.yaml and other save files, by default $ESPISY_SETTINGS_DIR or file_dir of the ini file
+    """
+
+    global _config, _config_file_name, _settings_dir
+    with _config_lock:
+        _config = None
+        _config_file_name = config_file
+        _settings_dir = settings_dir
+
+
+def get_config_file_name() -> str:
+    """Returns the path of the ini file"""
+    if _config_file_name is not None:
+        return _config_file_name
+    return os.environ.get("ESPISY_CONFIG") or os.path.join(filepath, 'esp.ini')
+
+
+def get_config() -> configparser.ConfigParser:
+    """Returns the configuration and reads the ini file on first use
+
+    If the ini file cannot be read, a warning is logged and the defaults are used.
+    """
+
+    global _config
+    with _config_lock:
+        if _config is None:
+            config = configparser.ConfigParser(defaults={"file_dir": "default"})
+            config_file_name = get_config_file_name()
+            logger.debug(f"Trying to read ini file from {config_file_name}")
+            if config.read(config_file_name):
+                logger.debug(f"read sections:\n {config.sections()}")
+            else:
+                logger.warning(f"Could not read config file {config_file_name}. Using the default configuration. "
+                               "Search for inifile at https://espisy.readthedocs.io for more information")
+            if not config.has_section("USER_SETTINGS"):
+                config.add_section("USER_SETTINGS")
+            _config = config
+        return _config
+
+
+def get_settings_dir() -> str:
+    """Returns the directory for esp.yaml and other save files. Set to the home directory on default"""
+    settings_dir = _settings_dir or os.environ.get("ESPISY_SETTINGS_DIR")
+    if not settings_dir:
+        settings_dir = get_config().get("USER_SETTINGS", "file_dir")
+    if settings_dir == "default":
+        settings_dir = os.path.join(Path.home(), ".espisy")
+    return settings_dir
+
+
+def get_settings_file_name() -> str:
+    """Returns the path of esp.yaml"""
+    return os.path.join(get_settings_dir(), "esp.yaml")
+
+
+def __getattr__(name):
+    # config and config_file_name used to be read at import time. They are still available, but read on first use.
+    if name == "config":
+        return get_config()
+    if name == "config_file_name":
+        return get_config_file_name()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # Dummy values:
 test_ip = "127.0.0.1"
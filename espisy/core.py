@@ -1,34 +1,95 @@
 """ESP Module to virtualize ESPEasy devices"""
 
-import os
-from pathlib import Path
 import json
 import logging
 import ipaddress
+import itertools
+import re
 import threading
-from typing import Union
-
-import requests
-import yaml
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Iterator, Union
 
 from .devices import Device
+from .transport import Transport, get_default_transport
+from .network import iter_probe_port
+from .settings import SettingsStore, YAMLSettingsStore
+from .state import State
+from .subscriptions import Change, Subscription, Subscriptions
+from .instrumentation import instrumentation, is_timeout
+from .breaker import CircuitBreaker
+from .scheduler import RequestScheduler
+from .coalescing import WriteCoalescer
+from .gpiocache import GPIOCache, may_change_gpios
 from .errors import ESPNotFoundError, NoGPIOError
-from .constants import config
+from .constants import get_settings_dir, get_settings_file_name
 
 
 logger = logging.getLogger(__name__)
-sh = logging.StreamHandler()
-formatter = logging.Formatter(
-    "%(asctime)s %(name)s.%(funcName)s, line %(lineno)s \t %(levelname)s: %(message)s")
-sh.setFormatter(formatter)
-logger.addHandler(sh)
-logger.setLevel(logging.DEBUG)
 
-# Extract the filename for settings from the config. Set to Home directory on default
-settings_dir = config.get("USER_SETTINGS", "file_dir")
-if settings_dir == "default":
-    settings_dir = os.path.join(Path.home(), ".espisy")
-settings_file_name = os.path.join(settings_dir, "esp.yaml")
+
+def __getattr__(name):
+    # settings_dir and settings_file_name used to be computed at import time. They are now read on first use.
+    if name == "settings_dir":
+        return get_settings_dir()
+    if name == "settings_file_name":
+        return get_settings_file_name()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _json_error(answer):
+    """Counts an answer that was no valid json, if the instrumentation is enabled"""
+    if instrumentation.enabled:
+        instrumentation.count_url(answer.url, "json_errors")
+
+
+def _state_answer(answer) -> State:
+    """Returns the State of a /json answer. Raises ValueError if the answer is no valid json"""
+    try:
+        return State(answer.content)
+    except ValueError:
+        _json_error(answer)
+        raise
+
+
+def _json_answer(answer):
+    """Returns the json of an answer or its text if ESPEasy did not send valid json"""
+    try:
+        return answer.json()
+    except json.JSONDecodeError as e:
+        _json_error(answer)
+        logger.info(f"Could not encode answer to json. ({e})")
+        return answer.text
+
+
+def _gpio_answer(answer):
+    """Returns the state from the answer to a GPIO command or the text if ESPEasy did not send valid json"""
+    try:
+        return answer.json()["state"]
+    except json.JSONDecodeError as e:
+        _json_error(answer)
+        logger.warning(f"An error occured. Could not verify json data: {e}")
+        return answer.text
+
+
+_STATE_PATTERN = re.compile(r'"state":\s*(-?\d+)')
+
+
+def _gpio_status_answer(answer):
+    """Returns the state from the answer to status,gpio,<gpio>
+
+    At the moment (V0.3.0) the JSON answer from ESPEasy is broken. The state is cut out of the text instead.
+    """
+    try:
+        return answer.json()["state"]
+    except json.JSONDecodeError as e:
+        _json_error(answer)
+        # expected with the broken answer, so no warning
+        logger.debug(f"Could not verify json data: {e}")
+        match = _STATE_PATTERN.search(answer.text)
+        if match is None:
+            return answer.text
+        return int(match.group(1))
 
 
 class ESP():
@@ -36,36 +97,324 @@ class ESP():
 
     _device_register = {}
     _name_ip_map = {}
+    _register_lock = threading.RLock()
+    settings_store = None
+    subscriptions = Subscriptions()
 
-    def __init__(self, ip: str):
+    def __init__(self, ip: str, transport: Transport = None, state: Union[State, bytes, dict] = None,
+                 cache: bool = False, breaker: CircuitBreaker = None, scheduler: RequestScheduler = None,
+                 coalesce_writes: bool = False, gpio_max_age: float = 0):
         """Initializing the ESP
 
         Parameters
         ----------
         ip : str
             The local ip where the ESP is reachable.
+        transport : Transport, optional
+            Pooled HTTP transport used for all requests to the ESP, by default the shared transport
+        state : dict, optional
+            An already fetched /json answer of the ESP. If it is not passed, the state is refreshed.
+        cache : bool, optional
+            If True, refresh only requests /json when the state is older than the TTL of the ESP, by default False
+        breaker : CircuitBreaker, optional
+            Circuit breaker and adaptive timeout of the ESP, by default a espisy.breaker.CircuitBreaker with its
+            default settings
+        scheduler : RequestScheduler, optional
+            Limits the requests in flight to the ESP and coalesces reads, by default a
+            espisy.scheduler.RequestScheduler with 2 requests in flight
+        coalesce_writes : bool, optional
+            If True, commands return a concurrent.futures.Future and pending commands for the same GPIO or display
+            position are merged, so only the last one is sent. See espisy.coalescing. By default False
+        gpio_max_age : float, optional
+            Seconds gpio_state and gpio_states answer from the states seen in the answers of earlier GPIO commands
+            instead of requesting them. See espisy.gpiocache. By default 0, the states are always requested
         """
 
         self.ip = ip
+        self.transport = transport if transport is not None else get_default_transport()
+        self.cache = cache
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self._refresh_lock = threading.Lock()
+        self._init_state()
+        self.gpio_cache = GPIOCache(gpio_max_age)
+        if coalesce_writes:
+            self._coalescer = WriteCoalescer(self._get)
+        if state is None:
+            self.refresh()
+        else:
+            self._update_state(state)
+        self.name = self._state.unit_name
+
+    def _init_state(self):
+        """Initializes the stored state, its index and the devices. Shared by ESP and AsyncESP."""
+
         self._state = None
+        self._coalescer = None
+        self._tasks = {}
+        self._task_names = {}
+        self._refreshed_at = None
+        self._pushed_at = {}
+        self._refresh_in_flight = None
+        self._history_capacity = None
+        self._history_tasks = None
+        self._histories = {}
         self._devices = []
-        self.refresh()
-        self.name = self._state["System"]["Unit Name"]
 
-    def refresh(self):
-        """Refreshes the state of the esp by requesting http://<self.ip>/json."""
+    def refresh(self, max_age: float = None):
+        """Refreshes the state of the esp by requesting http://<self.ip>/json.
+
+        If several threads refresh the same ESP at once, they share a single request.
+
+        Parameters
+        ----------
+        max_age : float, optional
+            Only refresh if the state is older than <max_age> seconds. By default the TTL of the ESP if caching is
+            enabled, otherwise the state is always refreshed.
+        """
+
+        if max_age is None and self.cache:
+            max_age = self.ttl
+        if max_age is not None and self.age is not None and self.age < max_age:
+            return
+        with self._refresh_lock:
+            in_flight = self._refresh_in_flight
+            if in_flight is None:
+                future = self._refresh_in_flight = Future()
+        if in_flight is not None:
+            in_flight.result()
+            return
+        try:
+            self._update_state(_state_answer(self._get("json")))
+            future.set_result(None)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._refresh_lock:
+                self._refresh_in_flight = None
+
+    @property
+    def age(self) -> float:
+        """Returns the time in seconds since the state was fetched or None if there is no state"""
+        if self._refreshed_at is None:
+            return None
+        return time.monotonic() - self._refreshed_at
+
+    @property
+    def ttl(self) -> float:
+        """Returns the time in seconds the state stays valid, taken from the TTL field of the json output"""
+        if self._state is None:
+            return 0
+        return self._state.get("TTL", 0) / 1000
+
+    def _update_state(self, state: Union[State, bytes, dict]):
+        """Stores a new /json answer and builds the task index used by the devices
+
+        The answer is stored as compact espisy.state.State.
+        The index maps TaskName -> (task, {ValueName: value}) and lowercase TaskName -> task.
+        It is built once per refresh, so that reading a device value does not search the state.
+        """
+
+        state = State.from_json(state)
+        tasks = {}
+        task_names = {}
+        for task in state.sensors:
+            # like a linear search, the first task and value with a name wins
+            name = task.name
+            if name not in tasks:
+                tasks[name] = (task, {value.name: value for value in reversed(task.values)})
+            task_names.setdefault(str(name).lower(), task)
+        previous_tasks = self._tasks if self._state is not None else None
+        self._state = state
+        self._tasks = tasks
+        self._task_names = task_names
+        self._refreshed_at = time.monotonic()
+        if self._history_capacity is not None:
+            self._record_history(tasks)
+        if previous_tasks is not None:
+            self.subscriptions.publish(self, previous_tasks, tasks)
+
+    def subscribe(self, callback: Callable, device: str = None, value: str = None) -> Subscription:
+        """Calls <callback> with a espisy.subscriptions.Change for every value of the ESP that changed on a refresh
+
+        The callback runs in the thread (or event loop) that refreshed the ESP, so it should return quickly.
+        Values pushed to espisy.push.PushReceiver are published as well, from the thread of the receiver.
+
+        Parameters
+        ----------
+        callback : Callable
+            Function that takes a Change(esp, device, value, old, new)
+        device : str, optional
+            Only changes of this device (TaskName), by default all devices
+        value : str, optional
+            Only changes of this value, e.g. "Temperature", by default all values
+
+        Returns
+        -------
+        Subscription
+            Call its cancel() to unsubscribe
+        """
+
+        return self.subscriptions.add(callback, ip=self.ip, device=device, value=value)
+
+    @ classmethod
+    def subscribe_all(cls, callback: Callable, device: str = None, value: str = None) -> Subscription:
+        """Like subscribe, but for the changes of all ESPs
+
+        Parameters
+        ----------
+        callback : Callable
+            Function that takes a Change(esp, device, value, old, new)
+        device : str, optional
+            Only changes of devices with this TaskName, by default all devices
+        value : str, optional
+            Only changes of this value, e.g. "Temperature", by default all values
+
+        Returns
+        -------
+        Subscription
+            Call its cancel() to unsubscribe
+        """
+
+        return cls.subscriptions.add(callback, device=device, value=value)
+
+    def record_history(self, capacity: int = 8640, tasks: list = None):
+        """Records the values of the ESP in a espisy.history.History on every refresh
+
+        Each value gets a fixed-capacity buffer that is allocated once. Requires numpy.
+        Access the buffers with Device.history(<value name>).
+
+        Parameters
+        ----------
+        capacity : int, optional
+            Number of samples per value, by default 8640 (24h with one refresh per 10s)
+        tasks : list, optional
+            TaskNames whose values are recorded, by default all
+        """
+
+        self._history_capacity = capacity
+        self._history_tasks = None if tasks is None else set(tasks)
+        self._record_history(self._tasks)
+
+    def _record_history(self, tasks: dict):
+        """Internal function that appends the values of all recorded tasks to their histories"""
+
+        from .history import History
+
+        now = time.time()
+        for task_name, (task, values) in tasks.items():
+            if self._history_tasks is not None and task_name not in self._history_tasks:
+                continue
+            for value_name, value in values.items():
+                history = self._histories.get((task_name, value_name))
+                if history is None:
+                    history = self._histories[(task_name, value_name)] = History(self._history_capacity)
+                try:
+                    history.append(value.value, now)
+                except (TypeError, ValueError):
+                    # values that are not numbers, e.g. MQTT messages, are not recorded
+                    pass
+
+    def update_value(self, device: str, value_name: str, value) -> bool:
+        """Stores a single value that was pushed by the ESP, e.g. received by espisy.push.PushReceiver
+
+        The value is updated in place in the stored state, so the devices read it at once. Subscribers get the
+        change and a recorded history gets the sample, like on a refresh.
+
+        Parameters
+        ----------
+        device : str
+            TaskName of the device
+        value_name : str
+            Name of the value, e.g. "Temperature"
+        value
+            The new value
+
+        Returns
+        -------
+        bool
+            False if the state has no such device or value. Call refresh to fetch new tasks.
+        """
 
-        self._state = requests.get(f"http://{self.ip}/json").json()
+        task = self._tasks.get(device)
+        if task is None:
+            return False
+        task_value = task[1].get(value_name)
+        if task_value is None:
+            return False
+        old = task_value.value
+        task_value.value = value
+        self._pushed_at[device] = time.monotonic()
+        if self._history_capacity is not None and (self._history_tasks is None or device in self._history_tasks):
+            self._record_history({device: (task[0], {value_name: task_value})})
+        if old != value:
+            self.subscriptions.dispatch(self.ip, [Change(self, device, value_name, old, value)])
+        return True
+
+    def _get(self, path: str, timeout: float = None) -> "requests.Response":
+        """Sends a GET request for http://<self.ip>/<path> over the pooled transport
+
+        The request is queued by the scheduler of the ESP and guarded by its circuit breaker.
+
+        Parameters
+        ----------
+        path : str
+            Everything that comes behind http://<self.ip>/
+        timeout : float, optional
+            Timeout in seconds, by default the adaptive timeout of the breaker or the timeout of the transport
+
+        Returns
+        -------
+        requests.Response
+            The response of the ESP
+
+        Raises
+        ------
+        CircuitOpenError
+            If the circuit of the ESP is open
+        """
+
+        return self.scheduler.request(path, self._request, path, timeout)
+
+    def _request(self, path: str, timeout: float = None) -> "requests.Response":
+        """Internal function that sends the request of _get once the scheduler lets it through"""
+
+        url = f"http://{self.ip}/{path}"
+        breaker = self.breaker
+        breaker.before_request()
+        if timeout is None:
+            timeout = breaker.timeout(getattr(self.transport, "timeout", None))
+        start = time.perf_counter()
+        try:
+            if instrumentation.enabled:
+                answer = instrumentation.call(self.ip, path, self.transport.get, url, timeout=timeout)
+            else:
+                answer = self.transport.get(url, timeout=timeout)
+        except Exception as error:
+            breaker.record_failure(timeout=is_timeout(error))
+            raise
+        except BaseException:
+            breaker.record_cancelled()
+            raise
+        breaker.record_success(time.perf_counter() - start)
+        return answer
 
     @property
-    def state(self) -> dict:
+    def healthy(self) -> bool:
+        """Returns False while the circuit of the ESP is open and requests fail immediately"""
+        return self.breaker.available
+
+    @property
+    def state(self) -> State:
         """Returns the state of the device.
 
-        The method does not refresh via http request, but uses the stored information
+        The method does not refresh via http request, but uses the stored information.
+        The state is a compact espisy.state.State that can be used like the dict of the json output.
 
         Returns
         -------
-        dict
+        State
             self._state
         """
         return self._state
@@ -96,20 +445,15 @@ class ESP():
         Returns
         -------
         dict
-            Answer of the ESP as json.
+            Answer of the ESP as json. With write coalescing a Future of it.
         """
 
         if gpio == None:
             raise NoGPIOError
-        cmd_url = f"http://{self.ip}/control?cmd=GPIO,{gpio},1"
-        answer = requests.get(cmd_url)
-        try:
-            answer = answer.json()
-            return answer["state"]
-        except json.decoder.JSONDecodeError as e:
-            print(f"An error occured. Could not verify json data: {e}")
-            answer = answer.text
-            return answer
+        if self._coalescer is not None:
+            return self._coalesce_gpio(gpio, 1)
+        cmd_url = f"control?cmd=GPIO,{gpio},1"
+        return self._gpio_written(gpio, _gpio_answer(self._get(cmd_url)))
 
     def gpio_off(self, gpio: int) -> dict:
         """Turn a GPIO off. This is a very basic function. If you want to access an ESPEasy switch use on, off or toggle instead.
@@ -122,35 +466,33 @@ class ESP():
         Returns
         -------
         str
-            Answer of the ESP as json.
+            Answer of the ESP as json. With write coalescing a Future of it.
         """
 
         if gpio == None:
             raise NoGPIOError
-        cmd_url = f"http://{self.ip}/control?cmd=GPIO,{gpio},0"
-        answer = requests.get(cmd_url)
-        try:
-            answer = answer.json()
-            return answer["state"]
-        except json.decoder.JSONDecodeError as e:
-            print(f"An error occured. Could not verify json data: {e}")
-            answer = answer.text
-            return answer
-
-    def gpio_state(self, gpio: int) -> dict:
+        if self._coalescer is not None:
+            return self._coalesce_gpio(gpio, 0)
+        cmd_url = f"control?cmd=GPIO,{gpio},0"
+        return self._gpio_written(gpio, _gpio_answer(self._get(cmd_url)))
+
+    def gpio_state(self, gpio: int, max_age: float = None) -> int:
         """Returns the state of the given GPIO
 
-        Normally returns dict. At the moment (V0.3.0) the JSON answer from ESPEasy is broken. Will return str instead
+        At the moment (V0.3.0) the JSON answer from ESPEasy is broken. The state is read from the text instead.
 
         Parameters
         ----------
         gpio : int
             GPIO number
+        max_age : float, optional
+            Answer from the GPIO cache if the state is younger than <max_age> seconds, by default the max_age of
+            self.gpio_cache
 
         Returns
         -------
-        dict
-            JSON answer from ESPEasy
+        int
+            State of the GPIO (the text of the answer if it contains no state)
 
         Raises
         ------
@@ -160,16 +502,79 @@ class ESP():
 
         if gpio == None:
             raise NoGPIOError
-        cmd_url = f"http://{self.ip}/control?cmd=status,gpio,{gpio}"
-        answer = requests.get(cmd_url)
-        try:
-            answer = answer.json()
-            return answer["state"]
-        except json.decoder.JSONDecodeError as e:
-            print(f"An error occured. Could not verify json data: {e}")
-            answer = answer.text
-            start = answer.find('"state": ')+9
-            return answer[start:start+1]
+        if self._coalescer is not None:
+            # the state has to include the pending writes
+            self._coalescer.flush()
+        state = self.gpio_cache.get(gpio, max_age)
+        if state is None:
+            state = self._fetch_gpio_state(gpio)
+        return state
+
+    def gpio_states(self, gpios: list, max_age: float = None) -> dict:
+        """Returns the states of several GPIOs
+
+        Only the states that are not in the GPIO cache are requested, concurrently up to the number of requests in
+        flight the scheduler allows for the ESP.
+
+        Parameters
+        ----------
+        gpios : list
+            GPIO numbers
+        max_age : float, optional
+            Answer from the GPIO cache if a state is younger than <max_age> seconds, by default the max_age of
+            self.gpio_cache
+
+        Returns
+        -------
+        dict
+            {gpio: state} in the order of <gpios>
+
+        Raises
+        ------
+        NoGPIOError
+            If one of the GPIOs is None
+        """
+
+        gpios = list(dict.fromkeys(gpios))
+        if None in gpios:
+            raise NoGPIOError
+        if self._coalescer is not None:
+            self._coalescer.flush()
+        states = {gpio: self.gpio_cache.get(gpio, max_age) for gpio in gpios}
+        missing = [gpio for gpio, state in states.items() if state is None]
+        if len(missing) == 1:
+            states[missing[0]] = self._fetch_gpio_state(missing[0])
+        elif missing:
+            workers = min(len(missing), self.scheduler.max_concurrency)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="espisy-gpio") as executor:
+                for gpio, state in zip(missing, executor.map(self._fetch_gpio_state, missing)):
+                    states[gpio] = state
+        return states
+
+    def _fetch_gpio_state(self, gpio: int):
+        """Internal function that requests the state of a GPIO and stores it in the GPIO cache"""
+        state = _gpio_status_answer(self._get(f"control?cmd=status,gpio,{gpio}"))
+        self.gpio_cache.update(gpio, state)
+        return state
+
+    def _gpio_written(self, gpio: int, answer):
+        """Internal function that stores the state from the answer to a GPIO command and returns the answer"""
+        self.gpio_cache.update(gpio, answer)
+        return answer
+
+    def _coalesce_gpio(self, gpio: int, value: int = None) -> Future:
+        """Internal function that queues a GPIO command in the write coalescer and updates the GPIO cache when it was
+        sent"""
+
+        def written(future):
+            if future.cancelled() or future.exception() is not None:
+                self.gpio_cache.invalidate(gpio)
+            elif future.result() is not None:
+                self.gpio_cache.update(gpio, future.result())
+
+        future = self._coalescer.gpio(gpio, value)
+        future.add_done_callback(written)
+        return future
 
     def _toggle(self, gpio: int) -> dict:
         """Toggles a switch or GPIO
@@ -185,6 +590,7 @@ class ESP():
         -------
         dict
             JSON answer from ESPEasy. (If JSON answer from ESPEasy is broken, returns string)
+            With write coalescing a Future of it. Pending toggles of the same GPIO cancel out.
 
         Raises
         ------
@@ -193,17 +599,12 @@ class ESP():
         """
 
         if gpio == None:
-            raise NoGPIOError(f"No GPIO mapped to the switch {switch}")
+            raise NoGPIOError("No GPIO mapped to the switch")
+        elif self._coalescer is not None:
+            return self._coalesce_gpio(gpio)
         else:
-            cmd_url = f"http://{self.ip}/control?cmd=gpiotoggle,{gpio}"
-            answer = requests.get(cmd_url)
-            try:
-                answer = answer.json()
-                return answer
-            except json.JSONDecoder.JSONDecodeError as e:
-                logger.info(f"Could not encode answer to json. ({e})")
-                answer = answer.text
-                return answer
+            cmd_url = f"control?cmd=gpiotoggle,{gpio}"
+            return self._gpio_written(gpio, _json_answer(self._get(cmd_url)))
 
     def device(self, device_name: str, **kwargs) -> Device:
         """Create a device
@@ -235,31 +636,25 @@ class ESP():
         return device
 
     def save_settings(self):
-        """Save the settings to the esp.yaml configuration file
+        """Save the settings to the settings store
 
+        By default the settings are stored in the esp.yaml configuration file.
         The path where the settings should be stored can be defined in esp.ini.
         The standard behaviour for all save files is  ~home/.espisy/
+        Set ESP.settings_store to use another store, e.g. espisy.settings.SQLiteSettingsStore.
         This method overwrites the old settings.
         """
 
-        filename = os.path.join(config.get(
-            "USER_SETTINGS", "file_dir"), "esp.yaml")
-        with open(filename, "r") as save_file:
-            settings = yaml.safe_load(save_file)
-        if "esps" not in settings:
-            settings.update({"esps": []})
-        # Check if the settings have already been saved and update or append the current settings
-        saved_esp_setting = next(((i, dictionary) for i, dictionary in enumerate(
-            settings["esps"]) if self.ip in dictionary), None)
-        if saved_esp_setting == None:
-
-            settings["esps"].append({self.ip: {"devices": [{key: value for key, value in device.items(
-            ) if key != "instance"} for device in self.devices]}})
-        else:
-            settings["esps"][saved_esp_setting[0]].update(
-                {self.ip: {"devices": [{key: value for key, value in device.items() if key != "instance"} for device in self.devices]}})
-        with open(filename, "w") as save_file:
-            yaml.dump(settings, save_file)
+        self.get_settings_store().save(self.ip, self._device_settings())
+
+    def _device_settings(self) -> list:
+        """Returns the settings of all devices without their instances"""
+        return [{key: value for key, value in device.items() if key != "instance"} for device in self.devices]
+
+    def _apply_settings(self, devices: list):
+        """Creates the devices from their saved settings"""
+        for device in devices:
+            self.device(device["name"], device_type=device["device_class"], settings=device["settings"])
 
     def event(self, event: str) -> str:
         """Triggers a event that can be fetched by a rule defined in ESPEasy
@@ -272,11 +667,15 @@ class ESP():
         Returns
         -------
         str
-            HTML response
+            HTML response. With write coalescing a Future of it.
         """
 
-        cmd_url = f"http://{self.ip}/control?cmd=event,{event}"
-        answer = requests.get(cmd_url)
+        cmd_url = f"control?cmd=event,{event}"
+        # rules may change any GPIO
+        self.gpio_cache.invalidate()
+        if self._coalescer is not None:
+            return self._coalescer.submit(cmd_url, lambda answer: answer)
+        answer = self._get(cmd_url)
         return answer
 
     def send_command(self, cmd: str) -> str:
@@ -293,39 +692,69 @@ class ESP():
         Returns
         -------
         str
-            Returns the answer of the ESPEasy device
+            Returns the answer of the ESPEasy device. With write coalescing a Future of it.
         """
 
-        cmd_url = f"http://{self.ip}/{cmd}"
-        answer = requests.get(cmd_url)
-        try:
-            answer = answer.json()
-            return answer
-        except json.JSONDecoder.JSONDecodeError as e:
-            logger.info(f"Could not encode answer to json. ({e})")
-            answer = answer.text
-            return answer
+        if may_change_gpios(cmd):
+            self.gpio_cache.invalidate()
+        if self._coalescer is not None:
+            return self._coalescer.submit(cmd, _json_answer)
+        return _json_answer(self._get(cmd))
+
+    @property
+    def coalesce_writes(self) -> bool:
+        """Returns True if the commands of the ESP are coalesced, see espisy.coalescing"""
+        return self._coalescer is not None
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until all coalesced commands were sent. Returns False if <timeout> seconds passed before.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time to wait in seconds, by default no limit
+        """
+
+        if self._coalescer is None:
+            return True
+        return self._coalescer.flush(timeout)
 
     def load_settings(self):
-        """Try to load settings from esp.yaml
+        """Try to load settings from the settings store
 
         If you created devices, they will be automatically generated with this method.
         This method is automatically invoked by the scan_network method
         """
 
-        filename = os.path.join(config.get(
-            "USER_SETTINGS", "file_dir"), "esp.yaml")
-        with open(filename, "r") as save_file:
-            settings = yaml.safe_load(save_file)
-        try:
-            for esp in settings["esps"]:
-                for ip, details in esp.items():
-                    if ip == self.ip:
-                        for device in details["devices"]:
-                            self.device(
-                                device["name"], device_type=device["device_class"], settings=device["settings"])
-        except KeyError as e:
+        devices = self.get_settings_store().load(self.ip)
+        if devices is None:
             logger.info(f"Could not find settings for ESP devices.")
+            return
+        self._apply_settings(devices)
+
+    @ classmethod
+    def get_settings_store(cls) -> SettingsStore:
+        """Classmethod. Returns the settings store shared by all ESPs, by default a YAMLSettingsStore for esp.yaml"""
+
+        if ESP.settings_store is None:
+            ESP.settings_store = YAMLSettingsStore(get_settings_file_name())
+        return ESP.settings_store
+
+    @ classmethod
+    def save_all(cls):
+        """Classmethod. Saves the settings of all registered ESPs at once"""
+
+        cls.get_settings_store().save_all(
+            {ip: esp._device_settings() for ip, esp in list(cls._device_register.items())})
+
+    @ classmethod
+    def load_all(cls):
+        """Classmethod. Loads the settings of all registered ESPs at once"""
+
+        settings = cls.get_settings_store().load_all()
+        for ip, esp in list(cls._device_register.items()):
+            if ip in settings:
+                esp._apply_settings(settings[ip])
 
     @ classmethod
     def get(cls, ip):
@@ -370,11 +799,12 @@ class ESP():
         """
 
         esp_deleted = cls._device_register.pop(ip)
-        print(cls._name_ip_map.pop(esp_deleted.name))
+        cls._name_ip_map.pop(esp_deleted.name)
+        logger.debug(f"Removed {esp_deleted.name} ({ip})")
         return esp_deleted
 
     @ classmethod
-    def add(cls, ip):
+    def add(cls, ip, transport: Transport = None, state: Union[State, bytes, dict] = None):
         """Classmethod. Should always be used.
 
         Especially necessary if the function of the device register is used.
@@ -383,19 +813,26 @@ class ESP():
         ----------
         ip : str
             ip address of the ESP device
+        transport : Transport, optional
+            Pooled HTTP transport used for all requests to the ESP, by default the shared transport
+        state : dict, optional
+            An already fetched /json answer of the ESP. If it is not passed, /json is requested once.
+
+        Returns
+        -------
+        ESP
+            The ESP that was added
         """
 
-        lock = threading.Lock()
-        lock.acquire()
-        name = requests.get(
-            f"http://{ip}/json").json()["System"]["Unit Name"]
-        cls._name_ip_map.update({name: ip})
-        esp = ESP(ip)
-        cls._device_register.update({ip: esp})
-        lock.release()
+        esp = ESP(ip, transport=transport, state=state)
+        with cls._register_lock:
+            cls._name_ip_map.update({esp.name: ip})
+            cls._device_register.update({ip: esp})
+        return esp
 
     @ classmethod
-    def scan_network(cls, network: ipaddress.IPv4Network = None, timeout=3):
+    def scan_network(cls, network: ipaddress.IPv4Network = None, timeout=3, concurrency: int = 64,
+                     deadline: float = None, port: int = 80, probe_timeout: float = 0.1) -> list:
         """Scans the network for any ESPEasy device and creates ESP instances
 
         The method scans all hosts in the given ipaddress.IPv4Network.
@@ -405,66 +842,180 @@ class ESP():
         not work.**
         Be sure to use the right network. The method does not perform any checks on the network!
 
+        The scan has two phases. First every host is probed with a non-blocking TCP connect on <port>, which takes
+        about <probe_timeout> per 512 hosts. Only the hosts that accepted the connection are asked for their /json
+        answer by a bounded pool of worker threads. At most <concurrency> requests are in flight, independent of the
+        size of the network.
+        Use iter_scan to get the ESPs while the scan is still running. To find ESPs without scanning, listen to their
+        p2p announcements with espisy.discovery.DiscoveryListener.
+
         Parameters
         ----------
         network : ipaddress.IPv4Network, optional
             Pass the network or leave it as None and configure it in esp.yaml, by default None
         timeout : int, optional
-            the time for the request to wait for an answer, by default 1
+            the time for each request to wait for an answer, by default 3
+        concurrency : int, optional
+            Maximum number of worker threads and requests in flight, by default 64
+        deadline : float, optional
+            Time in seconds after which the scan stops. Hosts that were not checked until then are skipped.
+            By default the whole network is scanned.
+        port : int, optional
+            The port of the ESPEasy web server. ESPs with another port than 80 get the ip "<ip>:<port>", by default 80
+        probe_timeout : float, optional
+            Time in seconds that the TCP probe waits for hosts to accept the connection, by default 0.1
+
+        Returns
+        -------
+        list
+            The ESPs that were added by this scan, ordered by their address
         """
 
         # if no network is passed, try to find the network in the configuration file.
         # log and return if not possible.
         if network == None:
-            try:
-                with open(settings_file_name, "r") as f:
-                    ipv4network_string = yaml.safe_load(f)["ipv4network"]
-                if ipv4network_string == None:
-                    logger.error("No subnet is set in the config file.")
-                    return
-                network = ipaddress.ip_network(ipv4network_string)
-            except FileNotFoundError as fnferror:
-                logger.error(f"File {settings_file_name} does not exist")
+            network = cls._configured_network()
+            if network == None:
+                return []
+        found = cls._scan(network, timeout, concurrency, deadline, port, probe_timeout)
+        return [esp for host, esp in sorted(found, key=lambda item: item[0])]
+
+    @ classmethod
+    def iter_scan(cls, network: ipaddress.IPv4Network = None, timeout=3, concurrency: int = 64,
+                  deadline: float = None, port: int = 80, probe_timeout: float = 0.1, limit: int = None,
+                  name: str = None) -> Iterator["ESP"]:
+        """Scans the network like scan_network, but yields every ESP as soon as it was added
+
+        The ESPs are yielded in the order they answered. The scan stops as soon as the generator is closed,
+        e.g. by leaving a for loop with break.
+
+        Parameters
+        ----------
+        network : ipaddress.IPv4Network, optional
+            Pass the network or leave it as None and configure it in esp.yaml, by default None
+        timeout, concurrency, deadline, port, probe_timeout
+            See scan_network
+        limit : int, optional
+            Stop after <limit> ESPs were found, by default None
+        name : str, optional
+            Stop when the ESP with the unit name <name> was found. If it is already registered, it is yielded without
+            scanning. By default None
+
+        Yields
+        -------
+        ESP
+            The ESPs that were added by this scan
+        """
+
+        if name is not None and name in cls._name_ip_map:
+            yield cls.get(name)
+            return
+        if network == None:
+            network = cls._configured_network()
+            if network == None:
                 return
-            except KeyError as kerror:
-                logger.error("ipv4network not defined")
+        count = 0
+        for host, esp in cls._scan(network, timeout, concurrency, deadline, port, probe_timeout):
+            yield esp
+            count += 1
+            if (limit is not None and count >= limit) or (name is not None and esp.name == name):
                 return
 
-        # start a single thread for each ip address in the network and validate the answer on <ip>:80/json
-        threads = []
+    @ classmethod
+    def _scan(cls, network: ipaddress.IPv4Network, timeout, concurrency: int, deadline: float, port: int,
+              probe_timeout: float) -> Iterator[tuple]:
+        """Internal generator that runs the scan and yields (host, ESP) for every ESP as soon as it was added"""
+
+        end_time = None if deadline is None else time.monotonic() + deadline
+        stop = threading.Event()
+        hosts = iter_probe_port(network.hosts(), port=port, timeout=probe_timeout, deadline=deadline)
+        address = "{host}" if port == 80 else "{host}:" + str(port)
+        # Dead hosts are not retried, so the scan gets its own transport without retries
+        scan_transport = Transport(pool_connections=concurrency, pool_size=1, timeout=timeout, retries=0)
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="espisy-scan")
         try:
-            with open(settings_file_name) as settings_file:
-                settings = yaml.safe_load(settings_file)
-        except Exception as e:
-            logger.error(e, exc_info=1)
-        for host in network:
-            t = threading.Thread(
-                target=cls.__connect_validate_ipv4_address, args=(host, timeout, settings))
-            t.start()
-            threads.append(t)
-        for t in threads:
-            t.join()
+            # only <concurrency> hosts are submitted at once. Every finished host submits the next one.
+            pending = {executor.submit(cls.__connect_validate_ipv4_address, address.format(host=host), timeout,
+                                       scan_transport, stop): host
+                       for host in itertools.islice(hosts, concurrency)}
+            while pending:
+                remaining = None if end_time is None else end_time - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    logger.warning(f"Scan of {network} stopped after reaching the deadline of {deadline}s")
+                    break
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    host = pending.pop(future)
+                    for next_host in itertools.islice(hosts, 1):
+                        pending[executor.submit(cls.__connect_validate_ipv4_address, address.format(host=next_host),
+                                                timeout, scan_transport, stop)] = next_host
+                    esp = future.result()
+                    if esp is not None:
+                        yield host, esp
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            scan_transport.close()
 
     @ classmethod
-    def __connect_validate_ipv4_address(cls, host: ipaddress.IPv4Address, timeout: int, settings=None):
-        """Internal function to knock at port 80 and check if the answer is ESPEasy-like"""
+    def _configured_network(cls) -> ipaddress.IPv4Network:
+        """Internal function to read the network to scan from esp.yaml. Logs and returns None if not possible."""
+        import yaml
+
+        settings_file_name = get_settings_file_name()
+        try:
+            with open(settings_file_name, "r") as f:
+                ipv4network_string = yaml.safe_load(f)["ipv4network"]
+            if ipv4network_string == None:
+                logger.error("No subnet is set in the config file.")
+                return None
+            return ipaddress.ip_network(ipv4network_string)
+        except FileNotFoundError as fnferror:
+            logger.error(f"File {settings_file_name} does not exist")
+        except KeyError as kerror:
+            logger.error("ipv4network not defined")
+        return None
+
+    @ classmethod
+    def __connect_validate_ipv4_address(cls, host: str, timeout: int, transport: Transport = None,
+                                        stop: threading.Event = None):
+        """Internal function to request <host>/json and check if the answer is ESPEasy-like
+
+        Returns the ESP that was added or None. Nothing is added once <stop> is set.
+        """
+        import requests
+
+        if transport is None:
+            transport = get_default_transport()
+        url = f"http://{host}/json"
+        try:
+            if instrumentation.enabled:
+                answer = instrumentation.call(host, "json", transport.get, url, timeout=timeout)
+            else:
+                answer = transport.get(url, timeout=timeout)
+            response = State(answer.content)
+            name = response.unit_name
+        except (ValueError, AttributeError, TypeError, requests.RequestException) as error:
+            logger.debug(f"did not find a device at {host}: {error!r}")
+            return None
+        if not name or (stop is not None and stop.is_set()):
+            return None
+        with cls._register_lock:
+            if name in cls._name_ip_map:
+                logger.info(
+                    f"{name} already exists. Please rename the ESPEasy device at {host} and scan again.")
+                return None
+            # reserve the name until the ESP is added
+            cls._name_ip_map.update({name: host})
         try:
-            response = requests.get(
-                f"http://{host}/json", timeout=timeout).json()
-            name = response["System"]["Unit Name"]
-            if name:
-                if name in cls._name_ip_map:
-                    logger.info(
-                        f"{name} already exists. Please rename the ESPEasy device at {host.exploded} and scan again.")
-                else:
-                    ESP.add(host.exploded)
-                    # Try to find old settings and apply
-                    esp = ESP.get(host.exploded)
-                    # Check if the settings have already been saved and update or append the current settings
-                    try:
-                        esp.load_settings()
-                    except Exception as e:
-                        logger.exception(f"An Exception occured: {e}")
-
-        except (json.JSONDecodeError, requests.ConnectTimeout, KeyError, requests.ConnectionError) as error:
-            pass  # logger.debug(f"did not find a device at {host}")
+            esp = ESP.add(host, state=response)
+        except (KeyError, TypeError) as error:
+            with cls._register_lock:
+                cls._name_ip_map.pop(name, None)
+            return None
+        # Try to find old settings and apply
+        try:
+            esp.load_settings()
+        except Exception as e:
+            logger.exception(f"An Exception occured: {e}")
+        return esp
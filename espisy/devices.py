@@ -1,23 +1,39 @@
+import inspect
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
 value_names = {"Thermometer": "Temperature",
                "Barometer": "Pressure",
                "Hygrometer": "Humidity",
                "Rotary": "Counter"}
 
 
+async def _fresh():
+    """Awaitable of Device.refresh for an AsyncESP whose values need no refresh"""
+
+
 class Device():
     """Standard Device class that implements basic properties.
 
-    The Device class implements basic properties, like name, parent or settings
+    The Device class implements basic properties, like name, parent or settings.
+    Devices are slotted, subclasses have to declare their attributes in __slots__.
     """
 
+    __slots__ = ("name", "parent", "settings")
+
     def __new__(cls, name, parent, device_type="auto", *args, **kwargs):
         if device_type == "auto":
-            for task in parent.state["Sensors"]:
-                if task["TaskName"].lower() == name.lower():
-                    if task["Type"] in device_name_class_map:
-                        return object.__new__(device_name_class_map[task["Type"]])
-                    else:
-                        print(f"found no device of type {task['Type']}")
+            task = parent._task_names.get(name.lower())
+            if task is not None:
+                if task["Type"] in device_name_class_map:
+                    return object.__new__(device_name_class_map[task["Type"]])
+                else:
+                    logger.warning(f"found no device of type {task['Type']}")
         else:
             return object.__new__(device_name_class_map[device_type])
 
@@ -34,17 +50,104 @@ class Device():
     @property
     def state(self):
         """Returns the (static) state of the device taken from the esp json output"""
-        for state in self.parent.state["Sensors"]:
-            if state["TaskName"] == self.name:
-                return state
-        return None
+        task = self.parent._tasks.get(self.name)
+        if task is None:
+            return None
+        return task[0]
+
+    def _value(self, value_name: str):
+        """Returns the value <value_name> of the device taken from the task index of the parent"""
+        task = self.parent._tasks.get(self.name)
+        if task is None:
+            return None
+        value = task[1].get(value_name)
+        if value is None:
+            return None
+        return value.value
+
+    def history(self, value_name: str = None):
+        """Returns the espisy.history.History of a value or None if it is not recorded
+
+        Recording has to be enabled with ESP.record_history.
+
+        Parameters
+        ----------
+        value_name : str, optional
+            Name of the value, e.g. "Temperature", by default the first value of the task
+        """
+        if value_name is None:
+            state = self.state
+            if state is None or not state.get("TaskValues"):
+                return None
+            value_name = state["TaskValues"][0]["Name"]
+        return self.parent._histories.get((self.name, value_name))
+
+    def subscribe(self, callback, value_name: str = None):
+        """Calls <callback> with a espisy.subscriptions.Change whenever a value of the device changes on a refresh
+
+        Parameters
+        ----------
+        callback : Callable
+            Function that takes a Change(esp, device, value, old, new)
+        value_name : str, optional
+            Only changes of this value, e.g. "Temperature", by default all values of the device
+
+        Returns
+        -------
+        Subscription
+            Call its cancel() to unsubscribe
+        """
+        return self.parent.subscribe(callback, device=self.name, value=value_name)
+
+    @property
+    def interval(self):
+        """Returns the TaskInterval of the device in seconds or None if the task has no interval"""
+        state = self.state
+        if state is None or not state.get("TaskInterval"):
+            return None
+        return state["TaskInterval"]
 
-    def refresh(self):
+    @property
+    def age(self):
+        """Returns the seconds since the values of the device were refreshed or pushed, None if they never were"""
+        age = self.parent.age
+        pushed_at = self.parent._pushed_at.get(self.name)
+        if pushed_at is not None:
+            pushed_age = time.monotonic() - pushed_at
+            if age is None or pushed_age < age:
+                return pushed_age
+        return age
+
+    @property
+    def fresh_state(self):
+        """Returns the state of the device after refreshing it. With caching enabled only stale data is requested.
+
+        For devices of an AsyncESP use await refresh() and state instead.
+        """
+        self.refresh()
+        return self.state
+
+    def refresh(self, max_age: float = None):
         """Refreshes the parent ESP device.
 
-        The function only reads the json output again. The ESP Easy device will only refresh on its set interval
+        The function only reads the json output again. The ESP Easy device will only refresh on its set interval.
+        If caching is enabled on the parent, the request is only sent if the state is older than the TaskInterval of
+        the device (or the TTL of the ESP for tasks without interval). Values pushed by the ESP count as refresh.
+
+        Parameters
+        ----------
+        max_age : float, optional
+            Only refresh if the values of the device are older than <max_age> seconds, by default None
         """
-        self.parent.refresh()
+        if max_age is None and self.parent.cache:
+            max_age = self.interval
+        if max_age is not None and self.parent._pushed_at:
+            age = self.age
+            if age is not None and age < max_age:
+                if inspect.iscoroutinefunction(self.parent.refresh):
+                    return _fresh()
+                return None
+        return self.parent.refresh(max_age=max_age)
 
 
 class Thermometer(Device):
@@ -53,15 +156,15 @@ class Thermometer(Device):
     Implements property temperature
     """
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     @ property
     def temperature(self):
         """Returns the value of the temperature"""
-        for task in self.state["TaskValues"]:
-            if task["Name"] == value_names["Thermometer"]:
-                return task["Value"]
+        return self._value(value_names["Thermometer"])
 
 
 class Hygrometer(Device):
@@ -70,15 +173,15 @@ class Hygrometer(Device):
     Implements property humidity
     """
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     @ property
     def humidity(self):
         """Returns the value of the humidity"""
-        for task in self.state["TaskValues"]:
-            if task["Name"] == value_names["Hygrometer"]:
-                return task["Value"]
+        return self._value(value_names["Hygrometer"])
 
 
 class Barometer(Device):
@@ -87,20 +190,22 @@ class Barometer(Device):
     Implements property pressure
     """
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     @ property
     def pressure(self):
         """Returns the value of the pressure"""
-        for task in self.state["TaskValues"]:
-            if task["Name"] == value_names["Barometer"]:
-                return task["Value"]
+        return self._value(value_names["Barometer"])
 
 
 class DS18b20(Thermometer, Device):
     """DS18b20 class"""
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -108,6 +213,8 @@ class DS18b20(Thermometer, Device):
 class DHT(Thermometer, Hygrometer, Device):
     """DHT class"""
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -115,6 +222,8 @@ class DHT(Thermometer, Hygrometer, Device):
 class MLX90614(Thermometer, Device):
     """MLX90614 class"""
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -122,6 +231,8 @@ class MLX90614(Thermometer, Device):
 class BMP085(Thermometer, Barometer, Device):
     """BMP085 class"""
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -129,6 +240,8 @@ class BMP085(Thermometer, Barometer, Device):
 class BMx280(Thermometer, Barometer, Hygrometer, Device):
     """BMx280 class"""
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -136,6 +249,8 @@ class BMx280(Thermometer, Barometer, Hygrometer, Device):
 class MS5611(Thermometer, Barometer, Device):
     """MS5611 class"""
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -146,6 +261,8 @@ class Switch(Device):
     Used to track input switches that were setup in the ESPEasy
     """
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -158,6 +275,8 @@ class Switch(Device):
 class GPIO(Device):
     """Generic GPIO class to control GPIO output.
 
+    on, off and toggle return the answer of the parent ESP. With an espisy.aio.AsyncESP as parent they return awaitables.
+
     This class differs from switch, because GPIOs pinstate function will always be the updated state.
     This class cannot be generated automatically. In order to create a GPIO, you have to call the Device constructor manually.
     Device(<name>, <parent>, device_type="GPIO",settings={"pin":<gpio>}) where <name>, <parent> and <gpio> must be correct will
@@ -165,36 +284,78 @@ class GPIO(Device):
     If you call the device method of an espisy.ESP instance, you do not need to pass the parent.
     """
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.settings.update(kwargs["settings"])
 
     def on(self):
         """Set GPIO high"""
-        self.parent.gpio_on(self.settings["pin"])
+        return self.parent.gpio_on(self.settings["pin"])
 
     def off(self):
         """Set GPIO low"""
-        self.parent.gpio_off(self.settings["pin"])
+        return self.parent.gpio_off(self.settings["pin"])
 
     def toggle(self):
         """Toggle GPIO state"""
-        self.parent._toggle(self.settings["pin"])
+        return self.parent._toggle(self.settings["pin"])
 
     @property
     def pinstate(self):
         """Returns the current GPIO state
 
-        This call always gets the current state from your ESPEasy device.
+        This call gets the current state from your ESPEasy device, unless the GPIO cache of the parent is enabled
+        (ESP(..., gpio_max_age=<seconds>)). If the parent is an espisy.aio.AsyncESP, the property has to be awaited.
         """
         return self.parent.gpio_state(self.settings["pin"])
 
 
 class Display(Device):
-    """Class for a Display with 2004 driver or OLED display"""
+    """Class for a Display with 2004 driver or OLED display
+
+    text, clear, on and off send their command at once. All methods that send commands return the answer of the
+    parent ESP. With an espisy.aio.AsyncESP as parent they return awaitables.
+
+    The display also keeps a frame buffer. write and erase only change the buffer, render compares it with the
+    contents last sent to the screen and sends the changed part of every row that changed, one request per row, in
+    the order of the rows. Unchanged rows cost nothing, so a frame can be rendered every second without flicker::
+
+        lcd = esp.device("lcd", device_type="Display", settings={"max_fps": 2})
+        lcd.write(1, 1, "Temperature")
+        lcd.write(2, 1, f"{dht.temperature:5.1f} C")
+        lcd.render()
+
+    The settings "rows" and "columns" give the size of the display (by default 4 and 20), "max_fps" caps the frames
+    rendered per second, "command" is the command of the ESPEasy plugin (by default "LCD", "OLED" for the SSD1306
+    plugin).
+    """
+
+    __slots__ = ("_buffer", "_shown", "_rendered_at", "_lock")
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.settings.update(kwargs.get("settings") or {})
+        self._buffer = [" " * self.columns] * self.rows
+        # contents of the screen as far as known, None until the first frame or after invalidate
+        self._shown = None
+        self._rendered_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def rows(self) -> int:
+        """Returns the number of rows of the display"""
+        return self.settings.get("rows", 4)
+
+    @property
+    def columns(self) -> int:
+        """Returns the number of columns of the display"""
+        return self.settings.get("columns", 20)
+
+    @property
+    def _command(self) -> str:
+        return self.settings.get("command", "LCD")
 
     def text(self, row: int, column: int, text: str):
         """Sets the Displays text
@@ -206,44 +367,179 @@ class Display(Device):
         column : int
             column to start the text, starting at 1
         text : str
-            Text to display
+            Text to display. It is sent as it is, even if the position is outside of the configured rows and
+            columns, e.g. for displays with another size. The frame buffer only follows text that fits on it.
         """
-        cmd = f"control?cmd=LCD,{row},{column},{text}"
-        self.parent.send_command(cmd)
+        cmd = f"control?cmd={self._command},{row},{column},{text}"
+        with self._lock:
+            if 1 <= row <= len(self._buffer) and 1 <= column <= self.columns:
+                self._buffer[row - 1] = self._draw(self._buffer[row - 1], column, text)
+                if self._shown is not None and row <= len(self._shown):
+                    self._shown[row - 1] = self._draw(self._shown[row - 1], column, text)
+        return self.parent.send_command(cmd)
 
     def clear(self):
-        """Clears the display"""
-        cmd = f"control?cmd=LCDCMD,clear"
-        self.parent.send_command(cmd)
+        """Clears the display and the frame buffer"""
+        cmd = f"control?cmd={self._command}CMD,clear"
+        with self._lock:
+            self._buffer = [" " * self.columns] * self.rows
+            self._shown = list(self._buffer)
+        return self.parent.send_command(cmd)
 
     def on(self):
         """Switches the Display light on"""
-        cmd = f"control?cmd=LCDCMD,on"
-        self.parent.send_command(cmd)
+        cmd = f"control?cmd={self._command}CMD,on"
+        return self.parent.send_command(cmd)
 
     def off(self):
         """Switches the Display light off"""
-        cmd = f"control?cmd=LCDCMD,off"
-        self.parent.send_command(cmd)
+        cmd = f"control?cmd={self._command}CMD,off"
+        return self.parent.send_command(cmd)
+
+    @property
+    def frame(self) -> list:
+        """Returns the rows of the frame buffer"""
+        return list(self._buffer)
+
+    @property
+    def pending(self) -> bool:
+        """Returns True if the frame buffer differs from the contents last sent to the screen"""
+        return self._shown != self._buffer
+
+    def write(self, row: int, column: int, text: str):
+        """Writes text into the frame buffer. Nothing is sent until render is called.
+
+        Parameters
+        ----------
+        row : int
+            row to start the text, starting at 1
+        column : int
+            column to start the text, starting at 1. Text behind the last column is cut off.
+        text : str
+            Text to write
+
+        Raises
+        ------
+        ValueError
+            If row or column are not on the display
+        """
+        self._check_position(row, column)
+        with self._lock:
+            self._buffer[row - 1] = self._draw(self._buffer[row - 1], column, text)
+
+    def erase(self, row: int = None):
+        """Blanks a row or the whole frame buffer. Nothing is sent until render is called."""
+        with self._lock:
+            if row is None:
+                self._buffer = [" " * self.columns] * self.rows
+            else:
+                self._buffer[row - 1] = " " * self.columns
+
+    def invalidate(self):
+        """Forgets the contents of the screen, e.g. after the ESP restarted. The next frame redraws every row."""
+        with self._lock:
+            self._shown = None
+
+    def render(self, force: bool = False):
+        """Sends the changes of the frame buffer to the screen
+
+        Every row that changed gets one command with the text from its first to its last changed column. The
+        commands are sent in the order of the rows, one after another. The first frame (and the first after
+        invalidate) writes every row completely.
+
+        Parameters
+        ----------
+        force : bool, optional
+            Ignore the max_fps setting, by default False
+
+        Returns
+        -------
+        list
+            The answers of the commands, an empty list if nothing changed, None if the frame was skipped because of
+            max_fps. The changes stay in the buffer and go out with the next frame. With an AsyncESP as parent an
+            awaitable of it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            max_fps = self.settings.get("max_fps")
+            if (not force and max_fps and self._rendered_at is not None
+                    and now - self._rendered_at < 1 / max_fps and self._shown != self._buffer):
+                return None
+            commands = [f"control?cmd={self._command},{row},{column},{text}"
+                        for row, column, text in self._segments()]
+            if commands:
+                self._rendered_at = now
+            self._shown = list(self._buffer)
+            if inspect.iscoroutinefunction(self.parent.send_command):
+                return self._send_async(commands)
+            try:
+                return [self.parent.send_command(cmd) for cmd in commands]
+            except BaseException:
+                # the screen is in an unknown state
+                self._shown = None
+                raise
+
+    async def _send_async(self, commands: list) -> list:
+        answers = []
+        try:
+            for cmd in commands:
+                answers.append(await self.parent.send_command(cmd))
+        except BaseException:
+            self._shown = None
+            raise
+        return answers
+
+    def _segments(self):
+        """Yields (row, column, text) of the changed part of every row that differs from the screen"""
+        shown = self._shown
+        columns = self.columns
+        for index, line in enumerate(self._buffer):
+            # rows are padded, so a change of the columns setting cannot make them differ in length
+            line = line.ljust(columns)[:columns]
+            if shown is None:
+                yield index + 1, 1, line
+                continue
+            old = (shown[index] if index < len(shown) else "").ljust(columns)[:columns]
+            if old == line:
+                continue
+            start = 0
+            while line[start] == old[start]:
+                start += 1
+            end = len(line)
+            while line[end - 1] == old[end - 1]:
+                end -= 1
+            yield index + 1, start + 1, line[start:end]
+
+    def _draw(self, line: str, column: int, text: str) -> str:
+        """Returns <line> with <text> at <column> like the display shows it"""
+        line = line.ljust(self.columns)
+        return (line[:column - 1] + text + line[column - 1 + len(text):])[:self.columns]
+
+    def _check_position(self, row: int, column: int):
+        """Raises a ValueError if <row> and <column> are not on the display"""
+        if not 1 <= row <= self.rows or not 1 <= column <= self.columns:
+            raise ValueError(f"({row}, {column}) is not on the {self.rows}x{self.columns} display")
 
 
 class Rotary(Device):
     """Class for rotary encoders"""
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     @property
     def counter(self):
         """Returns the counter value of the device"""
-        for task in self.state["TaskValues"]:
-            if task["Name"] == value_names["Rotary"]:
-                return task["Value"]
+        return self._value(value_names["Rotary"])
 
 
 class MQTT(Device):
     """Class for generig MQTT listener"""
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
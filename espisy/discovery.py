@@ -0,0 +1,263 @@
+"""Passive discovery of ESPEasy units by their p2p announcements
+
+ESPEasy units with the controller "ESPEasy P2P Networking" enabled broadcast an announcement with their MAC, ip,
+unit number, build, unit name and web server port over UDP (port 65500 by default) about every 30 seconds.
+The DiscoveryListener decodes these announcements and keeps the device register up to date without scanning:
+
+* a unit that is not registered is added with ESP.add (one request for its /json) and its settings are loaded,
+* a registered unit that announces another ip is moved to it, together with its saved device settings,
+* a registered unit that announces another name is renamed. If another unit is registered with that name, a warning
+  is logged and the unit keeps its old name.
+
+Usage::
+
+    from espisy.discovery import DiscoveryListener
+
+    listener = DiscoveryListener()
+    listener.start()
+    ...
+    listener.stop()
+"""
+
+import logging
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from .core import ESP
+from .transport import Transport
+
+
+logger = logging.getLogger(__name__)
+
+
+Announcement = namedtuple("Announcement", ["mac", "ip", "unit", "build", "name", "node_type", "port"])
+Announcement.__doc__ = """Decoded p2p announcement of an ESPEasy unit
+
+mac is formatted like "a0:20:a6:12:34:56", port is the port of the web server (80 for old builds that do not send it).
+"""
+
+# 0xFF, 1 (info packet), mac[6], ip[4], unit, build (uint16), name[25], node type, followed by the web port (uint16)
+_ANNOUNCEMENT = struct.Struct("<BB6s4sBH25sB")
+_PORT = struct.Struct("<H")
+
+
+def parse_announcement(data: bytes) -> Announcement:
+    """Returns the Announcement of a p2p packet or None if the packet is no announcement"""
+
+    if len(data) < _ANNOUNCEMENT.size or data[0] != 0xFF or data[1] != 1:
+        return None
+    _, _, mac, ip, unit, build, name, node_type = _ANNOUNCEMENT.unpack_from(data)
+    port = 80
+    if len(data) >= _ANNOUNCEMENT.size + _PORT.size:
+        port = _PORT.unpack_from(data, _ANNOUNCEMENT.size)[0] or 80
+    return Announcement(mac=":".join(f"{byte:02x}" for byte in mac), ip=socket.inet_ntoa(ip), unit=unit, build=build,
+                        name=name.split(b"\0", 1)[0].decode("utf-8", errors="replace").strip(),
+                        node_type=node_type, port=port)
+
+
+class DiscoveryListener():
+    """Listens for p2p announcements in a background thread and updates ESP._device_register"""
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 65500, add: bool = True, transport: Transport = None,
+                 callback: Callable = None, workers: int = 4):
+        """Initializing the listener without listening
+
+        Parameters
+        ----------
+        host : str, optional
+            Address to listen on, by default all addresses
+        port : int, optional
+            UDP port of the p2p protocol, 0 picks a free port, by default 65500
+        add : bool, optional
+            Add units that are not registered. If False only ip and name changes are applied, by default True
+        transport : Transport, optional
+            Transport of the ESPs that are added, by default the shared transport
+        callback : Callable, optional
+            Called with (esp, announcement) for every ESP that was added, moved or renamed, by default None
+        workers : int, optional
+            Number of threads that add new units, by default 4
+        """
+
+        self.host = host
+        self.port = port
+        self.add = add
+        self.transport = transport
+        self.callback = callback
+        self.workers = workers
+        # mac -> (Announcement, time.time() it was last received)
+        self.units = {}
+        self._adding = set()
+        self._lock = threading.Lock()
+        self._socket = None
+        self._thread = None
+        self._executor = None
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Starts listening in a background thread. If port is 0, port is set to the port that was picked."""
+
+        if self._socket is not None:
+            return
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.settimeout(0.5)
+        self.port = self._socket.getsockname()[1]
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="espisy-discovery")
+        self._thread = threading.Thread(target=self._listen, name="espisy-discovery", daemon=True)
+        self._thread.start()
+        logger.info(f"Listening for ESPEasy announcements on {self.host}:{self.port}")
+
+    def stop(self):
+        """Stops listening. Units that are being added are still added."""
+
+        if self._socket is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._socket.close()
+        self._executor.shutdown(wait=True)
+        self._socket = None
+        self._thread = None
+        self._executor = None
+
+    def _listen(self):
+        """Internal function that receives the packets until the listener is stopped"""
+
+        while not self._stop.is_set():
+            try:
+                data, (address, _) = self._socket.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError as error:
+                logger.warning(f"Receiving announcements failed: {error!r}")
+                continue
+            announcement = parse_announcement(data)
+            if announcement is None:
+                continue
+            try:
+                self.handle(announcement)
+            except Exception:
+                logger.exception(f"Handling the announcement {announcement} from {address} failed")
+
+    def handle(self, announcement: Announcement):
+        """Applies an announcement to the device register. Used by the listener, but can be called directly.
+
+        Parameters
+        ----------
+        announcement : Announcement
+            The decoded announcement
+        """
+
+        self.units[announcement.mac] = (announcement, time.time())
+        old_host = None
+        host = announcement.ip if announcement.port == 80 else f"{announcement.ip}:{announcement.port}"
+        name = announcement.name
+        with ESP._register_lock:
+            esp = ESP._device_register.get(host)
+            if esp is not None:
+                if not name or esp.name == name:
+                    return
+                # the unit was renamed
+                other_host = ESP._name_ip_map.get(name)
+                if other_host is not None and other_host != host:
+                    logger.warning(f"ESP at {host} was renamed from {esp.name} to {name}, but {name} is already "
+                                   f"registered at {other_host}. Keeping the name {esp.name}, please rename one "
+                                   f"of them.")
+                    return
+                if ESP._name_ip_map.get(esp.name) == host:
+                    del ESP._name_ip_map[esp.name]
+                ESP._name_ip_map[name] = host
+                logger.info(f"ESP at {host} was renamed from {esp.name} to {name}")
+                esp.name = name
+            else:
+                old_host = ESP._name_ip_map.get(name) if name else None
+                esp = ESP._device_register.get(old_host) if old_host is not None else None
+                if esp is not None:
+                    # the unit got another ip
+                    del ESP._device_register[old_host]
+                    ESP._device_register[host] = esp
+                    ESP._name_ip_map[name] = host
+                    esp.ip = host
+                    esp.breaker.reset()
+                    logger.info(f"{name} moved from {old_host} to {host}")
+        if esp is not None:
+            if old_host is not None:
+                self._move_settings(esp, old_host)
+            self._notify(esp, announcement)
+        elif self.add and name:
+            with self._lock:
+                if host in self._adding:
+                    return
+                self._adding.add(host)
+            self._executor.submit(self._add, host, announcement)
+
+    def _add(self, host: str, announcement: Announcement):
+        """Internal function that adds a new unit. It is retried on its next announcement if it fails."""
+
+        import requests
+
+        try:
+            with ESP._register_lock:
+                if host in ESP._device_register or announcement.name in ESP._name_ip_map:
+                    return
+                # reserve the name until the ESP is added, like a scan does
+                ESP._name_ip_map[announcement.name] = host
+            try:
+                esp = ESP.add(host, transport=self.transport)
+            except (ValueError, requests.RequestException) as error:
+                with ESP._register_lock:
+                    if ESP._name_ip_map.get(announcement.name) == host:
+                        del ESP._name_ip_map[announcement.name]
+                logger.info(f"Could not add {announcement.name} at {host}: {error!r}")
+                return
+            if esp.name != announcement.name:
+                with ESP._register_lock:
+                    if ESP._name_ip_map.get(announcement.name) == host:
+                        del ESP._name_ip_map[announcement.name]
+            logger.info(f"Discovered {esp.name} at {host}")
+            try:
+                esp.load_settings()
+            except Exception as e:
+                logger.exception(f"An Exception occured: {e}")
+            self._notify(esp, announcement)
+        finally:
+            with self._lock:
+                self._adding.discard(host)
+
+    def _move_settings(self, esp: ESP, old_host: str):
+        """Internal function that moves the saved device settings of <esp> from <old_host> to its new ip
+
+        The settings are stored by ip. Without moving them, the ESP would lose them on the next load and another unit
+        that gets the old ip would get them.
+        """
+
+        try:
+            store = ESP.get_settings_store()
+            devices = store.load(old_host)
+            if devices is None:
+                return
+            store.save_all({esp.ip: devices, old_host: []})
+        except Exception:
+            logger.exception(f"Could not move the settings of {esp.name} from {old_host} to {esp.ip}")
+
+    def _notify(self, esp: ESP, announcement: Announcement):
+        if self.callback is None:
+            return
+        try:
+            self.callback(esp, announcement)
+        except Exception:
+            logger.exception(f"Discovery callback {self.callback!r} failed for {esp.name}")
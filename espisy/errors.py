@@ -5,3 +5,13 @@ class ESPNotFoundError(Exception):
 class NoGPIOError(Exception):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of sending a request to an ESP whose circuit breaker is open
+
+    retry_after is the number of seconds until the breaker lets the next request through.
+    """
+
+    def __init__(self, *args, retry_after: float = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.retry_after = retry_after
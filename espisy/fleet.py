@@ -0,0 +1,169 @@
+"""Concurrent bulk operations over all ESPs of the device register"""
+
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable
+
+from .core import ESP
+from .errors import ESPNotFoundError
+
+
+logger = logging.getLogger(__name__)
+
+
+class FleetResult(dict):
+    """Result of a bulk operation. Maps every ESP (or (ip, gpio) for gpio_set_many) to its answer or exception"""
+
+    @property
+    def succeeded(self) -> dict:
+        """Returns the answers of all ESPs that did not raise an exception"""
+        return {key: value for key, value in self.items() if not isinstance(value, Exception)}
+
+    @property
+    def failed(self) -> dict:
+        """Returns the exceptions of all ESPs that failed"""
+        return {key: value for key, value in self.items() if isinstance(value, Exception)}
+
+
+class Fleet():
+    """Fleet of ESPs with concurrent versions of the ESP methods
+
+    All operations run on at most <concurrency> threads and return a FleetResult instead of stopping at the first
+    exception. Commands of ESPs with write coalescing are waited for, so the FleetResult holds their answers and not
+    Futures.
+    """
+
+    def __init__(self, register: dict = None, concurrency: int = 32):
+        """Initializing the fleet
+
+        Parameters
+        ----------
+        register : dict, optional
+            Dictionary ip -> ESP, by default ESP._device_register
+        concurrency : int, optional
+            Maximum number of requests in flight, by default 32
+        """
+
+        self.register = ESP._device_register if register is None else register
+        self.concurrency = concurrency
+
+    @property
+    def esps(self) -> list:
+        """Returns a snapshot of all ESPs of the fleet"""
+        return list(self.register.values())
+
+    def _get(self, esp: str) -> ESP:
+        """Internal function that returns the ESP of the fleet with the ip or name <esp>, like ESP.get"""
+
+        found = self.register.get(esp)
+        if found is None:
+            found = next((candidate for candidate in list(self.register.values()) if candidate.name == esp), None)
+        if found is None:
+            raise ESPNotFoundError(esp)
+        return found
+
+    def _map(self, calls: Iterable[tuple]) -> FleetResult:
+        """Internal function that runs function(*args) for every (key, function, args) on the thread pool"""
+
+        calls = list(calls)
+        result = FleetResult()
+        if not calls:
+            return result
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(calls)),
+                                thread_name_prefix="espisy-fleet") as executor:
+            futures = [(key, function, executor.submit(_call, function, *args)) for key, function, args in calls]
+            for key, function, future in futures:
+                try:
+                    result[key] = future.result()
+                except Exception as e:
+                    logger.info(f"{function.__name__} failed for {key}: {e}")
+                    result[key] = e
+        return result
+
+    def refresh_all(self, max_age: float = None) -> FleetResult:
+        """Refreshes all ESPs
+
+        Parameters
+        ----------
+        max_age : float, optional
+            Only refresh ESPs whose state is older than <max_age> seconds, by default see ESP.refresh
+
+        Returns
+        -------
+        FleetResult
+            ip -> None or the exception
+        """
+
+        return self._map((esp.ip, esp.refresh, (max_age,)) for esp in self.esps)
+
+    def broadcast_command(self, cmd: str) -> FleetResult:
+        """Sends a command to all ESPs. See ESP.send_command
+
+        Parameters
+        ----------
+        cmd : str
+            The command string that comes behind http://ip/
+
+        Returns
+        -------
+        FleetResult
+            ip -> answer of the ESP or the exception
+        """
+
+        return self._map((esp.ip, esp.send_command, (cmd,)) for esp in self.esps)
+
+    def broadcast_event(self, event: str) -> FleetResult:
+        """Triggers an event on all ESPs. See ESP.event
+
+        Parameters
+        ----------
+        event : str
+            Name of the event to trigger
+
+        Returns
+        -------
+        FleetResult
+            ip -> HTML response or the exception
+        """
+
+        return self._map((esp.ip, esp.event, (event,)) for esp in self.esps)
+
+    def gpio_set_many(self, gpios: Iterable[tuple]) -> FleetResult:
+        """Sets many GPIOs at once
+
+        Parameters
+        ----------
+        gpios : Iterable[tuple]
+            (esp, gpio, value) for every GPIO. esp can be an ESP, or the ip or name of an ESP of the fleet.
+            Truthy values turn the GPIO on, falsy values turn it off.
+
+        Returns
+        -------
+        FleetResult
+            (ip, gpio) -> answer of the ESP or the exception. ESPs that were not found are stored under the ip or name
+            that was passed with an ESPNotFoundError.
+        """
+
+        calls = []
+        not_found = {}
+        for esp, gpio, value in gpios:
+            if not isinstance(esp, ESP):
+                try:
+                    esp = self._get(esp)
+                except ESPNotFoundError as e:
+                    logger.info(f"gpio_set_many found no ESP {esp}")
+                    not_found[(esp, gpio)] = e
+                    continue
+            calls.append(((esp.ip, gpio), esp.gpio_on if value else esp.gpio_off, (gpio,)))
+        result = self._map(calls)
+        result.update(not_found)
+        return result
+
+
+def _call(function, *args):
+    """Returns function(*args) and waits for the answer if the ESP returned a Future (write coalescing)"""
+    answer = function(*args)
+    if isinstance(answer, Future):
+        answer = answer.result()
+    return answer
+
@@ -0,0 +1,85 @@
+"""Write-through cache of the GPIO states of an ESP
+
+Every ESP has a GPIOCache. The answers of GPIO,<pin>,<value> and gpiotoggle,<pin> contain the new state of the pin,
+so every write updates the cache. ESP.gpio_state and ESP.gpio_states answer from the cache while the cached state is
+younger than <max_age> seconds and only request the states that are missing or stale.
+
+The default max_age of 0 keeps the old behaviour: the state is always requested. Pins that are changed by something
+else than espisy (rules, buttons, other clients) are only noticed after <max_age> seconds, so choose it accordingly.
+Commands that may change pins in unknown ways (events and other commands sent with send_command, except reads and
+display commands) clear the cache.
+"""
+
+import time
+
+from .scheduler import is_read
+
+
+_DISPLAY_COMMANDS = ("lcd", "lcdcmd", "oled", "oledcmd")
+
+
+def may_change_gpios(path: str) -> bool:
+    """Returns False for requests that cannot change a GPIO: reads and display commands"""
+    if is_read(path):
+        return False
+    return not (path.startswith("control?cmd=") and path[12:].split(",", 1)[0].lower() in _DISPLAY_COMMANDS)
+
+
+class GPIOCache():
+    """GPIO states of one ESP with the time they were seen"""
+
+    def __init__(self, max_age: float = 0):
+        """Initializing the cache
+
+        Parameters
+        ----------
+        max_age : float, optional
+            Seconds a cached state is used instead of requesting it, by default 0 (never)
+        """
+
+        self.max_age = max_age
+        self._states = {}
+
+    def __len__(self):
+        return len(self._states)
+
+    def get(self, pin: int, max_age: float = None):
+        """Returns the cached state of <pin> or None if it is unknown or older than <max_age> seconds
+
+        Parameters
+        ----------
+        pin : int
+            GPIO number
+        max_age : float, optional
+            Overrides the max_age of the cache, by default None
+        """
+
+        if max_age is None:
+            max_age = self.max_age
+        if not max_age:
+            return None
+        entry = self._states.get(pin)
+        if entry is None or time.monotonic() - entry[1] > max_age:
+            return None
+        return entry[0]
+
+    def set(self, pin: int, state: int):
+        """Stores the state of <pin>, seen now"""
+        self._states[pin] = (state, time.monotonic())
+
+    def update(self, pin: int, answer):
+        """Stores the state from the answer to a GPIO command. Forgets the pin if the answer has no state."""
+
+        if isinstance(answer, dict):
+            answer = answer.get("state")
+        if isinstance(answer, int):
+            self.set(pin, answer)
+        else:
+            self.invalidate(pin)
+
+    def invalidate(self, pin: int = None):
+        """Forgets the state of <pin> or of all pins"""
+        if pin is None:
+            self._states = {}
+        else:
+            self._states.pop(pin, None)
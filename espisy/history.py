@@ -0,0 +1,172 @@
+"""Fixed-capacity time series of device values with vectorized statistics
+
+Requires numpy, which is installed with ``pip install espisy[history]``.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+# offset in seconds above which the timestamps are moved to a new base time (about 12 days)
+_REBASE = 2 ** 20
+
+
+class History():
+    """Ring buffer of (timestamp, value) samples backed by two numpy arrays
+
+    The memory of a history is allocated once: capacity * (4 bytes per timestamp + itemsize of the value dtype).
+    The timestamps are float32 offsets from a base time, which follows the oldest sample, so they stay exact to a few
+    milliseconds for a day and to a fraction of a second for weeks. float64 values keep counters exact up to 2**53,
+    float32 would round them above 2**24 (16,777,216). With the default float64 values that are 12 bytes per sample,
+    about 104 KB for 24h at one sample per 10s, so 500 recorded values take about 52 MB.
+    When the buffer is full the oldest sample is overwritten. Appending and reading are thread-safe, so the poller and
+    the push receiver can append while other threads read.
+    """
+
+    def __init__(self, capacity: int = 8640, dtype: str = "float64"):
+        """Initializing the history
+
+        Parameters
+        ----------
+        capacity : int, optional
+            Maximum number of samples, by default 8640 (24h at one sample per 10s)
+        dtype : str, optional
+            numpy dtype of the values, by default "float64"
+        """
+
+        self.capacity = capacity
+        self._base = None
+        self._times = np.zeros(capacity, dtype="float32")
+        self._values = np.zeros(capacity, dtype=dtype)
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        """Returns the memory used by the samples in bytes"""
+        return self._times.nbytes + self._values.nbytes
+
+    def append(self, value: float, timestamp: float = None):
+        """Adds a sample
+
+        Parameters
+        ----------
+        value : float
+            The value
+        timestamp : float, optional
+            Unix timestamp of the value, by default now
+        """
+
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            if self._base is None:
+                self._base = timestamp
+            elif timestamp - self._base >= _REBASE and self._count:
+                # move the base to the oldest sample, so that the offsets stay small and precise
+                oldest = float(self._times[self._next if self._count == self.capacity else 0])
+                if oldest > 0:
+                    self._times -= np.float32(oldest)
+                    self._base += oldest
+            self._values[self._next] = value
+            self._times[self._next] = timestamp - self._base
+            self._next = (self._next + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    @property
+    def times(self) -> np.ndarray:
+        """Returns the timestamps of all samples, oldest first"""
+        with self._lock:
+            return self._ordered_times()
+
+    @property
+    def values(self) -> np.ndarray:
+        """Returns the values of all samples, oldest first"""
+        with self._lock:
+            return self._ordered(self._values)
+
+    def _ordered(self, array: np.ndarray) -> np.ndarray:
+        """Internal function that returns a copy of the samples of <array> in chronological order. Needs the lock."""
+        if self._count < self.capacity:
+            return array[:self._count].copy()
+        return np.concatenate((array[self._next:], array[:self._next]))
+
+    def _ordered_times(self) -> np.ndarray:
+        """Internal function that returns the timestamps in chronological order as float64. Needs the lock."""
+        times = self._ordered(self._times).astype("float64")
+        if self._base is not None:
+            times += self._base
+        return times
+
+    def window(self, seconds: float = None, now: float = None) -> tuple:
+        """Returns (times, values) of the samples of the last <seconds> seconds
+
+        Parameters
+        ----------
+        seconds : float, optional
+            Length of the window, by default all samples
+        now : float, optional
+            Unix timestamp of the end of the window, by default now
+
+        Returns
+        -------
+        tuple
+            numpy arrays of the timestamps and values, oldest first
+        """
+
+        with self._lock:
+            times, values = self._ordered_times(), self._ordered(self._values)
+        if seconds is not None:
+            start = np.searchsorted(times, (time.time() if now is None else now) - seconds)
+            times, values = times[start:], values[start:]
+        return times, values
+
+    def min(self, seconds: float = None) -> float:
+        """Returns the smallest value of the last <seconds> seconds or None if there are no samples"""
+        return _min(*self.window(seconds))
+
+    def max(self, seconds: float = None) -> float:
+        """Returns the largest value of the last <seconds> seconds or None if there are no samples"""
+        return _max(*self.window(seconds))
+
+    def mean(self, seconds: float = None) -> float:
+        """Returns the mean value of the last <seconds> seconds or None if there are no samples"""
+        return _mean(*self.window(seconds))
+
+    def rate(self, seconds: float = None) -> float:
+        """Returns the change per second over the last <seconds> seconds, e.g. the speed of a Rotary counter
+
+        The rate is the slope of a least squares fit through the samples. Returns None for less than two samples.
+        """
+        return _rate(*self.window(seconds))
+
+    def stats(self, seconds: float = None) -> dict:
+        """Returns min, max, mean, rate and count of the last <seconds> seconds as dict"""
+        times, values = self.window(seconds)
+        return {"min": _min(times, values), "max": _max(times, values), "mean": _mean(times, values),
+                "rate": _rate(times, values), "count": len(times)}
+
+
+def _min(times: np.ndarray, values: np.ndarray) -> float:
+    return float(values.min()) if len(values) else None
+
+
+def _max(times: np.ndarray, values: np.ndarray) -> float:
+    return float(values.max()) if len(values) else None
+
+
+def _mean(times: np.ndarray, values: np.ndarray) -> float:
+    return float(values.mean(dtype="float64")) if len(values) else None
+
+
+def _rate(times: np.ndarray, values: np.ndarray) -> float:
+    if len(times) < 2 or times[-1] == times[0]:
+        return None
+    times = times - times.mean()
+    return float(np.dot(times, values - values.mean(dtype="float64")) / np.dot(times, times))
@@ -0,0 +1,247 @@
+"""Instrumentation of all requests to the ESPs
+
+Every request is measured in a latency histogram per ESP and per request kind ("json", "gpio", "status", "event", ...).
+Counters track requests, errors, timeouts, answers that were no valid json and retries of the transport.
+Tracers get a span for every request, e.g. to forward them to OpenTelemetry.
+
+The instrumentation is disabled by default. Then a request only costs one attribute lookup more::
+
+    from espisy.instrumentation import instrumentation
+
+    instrumentation.enable()
+    ...
+    print(instrumentation.snapshot()["devices"]["192.168.0.2"]["latency"]["json"]["p99"])
+"""
+
+import bisect
+import logging
+import threading
+import time
+from typing import Callable
+from urllib.parse import urlsplit
+
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram():
+    """Latency histogram with fixed, logarithmic buckets from 0.5 ms to 30 s"""
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    # upper bounds of the buckets in seconds. The last bucket takes everything above 30 s.
+    bounds = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds: float):
+        """Adds a measurement"""
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: "Histogram"):
+        """Adds all measurements of <other>"""
+        for bucket, count in enumerate(other.counts):
+            self.counts[bucket] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, q: float) -> float:
+        """Returns the upper bound of the bucket that contains the <q> quantile (0 < q <= 1), at most the maximum"""
+
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if bucket == len(self.bounds):
+                    return self.max
+                return min(self.bounds[bucket], self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        """Returns count, mean, min, max, p50, p90 and p99 in seconds and the bucket counts as dict"""
+        return {"count": self.count, "mean": self.total / self.count if self.count else None, "min": self.min,
+                "max": self.max, "p50": self.percentile(0.5), "p90": self.percentile(0.9),
+                "p99": self.percentile(0.99), "buckets": dict(zip(self.bounds + (float("inf"),), self.counts))}
+
+
+class Tracer():
+    """Base class of tracing hooks. start_span is called before every request, end_span after it."""
+
+    def start_span(self, ip: str, kind: str, path: str):
+        """Returns an object that is passed to end_span, e.g. a span of a tracing library"""
+        return None
+
+    def end_span(self, span, seconds: float, error: BaseException = None):
+        """Called with the object returned by start_span, the duration and the exception if the request failed"""
+
+
+def request_kind(path: str) -> str:
+    """Returns the kind of a request, e.g. "json" for json and "gpio" for control?cmd=GPIO,2,1"""
+    if path.startswith("control?cmd="):
+        return path[12:].split(",", 1)[0].lower() or "control"
+    return path.split("?", 1)[0] or "/"
+
+
+def is_timeout(error: BaseException) -> bool:
+    """Returns True for the timeouts of requests, aiohttp and asyncio"""
+    return isinstance(error, TimeoutError) or any(cls.__name__ == "Timeout" for cls in type(error).__mro__)
+
+
+class Instrumentation():
+    """Collects the histograms and counters of all requests and calls the tracers"""
+
+    counter_names = ("requests", "errors", "timeouts", "json_errors", "retries")
+
+    def __init__(self):
+        self.enabled = False
+        self.tracers = []
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def enable(self):
+        """Starts measuring"""
+        self.enabled = True
+
+    def disable(self):
+        """Stops measuring. The collected data is kept."""
+        self.enabled = False
+
+    def reset(self):
+        """Removes all collected data"""
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+
+    def add_tracer(self, tracer: Tracer):
+        """Adds a tracer that gets a span for every request"""
+        self.tracers.append(tracer)
+
+    def remove_tracer(self, tracer: Tracer):
+        """Removes a tracer"""
+        self.tracers.remove(tracer)
+
+    def count(self, ip: str, name: str, value: int = 1):
+        """Increments the counter <name> of the ESP with <ip>"""
+        with self._lock:
+            key = (ip, name)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def count_url(self, url: str, name: str, value: int = 1):
+        """Increments the counter <name> of the ESP that answered the request for <url>"""
+        self.count(urlsplit(url).netloc, name, value)
+
+    def observe(self, ip: str, kind: str, seconds: float, error: BaseException = None):
+        """Records a finished request"""
+        with self._lock:
+            histogram = self._histograms.get((ip, kind))
+            if histogram is None:
+                histogram = self._histograms[(ip, kind)] = Histogram()
+            histogram.observe(seconds)
+            counters = self._counters
+            counters[(ip, "requests")] = counters.get((ip, "requests"), 0) + 1
+            if error is not None:
+                counters[(ip, "errors")] = counters.get((ip, "errors"), 0) + 1
+                if is_timeout(error):
+                    counters[(ip, "timeouts")] = counters.get((ip, "timeouts"), 0) + 1
+
+    def _start(self, ip: str, kind: str, path: str) -> list:
+        spans = []
+        for tracer in self.tracers:
+            try:
+                spans.append((tracer, tracer.start_span(ip, kind, path)))
+            except Exception:
+                logger.exception(f"Tracer {tracer!r} failed to start a span")
+        return spans
+
+    def _end(self, ip: str, kind: str, spans: list, seconds: float, error: BaseException):
+        self.observe(ip, kind, seconds, error)
+        for tracer, span in spans:
+            try:
+                tracer.end_span(span, seconds, error)
+            except Exception:
+                logger.exception(f"Tracer {tracer!r} failed to end a span")
+
+    def call(self, ip: str, path: str, function: Callable, *args, **kwargs):
+        """Returns function(*args, **kwargs) and measures it as request for <path> to the ESP with <ip>"""
+
+        kind = request_kind(path)
+        spans = self._start(ip, kind, path) if self.tracers else ()
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as error:
+            self._end(ip, kind, spans, time.perf_counter() - start, error)
+            raise
+        self._end(ip, kind, spans, time.perf_counter() - start, None)
+        return result
+
+    async def acall(self, ip: str, path: str, function: Callable, *args, **kwargs):
+        """Like call for coroutine functions"""
+
+        kind = request_kind(path)
+        spans = self._start(ip, kind, path) if self.tracers else ()
+        start = time.perf_counter()
+        try:
+            result = await function(*args, **kwargs)
+        except BaseException as error:
+            self._end(ip, kind, spans, time.perf_counter() - start, error)
+            raise
+        self._end(ip, kind, spans, time.perf_counter() - start, None)
+        return result
+
+    def snapshot(self) -> dict:
+        """Returns the collected data
+
+        Returns
+        -------
+        dict
+            {"devices": {ip: {<counter>: int, "latency": {kind: histogram}}}, "kinds": {kind: histogram}}
+            with the histograms as dicts, see Histogram.snapshot. Latencies are in seconds.
+        """
+
+        with self._lock:
+            histograms = {key: _copy(histogram) for key, histogram in self._histograms.items()}
+            counters = dict(self._counters)
+        devices = {}
+        kinds = {}
+        for (ip, name), value in counters.items():
+            devices.setdefault(ip, _device_snapshot())[name] = value
+        for (ip, kind), histogram in histograms.items():
+            devices.setdefault(ip, _device_snapshot())["latency"][kind] = histogram.snapshot()
+            kinds.setdefault(kind, Histogram()).merge(histogram)
+        return {"devices": devices, "kinds": {kind: histogram.snapshot() for kind, histogram in kinds.items()}}
+
+
+def _copy(histogram: Histogram) -> Histogram:
+    copy = Histogram()
+    copy.merge(histogram)
+    return copy
+
+
+def _device_snapshot() -> dict:
+    snapshot = dict.fromkeys(Instrumentation.counter_names, 0)
+    snapshot["latency"] = {}
+    return snapshot
+
+
+# shared by all ESPs and transports
+instrumentation = Instrumentation()
@@ -0,0 +1,151 @@
+"""Cheap TCP probes that find hosts with an open port before they are asked for /json"""
+
+import errno
+import ipaddress
+import itertools
+import logging
+import selectors
+import socket
+import struct
+import time
+from typing import Iterable, Iterator
+
+
+logger = logging.getLogger(__name__)
+
+# connect_ex results of a non-blocking connect that is still in progress
+_CONNECT_IN_PROGRESS = {0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY,
+                        getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK)}
+
+
+def probe_port(hosts: Iterable[ipaddress.IPv4Address], port: int = 80, timeout: float = 0.1,
+               batch_size: int = 512, deadline: float = None) -> list:
+    """Returns all hosts that accept a TCP connection on <port>
+
+    Opens non-blocking connections to <batch_size> hosts at once and waits at most <timeout> seconds per batch
+    for them to be accepted. Connections are reset right after they were accepted.
+
+    Parameters
+    ----------
+    hosts : Iterable[ipaddress.IPv4Address]
+        Hosts to probe, e.g. an ipaddress.IPv4Network or network.hosts()
+    port : int, optional
+        TCP port to probe, by default 80
+    timeout : float, optional
+        Time in seconds to wait for the connections of a batch, by default 0.1
+    batch_size : int, optional
+        Number of connections opened at once. Must stay below the limit of open files, by default 512
+    deadline : float, optional
+        Time in seconds after which no further batch is started, by default all hosts are probed
+
+    Returns
+    -------
+    list
+        The hosts that accepted the connection, in the order they were passed
+    """
+
+    return list(iter_probe_port(hosts, port=port, timeout=timeout, batch_size=batch_size, deadline=deadline))
+
+
+def iter_probe_port(hosts: Iterable[ipaddress.IPv4Address], port: int = 80, timeout: float = 0.1,
+                    batch_size: int = 512, deadline: float = None) -> Iterator[ipaddress.IPv4Address]:
+    """Generator version of probe_port
+
+    Yields the hosts that accepted the connection batch by batch, so that they can be used before the whole network
+    was probed. A batch is only probed when the hosts of the previous batch were consumed.
+    See probe_port for the parameters.
+    """
+
+    end_time = None if deadline is None else time.monotonic() + deadline
+    hosts = iter(hosts)
+    while True:
+        if end_time is not None and time.monotonic() >= end_time:
+            logger.warning(f"Port probe stopped after reaching the deadline of {deadline}s")
+            return
+        batch = list(itertools.islice(hosts, batch_size))
+        if not batch:
+            return
+        yield from _probe_batch(batch, port, timeout)
+
+
+def _probe_batch(batch: list, port: int, timeout: float) -> list:
+    """Internal function to probe a batch of hosts with non-blocking connects"""
+    selector = selectors.DefaultSelector()
+    sockets = []
+    accepted = set()
+    try:
+        for host in batch:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sockets.append(sock)
+            sock.setblocking(False)
+            # reset instead of a regular close, so neither side keeps the connection in TIME_WAIT
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            try:
+                result = sock.connect_ex((str(host), port))
+            except OSError as e:
+                logger.debug(f"Could not connect to {host}:{port} ({e})")
+                continue
+            if result in _CONNECT_IN_PROGRESS:
+                selector.register(sock, selectors.EVENT_WRITE, host)
+        end_time = time.monotonic() + timeout
+        while selector.get_map():
+            remaining = end_time - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                selector.unregister(key.fileobj)
+                if key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    accepted.add(key.data)
+    finally:
+        selector.close()
+        for sock in sockets:
+            sock.close()
+    return [host for host in batch if host in accepted]
+
+
+async def async_probe_port(hosts: Iterable[ipaddress.IPv4Address], port: int = 80, timeout: float = 0.1,
+                           concurrency: int = 512) -> list:
+    """Asyncio version of probe_port
+
+    Parameters
+    ----------
+    hosts : Iterable[ipaddress.IPv4Address]
+        Hosts to probe, e.g. an ipaddress.IPv4Network or network.hosts()
+    port : int, optional
+        TCP port to probe, by default 80
+    timeout : float, optional
+        Time in seconds to wait for each connection, by default 0.1
+    concurrency : int, optional
+        Maximum number of connections opened at once, by default 512
+
+    Returns
+    -------
+    list
+        The hosts that accepted the connection, in the order they were passed
+    """
+
+    import asyncio
+
+    hosts = list(hosts)
+    accepted = set()
+    remaining = iter(hosts)
+
+    async def worker():
+        for host in remaining:
+            if await async_probe_host(host, port=port, timeout=timeout):
+                accepted.add(host)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(hosts)))))
+    return [host for host in hosts if host in accepted]
+
+
+async def async_probe_host(host: ipaddress.IPv4Address, port: int = 80, timeout: float = 0.1) -> bool:
+    """Returns True if <host> accepts a TCP connection on <port> within <timeout> seconds"""
+    import asyncio
+
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(str(host), port), timeout)
+    except (asyncio.TimeoutError, OSError):
+        return False
+    writer.transport.abort()
+    return True
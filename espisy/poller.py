@@ -0,0 +1,205 @@
+"""Background poller that refreshes every ESP of the device register on its own schedule"""
+
+import heapq
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .core import ESP
+from .errors import CircuitOpenError
+
+
+logger = logging.getLogger(__name__)
+
+
+class Poller():
+    """Refreshes the ESPs of the device register in the background
+
+    Every ESP is polled on its own interval, which is taken from the smallest TaskInterval of its /json output
+    (or its TTL) unless it is overridden. The first polls are spread over one interval and every following poll is
+    shifted by a random jitter, so the polls do not all fire at once. ESPs that fail are polled with an exponential
+    backoff. The refreshes run on a bounded pool of worker threads.
+    Readers simply use ESP.state or the device properties, which always return the latest snapshot without blocking.
+    ESPs that are added to or removed from the register while the poller runs are picked up automatically.
+    """
+
+    def __init__(self, register: dict = None, workers: int = 8, default_interval: float = 60,
+                 min_interval: float = 1, jitter: float = 0.1, max_backoff: float = 300, intervals: dict = None):
+        """Initializing the poller
+
+        Parameters
+        ----------
+        register : dict, optional
+            Dictionary ip -> ESP to poll, by default ESP._device_register
+        workers : int, optional
+            Number of worker threads and therefore maximum number of requests in flight, by default 8
+        default_interval : float, optional
+            Interval in seconds for ESPs without TaskInterval and TTL, by default 60
+        min_interval : float, optional
+            No ESP is polled more often than every <min_interval> seconds, by default 1
+        jitter : float, optional
+            Every interval is shifted randomly by up to +/- <jitter> times the interval, by default 0.1
+        max_backoff : float, optional
+            Maximum time in seconds between two polls of a failing ESP, by default 300
+        intervals : dict, optional
+            Overrides of the interval in seconds by ip or unit name, by default None
+        """
+
+        self.register = ESP._device_register if register is None else register
+        self.workers = workers
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.intervals = dict(intervals or {})
+        self._schedule = []
+        self._scheduled = {}
+        self._failures = {}
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._executor = None
+
+    def interval(self, esp: ESP) -> float:
+        """Returns the poll interval of an ESP in seconds
+
+        Parameters
+        ----------
+        esp : ESP
+            The ESP
+
+        Returns
+        -------
+        float
+            The override for its ip or name, else the smallest TaskInterval, else its TTL, else the default interval
+        """
+
+        interval = self.intervals.get(esp.ip, self.intervals.get(esp.name))
+        if interval is None:
+            task_intervals = [task.get("TaskInterval") for task in (esp.state or {}).get("Sensors", ())
+                              if task.get("TaskInterval")]
+            if task_intervals:
+                interval = min(task_intervals)
+            else:
+                interval = esp.ttl or self.default_interval
+        return max(interval, self.min_interval)
+
+    def set_interval(self, ip_or_name: str, interval: float = None):
+        """Overrides the poll interval of an ESP. Pass None to remove the override.
+
+        The new interval is used after the next poll of the ESP.
+        """
+
+        if interval is None:
+            self.intervals.pop(ip_or_name, None)
+        else:
+            self.intervals[ip_or_name] = interval
+
+    def failures(self, ip: str) -> int:
+        """Returns the number of consecutive failed polls of the ESP with <ip>"""
+        return self._failures.get(ip, 0)
+
+    @property
+    def running(self) -> bool:
+        """Returns True while the poller is running"""
+        return self._running
+
+    def start(self):
+        """Starts the poller in a background thread"""
+
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._schedule = []
+            self._scheduled = {}
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="espisy-poll")
+        self._thread = threading.Thread(target=self._run, name="espisy-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        """Stops the poller
+
+        Parameters
+        ----------
+        wait : bool, optional
+            Wait for running polls to finish, by default True
+        """
+
+        with self._condition:
+            if not self._running:
+                return
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self):
+        """Internal scheduler loop. Waits for the next due ESP and hands it to the worker threads"""
+
+        next_sync = 0
+        with self._condition:
+            while self._running:
+                now = time.monotonic()
+                if now >= next_sync:
+                    self._sync(now)
+                    next_sync = now + self.min_interval
+                while self._schedule and self._schedule[0][0] <= now:
+                    _, ip = heapq.heappop(self._schedule)
+                    esp = self.register.get(ip)
+                    if esp is None:
+                        # the ESP was removed from the register
+                        self._scheduled.pop(ip, None)
+                        continue
+                    self._executor.submit(self._poll, esp)
+                wait = next_sync - now
+                if self._schedule:
+                    wait = min(wait, self._schedule[0][0] - now)
+                self._condition.wait(max(wait, 0))
+
+    def _sync(self, now: float):
+        """Internal function to schedule new ESPs of the register. Their first poll is spread over one interval."""
+
+        for ip, esp in list(self.register.items()):
+            if ip not in self._scheduled:
+                self._scheduled[ip] = esp
+                heapq.heappush(self._schedule, (now + random.uniform(0, self.interval(esp)), ip))
+
+    def _poll(self, esp: ESP):
+        """Internal function that refreshes an ESP on a worker thread and schedules its next poll"""
+
+        interval = self.interval(esp)
+        try:
+            # a consumer may just have refreshed the ESP
+            esp.refresh(max_age=interval / 2)
+        except CircuitOpenError as e:
+            # the ESP failed too often, it is polled again when its breaker lets the next probe through
+            delay = max(e.retry_after, self.min_interval)
+            logger.debug(f"Skipping {esp.ip}, circuit open for {e.retry_after:.1f}s")
+        except Exception as e:
+            failures = self._failures.get(esp.ip, 0) + 1
+            self._failures[esp.ip] = failures
+            delay = min(interval * 2 ** failures, self.max_backoff)
+            logger.warning(f"Polling {esp.ip} failed {failures} times, next poll in {delay:.1f}s ({e})")
+        else:
+            self._failures.pop(esp.ip, None)
+            delay = interval
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        with self._condition:
+            if not self._running:
+                return
+            if self.register.get(esp.ip) is not esp:
+                # removed or replaced, the replacement is scheduled by the next sync
+                self._scheduled.pop(esp.ip, None)
+                return
+            heapq.heappush(self._schedule, (time.monotonic() + delay, esp.ip))
+            self._condition.notify_all()
@@ -0,0 +1,218 @@
+"""Receiver for the values ESPEasy pushes to a "Generic HTTP" controller
+
+Instead of polling /json, the ESPs send every new task value to espisy. Add a controller "Generic HTTP" in ESPEasy
+with the ip of the machine running espisy as Controller IP, the port of the receiver as Controller Port and the default
+publish template::
+
+    demo.php?name=%sysname%&task=%tskname%&valuename=%valname%&value=%value%
+
+and enable it for the tasks. The path of the template does not matter. The receiver looks up the ESP in the device
+register by the address the request came from and, if that fails (e.g. behind NAT), by its unit name. The value is
+stored in place by ESP.update_value, so Thermometer.temperature and the other device properties return it at once.
+The ESP has to be in the register with a state that contains the task, e.g. after ESP.add or a scan::
+
+    from espisy.push import PushReceiver
+
+    receiver = PushReceiver(port=8080)
+    receiver.start()
+    ...
+    receiver.stop()
+
+GET requests with the values in the query and POST requests with the values as form data are accepted.
+
+The receiver has no authentication: anyone who can reach its port can overwrite the values of the ESPs, and it listens
+on all interfaces by default. Bind it to the interface of the ESP network with host, or pass allowed_senders to only
+accept pushes from known addresses, e.g. the register itself to accept registered ESPs only::
+
+    receiver = PushReceiver(host="192.168.0.10", allowed_senders=ESP._device_register)
+"""
+
+import json
+import logging
+import threading
+from typing import Collection, Union
+from urllib.parse import parse_qs, urlsplit
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_value(text: str) -> Union[int, float, str]:
+    """Returns the value of a push like the /json output has it: numbers as int or float, everything else as str"""
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return text
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return text
+
+
+class PushReceiver():
+    """Threaded HTTP server that stores the pushed values in the ESPs of the device register"""
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 8080, register: dict = None, names: dict = None,
+                 allowed_senders: Collection[str] = None):
+        """Initializing the receiver without listening
+
+        Parameters
+        ----------
+        host : str, optional
+            Address to listen on, by default all addresses
+        port : int, optional
+            Port to listen on, 0 picks a free port, by default 8080
+        register : dict, optional
+            Dictionary ip -> ESP, by default ESP._device_register
+        names : dict, optional
+            Dictionary unit name -> ip, by default ESP._name_ip_map
+        allowed_senders : Collection[str], optional
+            Addresses that may push values, entries like "ip:port" match by their ip. It is read on every request, so
+            a dict like the register is kept up to date. By default None (every sender)
+        """
+
+        if register is None or names is None:
+            from .core import ESP
+            register = ESP._device_register if register is None else register
+            names = ESP._name_ip_map if names is None else names
+        self.host = host
+        self.port = port
+        self.register = register
+        self.names = names
+        self.allowed_senders = allowed_senders
+        self.accepted = 0
+        self.rejected = 0
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Starts listening in a background thread. If port is 0, port is set to the port that was picked."""
+
+        from http.server import ThreadingHTTPServer
+
+        if self._server is not None:
+            return
+        self._server = ThreadingHTTPServer((self.host, self.port), _handler_class(self))
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="espisy-push", daemon=True)
+        self._thread.start()
+        logger.info(f"Receiving pushed values on {self.host}:{self.port}")
+
+    def stop(self):
+        """Stops listening"""
+
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def handle(self, ip: str, path: str, body: bytes = b"") -> bool:
+        """Stores the values of a request. Used by the server, but can be called for pushes received otherwise.
+
+        Parameters
+        ----------
+        ip : str
+            Address of the ESP that sent the request
+        path : str
+            Path and query of the request
+        body : bytes, optional
+            Form data of a POST request, by default b""
+
+        Returns
+        -------
+        bool
+            True if the value was stored
+        """
+
+        if not self.is_allowed(ip):
+            self.rejected += 1
+            logger.warning(f"Rejected a push from {ip}, which is not an allowed sender")
+            return False
+        fields = parse_qs(urlsplit(path).query)
+        if body:
+            for key, values in parse_qs(body.decode(errors="replace")).items():
+                fields.setdefault(key, []).extend(values)
+        try:
+            task, value_name, value = fields["task"][0], fields["valuename"][0], fields["value"][0]
+        except KeyError:
+            self.rejected += 1
+            logger.debug(f"Push from {ip} without task, valuename or value: {path}")
+            return False
+        return self.ingest(ip, fields.get("name", [None])[0], task, value_name, value)
+
+    def is_allowed(self, ip: str) -> bool:
+        """Returns True if <ip> may push values"""
+
+        if self.allowed_senders is None:
+            return True
+        return any(sender.split(":", 1)[0] == ip for sender in list(self.allowed_senders))
+
+    def ingest(self, ip: str, name: str, task: str, value_name: str, value: Union[str, int, float]) -> bool:
+        """Stores a pushed value in the ESP with <ip> or the unit name <name>
+
+        Parameters
+        ----------
+        ip : str
+            Address of the ESP
+        name : str
+            Unit name of the ESP, used if no ESP with <ip> is registered
+        task : str
+            TaskName of the device
+        value_name : str
+            Name of the value
+        value : Union[str, int, float]
+            The value. Text is converted with parse_value.
+
+        Returns
+        -------
+        bool
+            True if the ESP, its task and the value were found
+        """
+
+        esp = self.register.get(ip)
+        if esp is None and name is not None:
+            esp = self.register.get(self.names.get(name))
+        if isinstance(value, str):
+            value = parse_value(value)
+        if esp is None or not esp.update_value(task, value_name, value):
+            self.rejected += 1
+            logger.debug(f"Dropped pushed value {task}.{value_name} of {name} ({ip}): unknown ESP, task or value")
+            return False
+        self.accepted += 1
+        return True
+
+
+def _handler_class(receiver: PushReceiver):
+    """Returns the request handler class of the server of <receiver>"""
+
+    from http.server import BaseHTTPRequestHandler
+
+    class PushHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._answer(receiver.handle(self.client_address[0], self.path))
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self._answer(receiver.handle(self.client_address[0], self.path, body))
+
+        def _answer(self, stored: bool):
+            body = b"OK" if stored else b"Unknown ESP, task or value"
+            self.send_response(200 if stored else 404)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f"{self.client_address[0]} {format % args}")
+
+    return PushHandler
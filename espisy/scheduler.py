@@ -0,0 +1,117 @@
+"""Per-ESP request scheduling
+
+ESPEasy only handles a few HTTP connections at once. Every ESP has a RequestScheduler that
+
+* caps the requests in flight to the ESP (default 2),
+* coalesces identical reads (/json and status,... commands): a read that is issued while the same read is in flight
+  waits for its answer instead of sending another request,
+* sends writes (all other commands) one after another in the order they were issued.
+
+A read is only coalesced with a read that was sent after the last write finished, so a read issued after a write
+always sees the result of the write.
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+
+def is_read(path: str) -> bool:
+    """Returns True for requests that do not change the ESP: /json and the status,... commands"""
+    return path == "json" or path.startswith("json?") or path[:19].lower() == "control?cmd=status,"
+
+
+class RequestScheduler():
+    """Request scheduler of an ESP for use from many threads"""
+
+    def __init__(self, max_concurrency: int = 2):
+        """Initializing the scheduler
+
+        Parameters
+        ----------
+        max_concurrency : int, optional
+            Maximum number of requests in flight to the ESP, by default 2
+        """
+
+        self.max_concurrency = max_concurrency
+        self.coalesced = 0
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._write_turn = threading.Condition(self._lock)
+        self._next_ticket = 0
+        self._serving = 0
+        # tickets of writes that gave up waiting for their turn
+        self._abandoned = set()
+        self._generation = 0
+        self._reads = {}
+
+    def request(self, path: str, function: Callable, *args, **kwargs):
+        """Returns function(*args, **kwargs), scheduled as request for <path>
+
+        Parameters
+        ----------
+        path : str
+            Everything that comes behind http://<ip>/, used to tell reads from writes and to coalesce reads
+        function : Callable
+            The function that sends the request
+        """
+
+        if is_read(path):
+            return self._read(path, function, *args, **kwargs)
+        return self._write(function, *args, **kwargs)
+
+    def _read(self, path: str, function: Callable, *args, **kwargs):
+        with self._lock:
+            in_flight = self._reads.get(path)
+            if in_flight is not None and in_flight[0] == self._generation:
+                self.coalesced += 1
+                future = in_flight[1]
+                owner = False
+            else:
+                future = Future()
+                self._reads[path] = (self._generation, future)
+                owner = True
+        if not owner:
+            return future.result()
+        try:
+            with self._slots:
+                result = function(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                if self._reads.get(path, (None, None))[1] is future:
+                    del self._reads[path]
+
+    def _write(self, function: Callable, *args, **kwargs):
+        with self._lock:
+            # writes are served strictly in the order of their tickets
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            try:
+                while self._serving != ticket:
+                    self._write_turn.wait()
+            except BaseException:
+                # an interrupted wait must not block the writes behind it
+                self._abandoned.add(ticket)
+                self._next_turn()
+                raise
+        try:
+            with self._slots:
+                return function(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._serving += 1
+                self._generation += 1
+                self._next_turn()
+
+    def _next_turn(self):
+        """Internal function that skips abandoned tickets and wakes the waiting writes. Must be called with the lock."""
+        while self._serving in self._abandoned:
+            self._abandoned.remove(self._serving)
+            self._serving += 1
+        self._write_turn.notify_all()
@@ -0,0 +1,196 @@
+"""Pluggable stores for the device settings of the ESPs
+
+The settings of an ESP are the devices that were created for it, as a list of
+{"name": <name>, "device_class": <class name>, "settings": {...}}.
+"""
+
+import copy
+import json
+import logging
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+
+
+logger = logging.getLogger(__name__)
+
+
+class SettingsStore(ABC):
+    """Base class of all settings stores. Subclasses implement load, load_all and save_all."""
+
+    @abstractmethod
+    def load(self, ip: str) -> list:
+        """Returns the device settings of the ESP with <ip> or None if there are none"""
+
+    def save(self, ip: str, devices: list):
+        """Saves the device settings of the ESP with <ip> and overwrites the old ones"""
+        self.save_all({ip: devices})
+
+    @abstractmethod
+    def load_all(self) -> dict:
+        """Returns the device settings of all ESPs as dict ip -> devices"""
+
+    @abstractmethod
+    def save_all(self, esps: dict):
+        """Saves the device settings of many ESPs at once
+
+        Parameters
+        ----------
+        esps : dict
+            ip -> devices. ESPs that are not passed keep their settings.
+        """
+
+    def import_yaml(self, filename: str):
+        """Imports the device settings from an esp.yaml file"""
+        self.save_all(YAMLSettingsStore(filename).load_all())
+
+    def export_yaml(self, filename: str):
+        """Exports the device settings to an esp.yaml file. Other entries of the file, like ipv4network, are kept."""
+        YAMLSettingsStore(filename).save_all(self.load_all())
+
+
+class YAMLSettingsStore(SettingsStore):
+    """Stores the settings in the esps list of esp.yaml
+
+    The parsed file is kept in memory as long as the file is not modified, so loading the settings of many ESPs only
+    parses the file once. Writes are serialized by a lock and replace the file atomically.
+    """
+
+    def __init__(self, filename: str):
+        """Initializing the store
+
+        Parameters
+        ----------
+        filename : str
+            Path of the esp.yaml file
+        """
+
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._mtime = None
+        self._settings = {}
+        self._index = {}
+
+    def _read(self) -> dict:
+        """Internal function that returns the parsed file and the index ip -> devices. Must be called with the lock."""
+
+        try:
+            mtime = os.stat(self.filename).st_mtime_ns
+        except FileNotFoundError:
+            self._mtime, self._settings, self._index = None, {}, {}
+            return self._settings
+        if mtime != self._mtime:
+            import yaml
+
+            with open(self.filename, "r") as save_file:
+                settings = yaml.safe_load(save_file) or {}
+            index = {}
+            for esp in settings.get("esps") or []:
+                for ip, details in esp.items():
+                    index[ip] = (details or {}).get("devices", [])
+            self._mtime, self._settings, self._index = mtime, settings, index
+        return self._settings
+
+    def load(self, ip: str) -> list:
+        with self._lock:
+            self._read()
+            # a copy, so changes of the caller do not leak into the cache
+            return copy.deepcopy(self._index.get(ip))
+
+    def load_all(self) -> dict:
+        with self._lock:
+            self._read()
+            return copy.deepcopy(self._index)
+
+    def save_all(self, esps: dict):
+        with self._lock:
+            settings = dict(self._read())
+            index = dict(self._index)
+            index.update(esps)
+            settings["esps"] = [{ip: {"devices": devices}} for ip, devices in index.items()]
+            self._write(settings)
+
+    def _write(self, settings: dict):
+        """Internal function that writes a temporary file and replaces esp.yaml with it"""
+
+        import yaml
+
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=directory, prefix=".esp.yaml.")
+        try:
+            with os.fdopen(fd, "w") as save_file:
+                yaml.dump(settings, save_file)
+                save_file.flush()
+                os.fsync(save_file.fileno())
+            os.replace(temp_name, self.filename)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+        self._mtime = None
+
+
+class SQLiteSettingsStore(SettingsStore):
+    """Stores the settings in a SQLite database with one row per device, indexed by the ip of the ESP
+
+    save_all writes all ESPs in one transaction. The database runs in WAL mode, so a crash never leaves half written
+    settings behind.
+    """
+
+    def __init__(self, filename: str):
+        """Initializing the store
+
+        Parameters
+        ----------
+        filename : str
+            Path of the database file, e.g. ~/.espisy/esp.sqlite
+        """
+
+        import sqlite3
+
+        self.filename = filename
+        self._lock = threading.Lock()
+        if filename != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=FULL")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS devices (
+                ip TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                device_class TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                PRIMARY KEY (ip, position))""")
+
+    def load(self, ip: str) -> list:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT name, device_class, settings FROM devices WHERE ip = ? ORDER BY position", (ip,)).fetchall()
+        if not rows:
+            return None
+        return [{"name": name, "device_class": device_class, "settings": json.loads(settings)}
+                for name, device_class, settings in rows]
+
+    def load_all(self) -> dict:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT ip, name, device_class, settings FROM devices ORDER BY ip, position").fetchall()
+        esps = {}
+        for ip, name, device_class, settings in rows:
+            esps.setdefault(ip, []).append(
+                {"name": name, "device_class": device_class, "settings": json.loads(settings)})
+        return esps
+
+    def save_all(self, esps: dict):
+        rows = [(ip, position, device["name"], device["device_class"], json.dumps(device.get("settings") or {}))
+                for ip, devices in esps.items() for position, device in enumerate(devices)]
+        with self._lock, self._connection:
+            self._connection.executemany("DELETE FROM devices WHERE ip = ?", ((ip,) for ip in esps))
+            self._connection.executemany("INSERT INTO devices VALUES (?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        """Closes the database"""
+        self._connection.close()
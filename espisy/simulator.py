@@ -0,0 +1,458 @@
+"""Simulator of ESPEasy units for load and fault tests without hardware
+
+A SimulatedUnit answers /json and /control?cmd=... like an ESPEasy device: GPIO, gpiotoggle, status,gpio (with the
+broken json of ESPEasy), LCD, LCDCMD and event. Units can have latency, a limit of open connections and sensor values
+that drift over time.
+
+The units are served either by a Simulator, an asyncio HTTP server that gives every unit its own loopback port or
+address, or in-process by a FakeTransport that does not open any socket::
+
+    with Simulator.fleet(100) as simulator:
+        esps = [ESP(unit.ip) for unit in simulator.units]
+
+    transport = FakeTransport.fleet(1000)
+    esps = [ESP(ip, transport=transport) for ip in transport.units]
+
+Every unit needs one file descriptor per listening socket and open connection. For thousands of units raise the limit
+of open files, e.g. with ulimit -n.
+"""
+
+import asyncio
+import copy
+import ipaddress
+import json
+import logging
+import math
+import random
+import threading
+import time
+from typing import Callable, Iterable
+from urllib.parse import parse_qs, urlsplit
+
+from .constants import test_state
+from .transport import Response
+
+
+logger = logging.getLogger(__name__)
+
+
+def sine(mean: float, amplitude: float, period: float) -> Callable:
+    """Returns a drift function that oscillates around <mean> with a period of <period> seconds"""
+    return lambda elapsed: round(mean + amplitude * math.sin(2 * math.pi * elapsed / period), 2)
+
+
+def ramp(start: float, slope: float) -> Callable:
+    """Returns a drift function that starts at <start> and changes by <slope> per second"""
+    return lambda elapsed: round(start + slope * elapsed, 2)
+
+
+class SimulatedUnit():
+    """A virtual ESPEasy unit
+
+    The state is a copy of the /json answer. Commands change the GPIOs, the LCD and the recorded events, which can be
+    inspected by the tests. paths records the path of every request, accepted the number of connections a Simulator
+    accepted for the unit.
+    """
+
+    lcd_rows = 4
+    lcd_columns = 20
+
+    def __init__(self, name: str = "ESP_Easy", state: dict = None, latency: float = 0, jitter: float = 0,
+                 max_connections: int = 4, drift: dict = None, malformed_status: bool = True, gpios: dict = None):
+        """Initializing the unit
+
+        Parameters
+        ----------
+        name : str, optional
+            Unit Name of the ESPEasy device, by default "ESP_Easy"
+        state : dict, optional
+            /json answer of the unit, by default espisy.constants.test_state
+        latency : float, optional
+            Seconds every request takes at least, by default 0
+        jitter : float, optional
+            Maximum random seconds added to the latency, by default 0
+        max_connections : int, optional
+            Number of connections the unit accepts at once. Further connections are reset, like on a busy ESP.
+            None for no limit, by default 4
+        drift : dict, optional
+            (TaskName, ValueName) -> function(elapsed seconds) that returns the value, e.g. sine(20, 2, 600).
+            The values are updated whenever /json is requested. By default the values do not change.
+        malformed_status : bool, optional
+            Answer status,gpio with the broken json of ESPEasy, by default True
+        gpios : dict, optional
+            Initial states pin -> 0 or 1, by default all pins are 0
+        """
+
+        self.name = name
+        self.state = copy.deepcopy(test_state if state is None else state)
+        self.state.setdefault("System", {})["Unit Name"] = name
+        self.latency = latency
+        self.jitter = jitter
+        self.max_connections = max_connections
+        self.drift = dict(drift or {})
+        self.malformed_status = malformed_status
+        self.gpios = dict(gpios or {})
+        self.lcd = [" " * self.lcd_columns for _ in range(self.lcd_rows)]
+        self.lcd_on = True
+        self.events = []
+        self.commands = []
+        self.requests = 0
+        self.paths = []
+        self.rejected = 0
+        self.accepted = 0
+        self.connections = 0
+        self.host = None
+        self.port = None
+        self.ip = None
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"SimulatedUnit({self.name!r}, ip={self.ip!r})"
+
+    def delay(self) -> float:
+        """Returns the seconds the next request takes"""
+        if self.jitter:
+            return self.latency + random.uniform(0, self.jitter)
+        return self.latency
+
+    def set_value(self, task_name: str, value_name: str, value):
+        """Sets a value of the /json answer, e.g. set_value("DHT", "Temperature", 25)"""
+        with self._lock:
+            self._set_value(task_name, value_name, value)
+
+    def _set_value(self, task_name: str, value_name: str, value):
+        for task in self.state.get("Sensors", ()):
+            if task.get("TaskName") == task_name:
+                for task_value in task.get("TaskValues", ()):
+                    if task_value.get("Name") == value_name:
+                        task_value["Value"] = value
+                        return
+        raise KeyError(f"{task_name}.{value_name}")
+
+    def handle(self, path: str) -> tuple:
+        """Answers a request
+
+        Parameters
+        ----------
+        path : str
+            Path and query of the request, e.g. /control?cmd=GPIO,2,1
+
+        Returns
+        -------
+        tuple
+            (status code, content type, body)
+        """
+
+        split = urlsplit(path)
+        with self._lock:
+            self.requests += 1
+            self.paths.append(path)
+            if split.path == "/json":
+                return 200, "application/json", self._json()
+            if split.path == "/control":
+                return self._control(parse_qs(split.query).get("cmd", [""])[0])
+        return 404, "text/plain", b"Not found"
+
+    def _json(self) -> bytes:
+        elapsed = time.monotonic() - self._started
+        for (task_name, value_name), function in self.drift.items():
+            self._set_value(task_name, value_name, function(elapsed))
+        self.state.setdefault("System", {})["Uptime"] = int(elapsed // 60)
+        return json.dumps(self.state).encode()
+
+    def _control(self, cmd: str) -> tuple:
+        self.commands.append(cmd)
+        args = cmd.split(",")
+        command = args[0].lower()
+        try:
+            if command == "gpio":
+                pin, value = int(args[1]), 1 if int(args[2]) else 0
+                self.gpios[pin] = value
+                return self._gpio_answer(pin, f"GPIO {pin} Set to {value}")
+            if command == "gpiotoggle":
+                pin = int(args[1])
+                self.gpios[pin] = 1 - self.gpios.get(pin, 0)
+                return self._gpio_answer(pin, f"GPIO {pin} toggled to {self.gpios[pin]}")
+            if command == "status" and args[1].lower() == "gpio":
+                pin = int(args[2])
+                if self.malformed_status:
+                    # ESPEasy forgets a comma in this answer, see espisy.core._gpio_status_answer
+                    body = f'{{"log": "", "plugin": 1, "pin": {pin}, "mode": "output" "state": {self.gpios.get(pin, 0)}}}'
+                    return 200, "application/json", body.encode()
+                return self._gpio_answer(pin, "")
+            if command == "lcd":
+                row, column = int(args[1]), int(args[2])
+                text = ",".join(args[3:])
+                line = self.lcd[row - 1]
+                self.lcd[row - 1] = (line[:column - 1] + text + line[column - 1 + len(text):])[:self.lcd_columns]
+                return 200, "text/plain", b"OK"
+            if command == "lcdcmd":
+                argument = args[1].lower()
+                if argument == "clear":
+                    self.lcd = [" " * self.lcd_columns for _ in range(self.lcd_rows)]
+                elif argument in ("on", "off"):
+                    self.lcd_on = argument == "on"
+                else:
+                    raise ValueError(argument)
+                return 200, "text/plain", b"OK"
+            if command == "event":
+                self.events.append(",".join(args[1:]))
+                return 200, "text/plain", b"OK"
+        except (IndexError, ValueError):
+            return 200, "text/plain", b"Command argument error"
+        return 200, "text/plain", b"Unknown or restricted command!"
+
+    def _gpio_answer(self, pin: int, log: str) -> tuple:
+        body = json.dumps({"log": log, "plugin": 1, "pin": pin, "mode": "output", "state": self.gpios[pin]})
+        return 200, "application/json", body.encode()
+
+
+def _fleet_units(count: int, **unit_kwargs) -> list:
+    """Returns <count> units named ESP_0001, ESP_0002, ..."""
+    return [SimulatedUnit(name=f"ESP_{number:04d}", **unit_kwargs) for number in range(1, count + 1)]
+
+
+class Simulator():
+    """asyncio HTTP server for SimulatedUnits
+
+    Every unit listens on its own socket. Use it with async with inside a running event loop, or with with to run
+    the server on a background thread.
+    """
+
+    def __init__(self, units: Iterable[SimulatedUnit] = (), host: str = "127.0.0.1", port: int = 0,
+                 shared_port: bool = False):
+        """Initializing the simulator
+
+        Parameters
+        ----------
+        units : Iterable[SimulatedUnit], optional
+            The units to serve, by default none. Further units can be added before start with add.
+        host : str, optional
+            Address of units that were added without their own host, by default "127.0.0.1"
+        port : int, optional
+            Port of all units. 0 gives every unit a free port, by default 0
+        shared_port : bool, optional
+            If True and port is 0, all units get the free port of the first unit. The units then need different
+            hosts, like ESPs in a real network. By default False
+        """
+
+        self.units = []
+        self.host = host
+        self.port = port
+        self.shared_port = shared_port
+        self._servers = []
+        self._connections = {}
+        self._loop = None
+        self._thread = None
+        for unit in units:
+            self.add(unit)
+
+    @classmethod
+    def fleet(cls, count: int, network: str = None, port: int = 0, **unit_kwargs) -> "Simulator":
+        """Returns a simulator with <count> units named ESP_0001, ESP_0002, ...
+
+        Parameters
+        ----------
+        count : int
+            Number of units
+        network : str, optional
+            Loopback network like "127.0.1.0/24". Every unit gets an address of the network and all units share one
+            port, so the fleet can be found with ESP.scan_network(network, port=simulator.port).
+            By default all units listen on 127.0.0.1 with their own port.
+        port : int, optional
+            Port of the units, by default a free port
+        **unit_kwargs
+            Passed to every SimulatedUnit, e.g. latency=0.01
+        """
+
+        units = _fleet_units(count, **unit_kwargs)
+        if network is None:
+            return cls(units, port=port)
+        simulator = cls(port=port, shared_port=True)
+        for unit, host in zip(units, ipaddress.ip_network(network).hosts()):
+            simulator.add(unit, host=str(host))
+        return simulator
+
+    def add(self, unit: SimulatedUnit, host: str = None) -> SimulatedUnit:
+        """Adds a unit. Units that are added after start are not served."""
+        unit.host = host or self.host
+        self.units.append(unit)
+        return unit
+
+    async def start(self):
+        """Starts listening for all units"""
+
+        for unit in self.units:
+            server = await asyncio.start_server(lambda reader, writer, unit=unit: self._serve(unit, reader, writer),
+                                                unit.host, self.port, reuse_address=True)
+            unit.port = server.sockets[0].getsockname()[1]
+            unit.ip = f"{unit.host}:{unit.port}"
+            if self.shared_port and not self.port:
+                self.port = unit.port
+            self._servers.append(server)
+        logger.debug(f"Serving {len(self.units)} simulated units")
+
+    async def stop(self):
+        """Closes all sockets of the units"""
+
+        for server in self._servers:
+            server.close()
+        # open keep-alive connections are reset, so that their handlers finish
+        for writer in self._connections.values():
+            writer.transport.abort()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    def __enter__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="espisy-simulator", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(), self._loop).result()
+        return self
+
+    def __exit__(self, *args):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = self._thread = None
+
+    async def _serve(self, unit: SimulatedUnit, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answers the requests of one connection, keeping it alive until the client closes it"""
+
+        if unit.max_connections is not None and unit.connections >= unit.max_connections:
+            unit.rejected += 1
+            writer.transport.abort()
+            return
+        unit.accepted += 1
+        unit.connections += 1
+        connection = asyncio.current_task()
+        self._connections[connection] = writer
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                method, path, version = request_line.decode("latin-1").split()
+                delay = unit.delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                status, content_type, body = unit.handle(path)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write((f"HTTP/1.1 {status} {'OK' if status == 200 else 'Not Found'}\r\n"
+                              f"Content-Type: {content_type}\r\n"
+                              f"Content-Length: {len(body)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self._connections.pop(connection, None)
+            unit.connections -= 1
+            writer.close()
+
+
+class FakeTransport():
+    """Transport that answers from SimulatedUnits in-process, without sockets
+
+    Can be passed to ESP as transport. Measures the overhead of espisy without the network.
+    """
+
+    def __init__(self, units: Iterable[SimulatedUnit] = (), network: str = "10.0.0.0/8", sleep: bool = False):
+        """Initializing the transport
+
+        Parameters
+        ----------
+        units : Iterable[SimulatedUnit], optional
+            The units. Units without ip get the next address of <network>, by default none
+        network : str, optional
+            Addresses for units without ip, by default "10.0.0.0/8"
+        sleep : bool, optional
+            If True, every request sleeps for the latency of the unit, by default False
+        """
+
+        self.units = {}
+        self.sleep = sleep
+        self._hosts = ipaddress.ip_network(network).hosts()
+        for unit in units:
+            self.add(unit)
+
+    @classmethod
+    def fleet(cls, count: int, network: str = "10.0.0.0/8", sleep: bool = False, **unit_kwargs) -> "FakeTransport":
+        """Returns a transport with <count> units named ESP_0001, ESP_0002, ... See Simulator.fleet"""
+        return cls(_fleet_units(count, **unit_kwargs), network=network, sleep=sleep)
+
+    def add(self, unit: SimulatedUnit) -> SimulatedUnit:
+        """Adds a unit and gives it an ip if it has none"""
+        if unit.ip is None:
+            unit.ip = str(next(self._hosts))
+        self.units[unit.ip] = unit
+        return unit
+
+    def _unit(self, url: str) -> tuple:
+        """Internal function that returns the unit and the path of <url>"""
+        split = urlsplit(url)
+        unit = self.units.get(split.netloc)
+        if unit is None:
+            import requests
+            raise requests.ConnectionError(f"No simulated unit at {split.netloc}")
+        return unit, split.path + (f"?{split.query}" if split.query else "")
+
+    def _answer(self, url: str, unit: SimulatedUnit, path: str) -> Response:
+        status, content_type, body = unit.handle(path)
+        return Response(url, status, body)
+
+    def get(self, url: str, timeout: float = None) -> Response:
+        """Answers the request like Transport.get"""
+        unit, path = self._unit(url)
+        if self.sleep:
+            time.sleep(unit.delay())
+        return self._answer(url, unit, path)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AsyncFakeTransport(FakeTransport):
+    """FakeTransport for espisy.aio.AsyncESP"""
+
+    async def get(self, url: str, timeout: float = None) -> Response:
+        """Answers the request like espisy.aio.AsyncTransport.get"""
+        unit, path = self._unit(url)
+        if self.sleep:
+            await asyncio.sleep(unit.delay())
+        return self._answer(url, unit, path)
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
@@ -0,0 +1,147 @@
+"""Compact representation of the /json output of an ESPEasy device
+
+The tasks and their values are kept in slotted objects. All other sections, like System and WiFi, are kept as the raw
+bytes of the answer and only decoded when they are accessed. Every object can still be used like the dicts of the
+decoded json, e.g. state["Sensors"][0]["TaskValues"][0]["Value"] or state["System"]["Unit Name"].
+"""
+
+import json
+from collections.abc import Mapping
+from typing import Union
+
+
+class _SlottedMapping(Mapping):
+    """Base class for slotted objects that can be accessed like the dict they were built from
+
+    _fields maps the json keys to the slots. Keys without slot are stored in _extra.
+    """
+
+    __slots__ = ("_extra",)
+    _fields = {}
+
+    def __getitem__(self, key):
+        attribute = self._fields.get(key)
+        if attribute is not None:
+            return getattr(self, attribute)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        attribute = self._fields.get(key)
+        if attribute is not None:
+            setattr(self, attribute, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __iter__(self):
+        yield from self._fields
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return len(self._fields) + (len(self._extra) if self._extra is not None else 0)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)})"
+
+    def _set_fields(self, data: dict):
+        """Internal function that fills the slots from a decoded dict"""
+        extra = None
+        for key, value in data.items():
+            attribute = self._fields.get(key)
+            if attribute is not None:
+                setattr(self, attribute, value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        self._extra = extra
+
+
+class TaskValue(_SlottedMapping):
+    """A value of a task, e.g. {"ValueNumber": 1, "Name": "Temperature", "NrDecimals": 2, "Value": 20.6}"""
+
+    __slots__ = ("number", "name", "decimals", "value")
+    _fields = {"ValueNumber": "number", "Name": "name", "NrDecimals": "decimals", "Value": "value"}
+
+    def __init__(self, data: dict):
+        self.number = self.name = self.decimals = self.value = None
+        self._set_fields(data)
+
+
+class Task(_SlottedMapping):
+    """A task (ESPEasy device) of the Sensors section. The TaskValues are kept as tuple of TaskValue"""
+
+    __slots__ = ("name", "type", "number", "device_number", "enabled", "interval", "values")
+    _fields = {"TaskName": "name", "Type": "type", "TaskNumber": "number", "TaskDeviceNumber": "device_number",
+               "TaskEnabled": "enabled", "TaskInterval": "interval", "TaskValues": "values"}
+
+    def __init__(self, data: dict):
+        self.name = self.type = self.number = self.device_number = self.enabled = self.interval = None
+        self._set_fields(data)
+        self.values = tuple(TaskValue(value) for value in (self.values or ()))
+
+
+class State(Mapping):
+    """Compact /json output of an ESP
+
+    Sensors and TTL are decoded into slotted objects. The other sections are decoded from the raw answer on access.
+    """
+
+    __slots__ = ("raw", "sensors", "ttl", "unit_name", "_keys", "_sections")
+
+    def __init__(self, raw: bytes, decoded: dict = None):
+        """Initializing the state
+
+        Parameters
+        ----------
+        raw : bytes
+            The raw /json answer of the ESP
+        decoded : dict, optional
+            The answer decoded as json, if it was already decoded, by default None
+        """
+
+        if decoded is None:
+            decoded = json.loads(raw)
+        self.raw = raw
+        self.sensors = [Task(task) for task in decoded.get("Sensors") or ()]
+        self.ttl = decoded.get("TTL")
+        self.unit_name = (decoded.get("System") or {}).get("Unit Name")
+        self._keys = tuple(decoded)
+        self._sections = None
+
+    @classmethod
+    def from_json(cls, state: Union[bytes, str, dict, "State"]) -> "State":
+        """Returns a State for the raw or decoded /json answer. States are returned unchanged."""
+
+        if isinstance(state, State):
+            return state
+        if isinstance(state, (bytes, bytearray, str)):
+            return cls(state)
+        return cls(json.dumps(state).encode(), decoded=state)
+
+    def __getitem__(self, key):
+        if key == "Sensors":
+            return self.sensors
+        if key == "TTL" and self.ttl is not None:
+            return self.ttl
+        if key not in self._keys:
+            raise KeyError(key)
+        if self._sections is None:
+            self._sections = {}
+        if key not in self._sections:
+            # only the accessed section is kept after decoding
+            self._sections[key] = json.loads(self.raw)[key]
+        return self._sections[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"State({self.raw[:60]!r}...)"
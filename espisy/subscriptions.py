@@ -0,0 +1,197 @@
+"""Change-detection subscriptions for the values of the ESPs
+
+On every refresh the new task index of an ESP is compared with the previous one, value by value. Only the values that
+changed are passed to the subscribers whose filter (ESP, device name, value name) matches. If nobody subscribed to an
+ESP, the comparison is skipped completely.
+"""
+
+import logging
+import threading
+from collections import Counter, namedtuple
+from typing import Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+Change = namedtuple("Change", ["esp", "device", "value", "old", "new"])
+Change.__doc__ = """A value that changed between two refreshes
+
+esp is the ESP, device the TaskName and value the name of the value, e.g. "Temperature".
+old is None for tasks and values that were added, new is None for tasks and values that were removed.
+"""
+
+
+class Subscription():
+    """Handle of a registered callback. Call cancel() to stop receiving changes."""
+
+    __slots__ = ("callback", "ip", "device", "value", "_subscriptions")
+
+    def __init__(self, subscriptions: "Subscriptions", callback: Callable, ip: str = None, device: str = None,
+                 value: str = None):
+        self._subscriptions = subscriptions
+        self.callback = callback
+        self.ip = ip
+        self.device = device
+        self.value = value
+
+    @property
+    def key(self) -> tuple:
+        """Returns the filter (ip, device, value) of the subscription. None matches everything."""
+        return (self.ip, self.device, self.value)
+
+    def cancel(self):
+        """Removes the subscription. Cancelling twice does nothing."""
+        self._subscriptions.remove(self)
+
+    def __repr__(self):
+        return f"Subscription({self.callback!r}, ip={self.ip!r}, device={self.device!r}, value={self.value!r})"
+
+
+class Subscriptions():
+    """Register of all subscriptions, indexed by their filter
+
+    A change is looked up by its exact (ip, device, value) and the combinations with wildcards, so the cost of
+    dispatching does not grow with the number of unrelated subscribers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_key = {}
+        # ip -> Counter of watched device names, None counts subscriptions for all devices
+        self._watched = {}
+
+    def add(self, callback: Callable, ip: str = None, device: str = None, value: str = None) -> Subscription:
+        """Registers <callback> for all changes that match the filter
+
+        Parameters
+        ----------
+        callback : Callable
+            Called with a Change for every changed value
+        ip : str, optional
+            Only changes of the ESP with this ip, by default all ESPs
+        device : str, optional
+            Only changes of the device (TaskName), by default all devices
+        value : str, optional
+            Only changes of the value, e.g. "Temperature", by default all values
+
+        Returns
+        -------
+        Subscription
+            The handle to cancel the subscription
+        """
+
+        subscription = Subscription(self, callback, ip, device, value)
+        with self._lock:
+            self._by_key.setdefault(subscription.key, []).append(subscription)
+            self._watched.setdefault(ip, Counter())[device] += 1
+        return subscription
+
+    def remove(self, subscription: Subscription):
+        """Removes a subscription"""
+
+        with self._lock:
+            subscriptions = self._by_key.get(subscription.key)
+            if not subscriptions or subscription not in subscriptions:
+                return
+            subscriptions.remove(subscription)
+            if not subscriptions:
+                del self._by_key[subscription.key]
+            watched = self._watched[subscription.ip]
+            watched[subscription.device] -= 1
+            if watched[subscription.device] <= 0:
+                del watched[subscription.device]
+            if not watched:
+                del self._watched[subscription.ip]
+
+    def __len__(self):
+        return sum(len(subscriptions) for subscriptions in self._by_key.values())
+
+    def watched_devices(self, ip: str):
+        """Returns the device names that have subscribers for the ESP with <ip>
+
+        Returns
+        -------
+        set or None
+            None if no subscription matches the ESP, a set containing None if all devices are watched
+        """
+
+        watched = self._watched.get(ip)
+        watched_all = self._watched.get(None)
+        if not watched and not watched_all:
+            return None
+        devices = set()
+        if watched:
+            devices.update(watched)
+        if watched_all:
+            devices.update(watched_all)
+        return devices
+
+    def diff(self, esp, old_tasks: dict, new_tasks: dict, devices: set) -> list:
+        """Returns the Changes between two task indexes of <esp>
+
+        Parameters
+        ----------
+        esp : ESP
+            The ESP the indexes belong to
+        old_tasks, new_tasks : dict
+            TaskName -> (task, {ValueName: value}) as built by ESP._update_state
+        devices : set
+            The device names to compare, see watched_devices
+
+        Returns
+        -------
+        list
+            Changes of all values that differ
+        """
+
+        if None in devices:
+            names = list(new_tasks)
+            names.extend(name for name in old_tasks if name not in new_tasks)
+        else:
+            names = devices
+        changes = []
+        for name in names:
+            old = old_tasks.get(name)
+            new = new_tasks.get(name)
+            if old is new:
+                continue
+            old_values = old[1] if old is not None else {}
+            new_values = new[1] if new is not None else {}
+            for value_name, new_value in new_values.items():
+                old_value = old_values.get(value_name)
+                if old_value is None:
+                    changes.append(Change(esp, name, value_name, None, new_value.value))
+                elif old_value.value != new_value.value:
+                    changes.append(Change(esp, name, value_name, old_value.value, new_value.value))
+            for value_name, old_value in old_values.items():
+                if value_name not in new_values:
+                    changes.append(Change(esp, name, value_name, old_value.value, None))
+        return changes
+
+    def dispatch(self, ip: str, changes: list):
+        """Calls the matching subscribers for every change. Exceptions of the callbacks are logged, not raised."""
+
+        by_key = self._by_key
+        for change in changes:
+            for key in ((ip, change.device, change.value), (ip, change.device, None), (ip, None, change.value),
+                        (ip, None, None), (None, change.device, change.value), (None, change.device, None),
+                        (None, None, change.value), (None, None, None)):
+                subscriptions = by_key.get(key)
+                if not subscriptions:
+                    continue
+                for subscription in tuple(subscriptions):
+                    try:
+                        subscription.callback(change)
+                    except Exception:
+                        logger.exception(f"Subscriber {subscription.callback!r} failed for {change}")
+
+    def publish(self, esp, old_tasks: dict, new_tasks: dict):
+        """Compares two task indexes of <esp> and sends the changes to the subscribers"""
+
+        devices = self.watched_devices(esp.ip)
+        if devices is None:
+            return
+        changes = self.diff(esp, old_tasks, new_tasks, devices)
+        if changes:
+            self.dispatch(esp.ip, changes)
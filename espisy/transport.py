@@ -0,0 +1,160 @@
+"""HTTP transport that keeps pooled keep-alive connections to the ESPEasy devices"""
+
+import json
+import logging
+import threading
+
+from .instrumentation import instrumentation
+
+
+logger = logging.getLogger(__name__)
+
+
+class Response():
+    """Completely read answer of an ESP
+
+    Mirrors the parts of requests.Response that espisy uses, so that the answers can be parsed the same way.
+    """
+
+    def __init__(self, url: str, status_code: int, content: bytes, encoding: str = "utf-8"):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self) -> str:
+        """Returns the decoded body"""
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        """Returns the body decoded as json. Raises json.JSONDecodeError if ESPEasy did not send valid json"""
+        return json.loads(self.text)
+
+
+class Transport():
+    """Pooled HTTP transport shared by ESP instances
+
+    Wraps a requests.Session so that repeated requests to the same ESP reuse their socket instead of
+    opening a new TCP connection for every call. One transport is usually shared by the whole fleet.
+    """
+
+    def __init__(self, pool_connections: int = 256, pool_size: int = 2, timeout: float = 3,
+                 retries: int = 2, backoff_factor: float = 0.1):
+        """Initializing the transport
+
+        Parameters
+        ----------
+        pool_connections : int, optional
+            Number of hosts (ESPs) whose connection pools are kept alive, by default 256
+        pool_size : int, optional
+            Number of keep-alive connections per ESP. ESPEasy only handles a few connections, by default 2
+        timeout : float, optional
+            Default timeout in seconds for every request that does not pass its own, by default 3
+        retries : int, optional
+            Number of retries on connection errors, by default 2.
+            Requests that reached the ESP are never retried, because commands like gpiotoggle are not idempotent.
+        backoff_factor : float, optional
+            Backoff factor between retries, by default 0.1
+        """
+
+        # requests is imported on first use, so that importing espisy stays fast
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.timeout = timeout
+        self.retry = _counting_retry_class()(total=retries, connect=retries, read=False, status=0, redirect=0,
+                           backoff_factor=backoff_factor, raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_size,
+                                   max_retries=self.retry, pool_block=False)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+
+    def get(self, url: str, timeout: float = None) -> "requests.Response":
+        """Sends a GET request over the pooled session
+
+        Parameters
+        ----------
+        url : str
+            Complete url, e.g. http://192.168.0.2/json
+        timeout : float, optional
+            Timeout in seconds, by default the timeout of the transport
+
+        Returns
+        -------
+        requests.Response
+            The response of the ESP
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+        return self.session.get(url, timeout=timeout)
+
+    def close(self):
+        """Closes all pooled connections"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_CountingRetry = None
+
+
+def _counting_retry_class() -> type:
+    """Returns a subclass of urllib3's Retry that counts the retries for the instrumentation
+
+    The class is created on first use, so that urllib3 is only imported with the first transport.
+    """
+
+    global _CountingRetry
+    if _CountingRetry is None:
+        from urllib3.util.retry import Retry
+
+        class CountingRetry(Retry):
+            def increment(self, *args, **kwargs):
+                # raises if there are no retries left, so only real retries are counted
+                retry = super().increment(*args, **kwargs)
+                pool = kwargs.get("_pool")
+                if instrumentation.enabled and pool is not None:
+                    ip = pool.host if pool.port in (None, 80) else f"{pool.host}:{pool.port}"
+                    instrumentation.count(ip, "retries")
+                return retry
+
+        _CountingRetry = CountingRetry
+    return _CountingRetry
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport() -> Transport:
+    """Returns the transport that is shared by all ESPs that were not given their own transport
+
+    The transport is created on first use.
+    """
+
+    global _default_transport
+    if _default_transport is None:
+        with _default_transport_lock:
+            if _default_transport is None:
+                _default_transport = Transport()
+    return _default_transport
+
+
+def set_default_transport(transport: Transport):
+    """Replaces the shared transport, e.g. to change pool size, timeout or retries for the whole fleet
+
+    Parameters
+    ----------
+    transport : Transport
+        The new default transport. ESPs that were created before keep their transport.
+    """
+
+    global _default_transport
+    with _default_transport_lock:
+        _default_transport = transport
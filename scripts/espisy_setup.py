@@ -99,14 +99,13 @@ If you do not set one, the scanning function will not work.\n[y/n]{Style.RESET_A
 def perform_scan():
     print(f"{Style.BRIGHT}Do you want to perform a scan for ESPs now?\n[y/n]{Style.RESET_ALL}")
     if input(">>> ").lower() in positive_answer:
-        ESP.scan_network()
         msg_length = len(f"| ESP | {' ':20} | {' ':20}|")
         line = "+" + "-"*(msg_length-2) + "+"
         print(
             f"\n{Style.BRIGHT}Found the following ESPEasy devices.{Style.RESET_ALL}")
         print(line)
-        for ip, esp in ESP._device_register.items():
-            message = f"| ESP | {Fore.BLUE}{esp.name:^20}{Style.RESET_ALL} | {Fore.BLUE}{ip:^20}{Style.RESET_ALL}|"
+        for esp in ESP.iter_scan():
+            message = f"| ESP | {Fore.BLUE}{esp.name:^20}{Style.RESET_ALL} | {Fore.BLUE}{esp.ip:^20}{Style.RESET_ALL}|"
             print(message)
             print(line)
         return [(device.ip, device.name) for device in ESP._device_register.values()]
@@ -21,5 +21,6 @@ setuptools.setup(
     ],
     scripts=['scripts/espisy_setup.py'],
     install_requires=['requests','pyyaml','colorama'],
-    python_requires='>=3.5',
+    extras_require={'async': ['aiohttp'], 'history': ['numpy']},
+    python_requires='>=3.9',
 )
\ No newline at end of file
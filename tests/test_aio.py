@@ -0,0 +1,57 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from espisy.aio import AsyncESP, AsyncTransport, get_default_async_transport
+from espisy.constants import test_state
+from espisy.devices import DHT, GPIO
+from espisy.simulator import SimulatedUnit, Simulator
+
+
+class TestAsyncESP(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.simulator = Simulator([SimulatedUnit(test_state["System"]["Unit Name"])]).__enter__()
+        self.unit = self.simulator.units[0]
+
+    def tearDown(self):
+        self.simulator.__exit__()
+
+    async def test_connect_and_devices(self):
+        async with AsyncTransport(timeout=2) as transport:
+            esp = await AsyncESP.connect(self.unit.ip, transport=transport)
+            self.assertEqual(esp.name, test_state["System"]["Unit Name"])
+            self.assertIsInstance(esp.device("DHT", device_type="DHT"), DHT)
+            self.assertEqual(esp.device("DHT").temperature, 20.60)
+            led = esp.device("led", device_type="GPIO", settings={"pin": 2})
+            self.assertIsInstance(led, GPIO)
+            self.assertEqual(await led.on(), 1)
+            self.assertEqual(await led.pinstate, 1)
+            self.assertEqual(self.unit.paths[1:], ["/control?cmd=GPIO,2,1", "/control?cmd=status,gpio,2"])
+
+    async def test_many_requests_in_flight(self):
+        async with AsyncTransport(timeout=2) as transport:
+            esp = await AsyncESP.connect(self.unit.ip, transport=transport)
+            answers = await asyncio.gather(*(esp.gpio_on(2) for _ in range(50)))
+            self.assertEqual(answers, [1] * 50)
+
+    async def test_add_registers_esp(self):
+        esp = await AsyncESP.add(self.unit.ip)
+        self.assertIs(AsyncESP.get(self.unit.ip), esp)
+        self.assertIs(AsyncESP.get(esp.name), esp)
+        AsyncESP.remove(self.unit.ip)
+        transport = get_default_async_transport()
+        await AsyncESP.close_default_transport()
+        self.assertTrue(transport._session.closed)
+        self.assertIsNot(get_default_async_transport(), transport)
+        await AsyncESP.close_default_transport()
+
+
+class TestDefaultTransport(TestCase):
+    def test_asyncio_run_closes_the_default_transport(self):
+        with Simulator([SimulatedUnit()]) as simulator:
+            unit = simulator.units[0]
+
+            async def main():
+                await AsyncESP.connect(unit.ip)
+                return get_default_async_transport()
+            transport = asyncio.run(main())
+        self.assertTrue(transport._session.closed)
@@ -0,0 +1,61 @@
+import time
+from unittest import TestCase
+
+from espisy.breaker import CircuitBreaker
+from espisy.core import ESP
+from espisy.errors import CircuitOpenError
+from espisy.simulator import FakeTransport, SimulatedUnit
+
+
+class TestCircuitBreaker(TestCase):
+    def test_opens_and_probes(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        for _ in range(2):
+            breaker.before_request()
+            breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.available)
+        with self.assertRaises(CircuitOpenError) as context:
+            breaker.before_request()
+        self.assertGreater(context.exception.retry_after, 0)
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, "half_open")
+        breaker.before_request()
+        # only one probe at a time
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertGreater(breaker.retry_after, 0.05)
+        time.sleep(0.11)
+        breaker.before_request()
+        breaker.record_success(0.01)
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual(breaker.failures, 0)
+
+    def test_adaptive_timeout(self):
+        breaker = CircuitBreaker(min_timeout=0.1, min_samples=3)
+        self.assertEqual(breaker.timeout(3), 3)
+        for _ in range(3):
+            breaker.record_success(0.05)
+        # srtt + 4 * rttvar = 0.05 + 4 * 0.0140625
+        self.assertAlmostEqual(breaker.timeout(3), 0.10625)
+        breaker.record_failure(timeout=True)
+        self.assertAlmostEqual(breaker.timeout(3), 0.2125)
+        self.assertEqual(breaker.timeout(0.1), 0.1)
+
+
+class TestESPBreaker(TestCase):
+    def test_esp_fails_fast(self):
+        unit = SimulatedUnit()
+        transport = FakeTransport([unit])
+        esp = ESP(unit.ip, transport=transport, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        del transport.units[unit.ip]
+        for _ in range(2):
+            with self.assertRaises(OSError):
+                esp.refresh()
+        self.assertFalse(esp.healthy)
+        requests = unit.requests
+        with self.assertRaises(CircuitOpenError):
+            esp.gpio_on(2)
+        self.assertEqual(unit.requests, requests)
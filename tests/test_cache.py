@@ -0,0 +1,28 @@
+import threading
+from unittest import TestCase
+
+from espisy.core import ESP
+from espisy.simulator import SimulatedUnit, Simulator
+
+
+class TestStateCache(TestCase):
+    def test_cached_refresh(self):
+        with Simulator([SimulatedUnit()]) as simulator:
+            unit = simulator.units[0]
+            esp = ESP(unit.ip, cache=True)
+            esp.refresh()
+            esp.device("DHT", device_type="DHT").refresh()
+            self.assertEqual(unit.paths, ["/json"])
+            esp.refresh(max_age=0)
+            self.assertEqual(unit.paths, ["/json", "/json"])
+
+    def test_concurrent_refreshes_share_request(self):
+        with Simulator([SimulatedUnit(latency=0.2)]) as simulator:
+            unit = simulator.units[0]
+            esp = ESP(unit.ip)
+            threads = [threading.Thread(target=esp.refresh) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(unit.paths, ["/json", "/json"])
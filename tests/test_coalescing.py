@@ -0,0 +1,81 @@
+import threading
+from unittest import TestCase
+
+from espisy.coalescing import WriteCoalescer, command_key
+from espisy.core import ESP
+from espisy.simulator import FakeTransport, SimulatedUnit
+
+
+class TestWriteCoalescer(TestCase):
+    def setUp(self):
+        # the first request blocks, so that all following writes are pending
+        self.release = threading.Event()
+        self.paths = []
+        self.coalescer = WriteCoalescer(self.send)
+
+    def send(self, path):
+        self.release.wait(5)
+        self.paths.append(path)
+        return path
+
+    def test_last_write_wins(self):
+        first = self.coalescer.submit("control?cmd=event,start", lambda answer: answer)
+        futures = [self.coalescer.gpio(2, 1), self.coalescer.gpio(2, 0), self.coalescer.gpio(2, 1),
+                   self.coalescer.submit("control?cmd=LCD,1,1,a", str), self.coalescer.submit("control?cmd=LCD,1,1,b", str)]
+        self.release.set()
+        self.assertTrue(self.coalescer.flush(5))
+        self.assertEqual(self.paths, ["control?cmd=event,start", "control?cmd=GPIO,2,1", "control?cmd=LCD,1,1,b"])
+        self.assertEqual(first.result(), "control?cmd=event,start")
+        self.assertEqual(futures[3].result(), "control?cmd=LCD,1,1,b")
+        self.assertEqual(self.coalescer.merged, 3)
+
+    def test_toggles_cancel_out(self):
+        self.coalescer.submit("control?cmd=event,start", str)
+        toggles = [self.coalescer.gpio(4), self.coalescer.gpio(4)]
+        inverted = [self.coalescer.gpio(5, 1), self.coalescer.gpio(5)]
+        self.release.set()
+        self.coalescer.flush(5)
+        self.assertIsNone(toggles[1].result())
+        self.assertEqual(self.paths, ["control?cmd=event,start", "control?cmd=GPIO,5,0"])
+
+    def test_order_follows_the_last_write(self):
+        self.coalescer.submit("control?cmd=event,start", str)
+        self.coalescer.submit("control?cmd=LCD,1,1,a", str)
+        self.coalescer.submit("control?cmd=LCDCMD,clear", str)
+        self.coalescer.submit("control?cmd=LCD,1,1,b", str)
+        self.release.set()
+        self.coalescer.flush(5)
+        self.assertEqual(self.paths[1:], ["control?cmd=LCDCMD,clear", "control?cmd=LCD,1,1,b"])
+
+    def test_cancelled_writes_are_dropped(self):
+        self.coalescer.submit("control?cmd=event,start", str)
+        cancelled = self.coalescer.gpio(4, 1)
+        self.assertTrue(cancelled.cancel())
+        later = self.coalescer.gpio(5, 1)
+        self.release.set()
+        self.assertTrue(self.coalescer.flush(5))
+        self.assertEqual(self.paths, ["control?cmd=event,start", "control?cmd=GPIO,5,1"])
+        self.assertTrue(later.done())
+        # the worker is still alive
+        self.coalescer.gpio(6, 0)
+        self.assertTrue(self.coalescer.flush(5))
+        self.assertEqual(self.paths[-1], "control?cmd=GPIO,6,0")
+
+    def test_command_key(self):
+        self.assertEqual(command_key("control?cmd=LCD,2,3,hello, world"), ("lcd", "2", "3", 12))
+        self.assertNotEqual(command_key("control?cmd=LCD,2,3,hello"), command_key("control?cmd=LCD,2,3,hi"))
+        self.assertEqual(command_key("control?cmd=LCDCMD,off"), command_key("control?cmd=LCDCMD,on"))
+        self.assertIsNone(command_key("control?cmd=event,door"))
+
+
+class TestESPWriteCoalescing(TestCase):
+    def test_esp_returns_futures(self):
+        unit = SimulatedUnit(latency=0.05)
+        esp = ESP("10.0.0.1", transport=FakeTransport([unit], sleep=True), coalesce_writes=True)
+        led = esp.device("led", device_type="GPIO", settings={"pin": 2})
+        futures = [led.on(), led.off(), led.toggle(), led.toggle(), led.toggle()]
+        self.assertEqual(futures[-1].result(5), 1)
+        self.assertTrue(esp.flush(5))
+        self.assertEqual(unit.gpios[2], 1)
+        self.assertLessEqual(len(unit.commands), 2)
+        self.assertEqual(esp.gpio_state(2), 1)
@@ -0,0 +1,117 @@
+import asyncio
+import copy
+from unittest import TestCase
+
+from espisy.aio import AsyncESP
+from espisy.constants import test_state
+from espisy.core import ESP
+from espisy.devices import DHT, Switch
+from espisy.simulator import AsyncFakeTransport, FakeTransport, SimulatedUnit
+
+
+class TestDeviceIndex(TestCase):
+    def setUp(self):
+        state = copy.deepcopy(test_state)
+        state["Sensors"][0]["Type"] = "Switch input - Switch"
+        self.esp = ESP("127.0.0.1", state=state)
+
+    def test_auto_device_type(self):
+        self.assertIsInstance(self.esp.device("Door"), Switch)
+
+    def test_values_from_index(self):
+        dht = self.esp.device("DHT", device_type="DHT")
+        self.assertIsInstance(dht, DHT)
+        self.assertEqual(dht.temperature, 20.60)
+        self.assertEqual(dht.humidity, 62.10)
+        self.assertIs(dht.state, self.esp.state["Sensors"][1])
+        self.assertEqual(self.esp.device("door").pinstate, 0)
+
+    def test_index_follows_new_state(self):
+        dht = self.esp.device("DHT", device_type="DHT")
+        state = copy.deepcopy(self.esp.state)
+        state["Sensors"][1]["TaskValues"][0]["Value"] = 21.5
+        self.esp._update_state(state)
+        self.assertEqual(dht.temperature, 21.5)
+        self.esp._update_state(dict(state, Sensors=[]))
+        self.assertIsNone(dht.temperature)
+
+
+class TestDisplayFrame(TestCase):
+    def setUp(self):
+        self.unit = SimulatedUnit()
+        self.unit.lcd[3] = "garbage".ljust(20)
+        transport = FakeTransport([self.unit])
+        self.esp = ESP(self.unit.ip, transport=transport)
+        self.lcd = self.esp.device("lcd", device_type="Display")
+
+    def test_first_frame_redraws_every_row(self):
+        self.lcd.write(1, 1, "Temperature")
+        self.assertEqual(self.unit.commands, [])
+        self.assertEqual(len(self.lcd.render()), 4)
+        self.assertEqual(self.unit.lcd, self.lcd.frame)
+        self.assertEqual(self.unit.lcd[3], " " * 20)
+
+    def test_only_changes_are_sent(self):
+        self.lcd.write(1, 1, "Temperature")
+        self.lcd.write(2, 1, " 20.5 C   62 %")
+        self.lcd.render()
+        del self.unit.commands[:]
+        self.assertEqual(self.lcd.render(), [])
+        self.lcd.write(2, 1, " 20.7 C   61 %")
+        self.lcd.write(4, 18, "!")
+        self.lcd.render()
+        self.assertEqual(self.unit.commands, ["LCD,2,5,7 C   61", "LCD,4,18,!"])
+        self.assertEqual(self.unit.lcd, self.lcd.frame)
+        self.assertFalse(self.lcd.pending)
+
+    def test_text_and_clear_keep_the_frame(self):
+        self.lcd.render()
+        self.lcd.text(3, 2, "now")
+        self.assertEqual(self.lcd.frame[2], " now".ljust(20))
+        self.lcd.clear()
+        self.lcd.write(1, 1, "a")
+        del self.unit.commands[:]
+        self.lcd.render()
+        self.assertEqual(self.unit.commands, ["LCD,1,1,a"])
+
+    def test_text_outside_the_frame(self):
+        # e.g. an 8 row OLED without rows in the settings
+        self.lcd.render()
+        self.lcd.text(8, 1, "x")
+        self.lcd.text(1, 21, "y")
+        self.assertEqual(self.unit.commands[-2:], ["LCD,8,1,x", "LCD,1,21,y"])
+        self.assertEqual(self.lcd.frame, [" " * 20] * 4)
+        self.assertFalse(self.lcd.pending)
+        with self.assertRaises(ValueError):
+            self.lcd.write(8, 1, "x")
+
+    def test_rows_are_padded_when_the_size_changes(self):
+        self.lcd.render()
+        self.lcd.settings["columns"] = 24
+        self.lcd.write(1, 22, "x")
+        del self.unit.commands[:]
+        self.lcd.render()
+        self.assertEqual(self.unit.commands, ["LCD,1,22,x"])
+
+    def test_max_fps(self):
+        lcd = self.esp.device("slow", device_type="Display", settings={"max_fps": 0.5, "rows": 2, "columns": 16})
+        lcd.write(1, 1, "one")
+        self.assertEqual(len(lcd.render()), 2)
+        lcd.write(1, 1, "two")
+        self.assertIsNone(lcd.render())
+        self.assertTrue(lcd.pending)
+        self.assertEqual(lcd.render(force=True), ["OK"])
+        with self.assertRaises(ValueError):
+            lcd.write(3, 1, "off the display")
+
+    def test_async_parent(self):
+        async def main():
+            unit = SimulatedUnit()
+            transport = AsyncFakeTransport([unit])
+            lcd = AsyncESP(unit.ip, transport=transport, state=unit.state).device("lcd", device_type="Display")
+            lcd.write(2, 5, "async")
+            await lcd.render()
+            return unit.lcd, lcd.frame
+        screen, frame = asyncio.run(main())
+        self.assertEqual(screen, frame)
+        self.assertEqual(screen[1], "    async".ljust(20))
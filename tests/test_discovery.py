@@ -0,0 +1,95 @@
+import socket
+import struct
+import threading
+from unittest import TestCase
+
+from espisy.core import ESP
+from espisy.discovery import DiscoveryListener, parse_announcement
+from espisy.settings import SQLiteSettingsStore
+from espisy.simulator import FakeTransport, SimulatedUnit
+
+
+def announcement(name: str, ip: str, port: int = 80, mac: bytes = b"\xa0\x20\xa6\x12\x34\x56") -> bytes:
+    return (struct.pack("<BB6s4sBH25sB", 0xFF, 1, mac, socket.inet_aton(ip), 3, 20114, name.encode(), 17)
+            + struct.pack("<H", port))
+
+
+class TestParseAnnouncement(TestCase):
+    def test_parse(self):
+        parsed = parse_announcement(announcement("Living_Room", "10.0.0.7", port=8080))
+        self.assertEqual(parsed.mac, "a0:20:a6:12:34:56")
+        self.assertEqual((parsed.ip, parsed.unit, parsed.build, parsed.name, parsed.node_type, parsed.port),
+                         ("10.0.0.7", 3, 20114, "Living_Room", 17, 8080))
+        # builds before the web port was added
+        self.assertEqual(parse_announcement(announcement("a", "10.0.0.7")[:-2]).port, 80)
+        self.assertIsNone(parse_announcement(b"\xff\x05" + bytes(60)))
+        self.assertIsNone(parse_announcement(b"\xff\x01"))
+
+
+class TestDiscoveryListener(TestCase):
+    def setUp(self):
+        self.unit = SimulatedUnit("Garage")
+        self.transport = FakeTransport([self.unit])
+        self.events = []
+        self.received = threading.Event()
+        self.listener = DiscoveryListener(host="127.0.0.1", port=0, transport=self.transport, callback=self.callback)
+        self.old_store, ESP.settings_store = ESP.settings_store, SQLiteSettingsStore(":memory:")
+
+    def tearDown(self):
+        for ip in list(ESP._device_register):
+            ESP.remove(ip)
+        ESP.settings_store.close()
+        ESP.settings_store = self.old_store
+
+    def callback(self, esp, announcement):
+        self.events.append((esp.name, esp.ip))
+        self.received.set()
+
+    def send(self, packet: bytes):
+        self.received.clear()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            sender.sendto(packet, ("127.0.0.1", self.listener.port))
+        self.assertTrue(self.received.wait(5))
+
+    def test_new_unit_and_ip_change(self):
+        with self.listener:
+            self.send(announcement("Garage", self.unit.ip))
+            esp = ESP.get("Garage")
+            self.assertEqual(esp.ip, self.unit.ip)
+            self.send(announcement("Garage", "10.1.2.3"))
+        self.assertIs(ESP.get("10.1.2.3"), esp)
+        self.assertEqual(esp.ip, "10.1.2.3")
+        self.assertNotIn(self.unit.ip, ESP._device_register)
+        self.assertEqual(self.events, [("Garage", self.unit.ip), ("Garage", "10.1.2.3")])
+
+    def test_rename_and_known_units(self):
+        esp = ESP.add(self.unit.ip, transport=self.transport)
+        requests = self.unit.requests
+        self.listener.handle(parse_announcement(announcement("Garage", self.unit.ip)))
+        self.listener.handle(parse_announcement(announcement("Carport", self.unit.ip)))
+        self.assertEqual(self.unit.requests, requests)
+        self.assertEqual(esp.name, "Carport")
+        self.assertIs(ESP.get("Carport"), esp)
+        self.assertNotIn("Garage", ESP._name_ip_map)
+        self.assertEqual(len(self.listener.units), 1)
+
+    def test_ip_change_moves_settings(self):
+        esp = ESP.add(self.unit.ip, transport=self.transport)
+        esp.device("led", device_type="GPIO", settings={"pin": 2})
+        esp.save_settings()
+        old_ip = esp.ip
+        self.listener.handle(parse_announcement(announcement("Garage", "10.1.2.3")))
+        self.assertEqual(ESP.settings_store.load("10.1.2.3"), [{"name": "led", "device_class": "GPIO",
+                                                                "settings": {"pin": 2}}])
+        self.assertIsNone(ESP.settings_store.load(old_ip))
+
+    def test_rename_to_a_registered_name(self):
+        other = SimulatedUnit("Carport")
+        self.transport.add(other)
+        esp = ESP.add(self.unit.ip, transport=self.transport)
+        carport = ESP.add(other.ip, transport=self.transport)
+        with self.assertLogs("espisy.discovery", level="WARNING"):
+            self.listener.handle(parse_announcement(announcement("Carport", self.unit.ip)))
+        self.assertEqual(esp.name, "Garage")
+        self.assertIs(ESP.get("Garage"), esp)
+        self.assertIs(ESP.get("Carport"), carport)
@@ -0,0 +1,57 @@
+import socket
+from unittest import TestCase
+
+from espisy.constants import test_state
+from espisy.core import ESP
+from espisy.fleet import Fleet
+from espisy.simulator import FakeTransport, SimulatedUnit, Simulator
+
+
+class TestFleet(TestCase):
+    def test_bulk_operations_collect_errors(self):
+        with Simulator([SimulatedUnit()]) as simulator, socket.socket() as sock:
+            server = simulator.units[0]
+            sock.bind(("127.0.0.1", 0))
+            dead_ip = f"127.0.0.1:{sock.getsockname()[1]}"
+            register = {server.ip: ESP(server.ip), dead_ip: ESP(dead_ip, state=test_state)}
+            fleet = Fleet(register=register)
+
+            result = fleet.refresh_all()
+            self.assertEqual(list(result.succeeded), [server.ip])
+            self.assertEqual(list(result.failed), [dead_ip])
+
+            result = fleet.broadcast_event("lights_off")
+            self.assertIn(server.ip, result.succeeded)
+            self.assertIn("/control?cmd=event,lights_off", server.paths)
+
+            result = fleet.gpio_set_many([(register[server.ip], 2, 1), (register[dead_ip], 4, 0)])
+            self.assertEqual(result[(server.ip, 2)], 1)
+            self.assertIsInstance(result[(dead_ip, 4)], Exception)
+
+    def test_gpio_set_many_with_unknown_esps(self):
+        transport = FakeTransport.fleet(2)
+        first, second = (ESP.add(ip, transport=transport) for ip in transport.units)
+        coalescing = ESP(second.ip, transport=transport, coalesce_writes=True)
+        try:
+            result = Fleet().gpio_set_many([(first.name, 2, 1), ("Unknown_ESP", 4, 1), ("10.9.9.9", 4, 1),
+                                            (coalescing, 5, 1)])
+        finally:
+            ESP.remove(first.ip)
+            ESP.remove(second.ip)
+        self.assertEqual(result[(first.ip, 2)], 1)
+        self.assertEqual(result[(second.ip, 5)], 1)
+        self.assertEqual(list(result.failed), [("Unknown_ESP", 4), ("10.9.9.9", 4)])
+        self.assertEqual(transport.units[first.ip].gpios, {2: 1})
+
+    def test_gpio_set_many_uses_the_fleet_register(self):
+        transport = FakeTransport.fleet(2)
+        own, other = transport.units
+        esp = ESP(own, transport=transport)
+        registered = ESP.add(other, transport=transport)
+        try:
+            result = Fleet(register={own: esp}).gpio_set_many([(esp.name, 2, 1), (own, 3, 1), (registered.name, 4, 1)])
+        finally:
+            ESP.remove(other)
+        self.assertEqual((result[(own, 2)], result[(own, 3)]), (1, 1))
+        self.assertEqual(list(result.failed), [(registered.name, 4)])
+        self.assertEqual(transport.units[other].gpios, {})
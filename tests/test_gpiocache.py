@@ -0,0 +1,102 @@
+import asyncio
+import time
+from unittest import TestCase
+
+from espisy.aio import AsyncESP
+from espisy.core import ESP
+from espisy.gpiocache import GPIOCache
+from espisy.scheduler import RequestScheduler
+from espisy.simulator import AsyncFakeTransport, FakeTransport, SimulatedUnit
+
+
+class TestGPIOCache(TestCase):
+    def test_max_age(self):
+        cache = GPIOCache(max_age=10)
+        cache.set(2, 1)
+        self.assertEqual(cache.get(2), 1)
+        self.assertIsNone(cache.get(2, max_age=0))
+        self.assertIsNone(cache.get(3))
+        cache._states[2] = (1, time.monotonic() - 11)
+        self.assertIsNone(cache.get(2))
+        self.assertIsNone(GPIOCache().get(2))
+
+    def test_update(self):
+        cache = GPIOCache(max_age=10)
+        cache.update(2, {"state": 0})
+        cache.update(4, 1)
+        self.assertEqual((cache.get(2), cache.get(4)), (0, 1))
+        cache.update(4, "broken answer")
+        self.assertIsNone(cache.get(4))
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+
+class TestESPGPIOCache(TestCase):
+    def setUp(self):
+        self.unit = SimulatedUnit(gpios={2: 0, 4: 1})
+        self.transport = FakeTransport([self.unit])
+        self.esp = ESP(self.unit.ip, transport=self.transport, gpio_max_age=60)
+
+    def test_write_through(self):
+        self.esp.gpio_on(2)
+        self.esp._toggle(4)
+        requests = self.unit.requests
+        self.assertEqual((self.esp.gpio_state(2), self.esp.gpio_state(4)), (1, 0))
+        self.assertEqual(self.unit.requests, requests)
+        self.assertEqual(self.esp.gpio_state(2, max_age=0), 1)
+        self.assertEqual(self.unit.requests, requests + 1)
+
+    def test_commands_clear_the_cache(self):
+        self.esp.gpio_on(2)
+        self.esp.event("all_off")
+        self.assertEqual(len(self.esp.gpio_cache), 0)
+        self.esp.gpio_on(2)
+        self.esp.send_command("control?cmd=status,gpio,4")
+        self.assertEqual(len(self.esp.gpio_cache), 1)
+
+    def test_disabled_by_default(self):
+        esp = ESP(self.unit.ip, transport=self.transport)
+        esp.gpio_on(2)
+        requests = self.unit.requests
+        self.assertEqual(esp.gpio_state(2), 1)
+        self.assertEqual(self.unit.requests, requests + 1)
+
+    def test_gpio_states(self):
+        unit = SimulatedUnit(latency=0.05, gpios={pin: pin % 2 for pin in range(8)})
+        transport = FakeTransport([unit], sleep=True)
+        esp = ESP(unit.ip, transport=transport, gpio_max_age=60,
+                  scheduler=RequestScheduler(max_concurrency=4))
+        esp.gpio_off(1)
+        requests = unit.requests
+        start = time.perf_counter()
+        states = esp.gpio_states([7, 1, 0, 3, 2, 5, 4, 6, 1])
+        elapsed = time.perf_counter() - start
+        self.assertEqual(states, {7: 1, 1: 0, 0: 0, 3: 1, 2: 0, 5: 1, 4: 0, 6: 0})
+        self.assertEqual(list(states), [7, 1, 0, 3, 2, 5, 4, 6])
+        # 7 requests, 4 at a time
+        self.assertEqual(unit.requests, requests + 7)
+        self.assertLess(elapsed, 0.3)
+        self.assertEqual(esp.gpio_states(range(8)), {pin: 0 if pin == 1 else pin % 2 for pin in range(8)})
+        self.assertEqual(unit.requests, requests + 7)
+
+    def test_coalesced_writes(self):
+        esp = ESP(self.unit.ip, transport=self.transport, gpio_max_age=60, coalesce_writes=True)
+        esp.gpio_on(2)
+        esp._toggle(2)
+        requests = self.unit.requests
+        self.assertEqual(esp.gpio_state(2), 0)
+        self.assertLessEqual(self.unit.requests, requests + 2)
+        requests = self.unit.requests
+        self.assertEqual(esp.gpio_states([2]), {2: 0})
+        self.assertEqual(self.unit.requests, requests)
+
+    def test_async_esp(self):
+        async def main():
+            unit = SimulatedUnit(gpios={2: 0, 4: 1})
+            transport = AsyncFakeTransport([unit])
+            esp = AsyncESP(unit.ip, transport=transport, gpio_max_age=60)
+            await esp.gpio_on(2)
+            requests = unit.requests
+            states = await esp.gpio_states([2, 4])
+            return states, unit.requests - requests, await esp.gpio_state(4), unit.requests - requests
+        self.assertEqual(asyncio.run(main()), ({2: 1, 4: 1}, 1, 1, 1))
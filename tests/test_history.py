@@ -0,0 +1,82 @@
+import copy
+import threading
+from unittest import TestCase
+
+import numpy as np
+
+from espisy.constants import test_state
+from espisy.core import ESP
+from espisy.history import History
+
+
+class TestHistory(TestCase):
+    def test_ring_buffer_overwrites_oldest(self):
+        history = History(capacity=4)
+        for second in range(6):
+            history.append(second * 2, timestamp=1000 + second)
+        self.assertEqual(len(history), 4)
+        np.testing.assert_array_equal(history.times, [1002, 1003, 1004, 1005])
+        np.testing.assert_array_equal(history.values, [4, 6, 8, 10])
+        self.assertEqual(history.nbytes, 4 * 12)
+
+    def test_large_counters_are_exact(self):
+        history = History(capacity=10)
+        for second in range(5):
+            history.append(2 ** 24 + 1 + second, timestamp=1000 + second)
+        self.assertEqual(history.values[0], 2 ** 24 + 1)
+        self.assertAlmostEqual(history.rate(), 1)
+
+    def test_timestamps_stay_precise(self):
+        history = History(capacity=8640)
+        for sample in range(8640):
+            history.append(sample, timestamp=1.7e9 + sample * 10.001)
+        np.testing.assert_allclose(history.times, 1.7e9 + np.arange(8640) * 10.001, rtol=0, atol=0.01)
+        self.assertAlmostEqual(history.rate(), 1 / 10.001)
+        # weeks later the base follows the oldest sample
+        history = History(capacity=4)
+        for day in range(30):
+            history.append(day, timestamp=1.7e9 + day * 86400.25)
+        np.testing.assert_array_equal(history.times, 1.7e9 + np.arange(26, 30) * 86400.25)
+
+    def test_concurrent_appends(self):
+        history = History(capacity=1000)
+
+        def append(first):
+            for sample in range(first, first + 500):
+                history.append(sample, timestamp=sample)
+
+        threads = [threading.Thread(target=append, args=(first,)) for first in range(0, 4000, 500)]
+        for thread in threads:
+            thread.start()
+        for _ in range(100):
+            times, values = history.window()
+            np.testing.assert_array_equal(times, values)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(history), 1000)
+        np.testing.assert_array_equal(history.times, history.values)
+        self.assertEqual(len(set(history.times)), 1000)
+
+    def test_window_stats(self):
+        history = History(capacity=100)
+        for second in range(10):
+            history.append(second * 3, timestamp=1000 + second)
+        times, values = history.window(3.5, now=1009)
+        np.testing.assert_array_equal(values, [18, 21, 24, 27])
+        self.assertEqual(history.min(), 0)
+        self.assertEqual(history.max(), 27)
+        self.assertAlmostEqual(history.mean(), 13.5)
+        self.assertAlmostEqual(history.rate(), 3)
+        self.assertIsNone(History().rate())
+
+    def test_esp_records_values(self):
+        esp = ESP("127.0.0.1", state=copy.deepcopy(test_state))
+        dht = esp.device("DHT", device_type="DHT")
+        self.assertIsNone(dht.history())
+        esp.record_history(capacity=10, tasks=["DHT"])
+        state = copy.deepcopy(test_state)
+        state["Sensors"][1]["TaskValues"][0]["Value"] = 22.6
+        esp._update_state(state)
+        np.testing.assert_allclose(dht.history().values, [20.6, 22.6], rtol=1e-6)
+        self.assertEqual(len(dht.history("Humidity")), 2)
+        self.assertIsNone(esp.device("door", device_type="Switch").history())
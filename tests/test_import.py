@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+
+HEAVY_MODULES = ("requests", "urllib3", "yaml", "asyncio", "sqlite3", "numpy", "aiohttp")
+
+
+def run_python(code: str, **environ) -> subprocess.CompletedProcess:
+    env = dict(os.environ, **environ)
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, timeout=60)
+
+
+class TestImport(TestCase):
+    def test_import_does_not_load_heavy_dependencies(self):
+        result = run_python(
+            "import sys, espisy.core, espisy.devices, espisy.fleet, espisy.poller, espisy.settings\n"
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "")
+
+    def test_import_without_config_file(self):
+        result = run_python(
+            "import espisy.core\n"
+            "from espisy.constants import get_config\n"
+            "print(get_config().get('USER_SETTINGS', 'file_dir'))",
+            ESPISY_CONFIG=os.path.join(os.path.dirname(__file__), "missing.ini"))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "default")
+
+    def test_settings_dir_from_environment(self):
+        result = run_python(
+            "import espisy.core\n"
+            "print(espisy.core.settings_file_name)",
+            ESPISY_SETTINGS_DIR=os.path.join("tmp", "espisy"))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), os.path.join("tmp", "espisy", "esp.yaml"))
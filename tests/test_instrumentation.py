@@ -0,0 +1,87 @@
+import socket
+from unittest import TestCase
+
+from espisy.core import ESP
+from espisy.instrumentation import Histogram, Tracer, instrumentation, request_kind
+from espisy.simulator import FakeTransport, SimulatedUnit, Simulator
+from espisy.transport import Transport
+
+
+class RecordingTracer(Tracer):
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, ip, kind, path):
+        return [ip, kind]
+
+    def end_span(self, span, seconds, error=None):
+        self.spans.append(span + [error])
+
+
+class TestInstrumentation(TestCase):
+    def setUp(self):
+        instrumentation.reset()
+        instrumentation.enable()
+        self.transport = FakeTransport([SimulatedUnit()])
+        self.esp = ESP(next(iter(self.transport.units)), transport=self.transport)
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_latency_and_counters(self):
+        self.esp.gpio_on(2)
+        self.esp.gpio_state(2)
+        snapshot = instrumentation.snapshot()
+        device = snapshot["devices"][self.esp.ip]
+        self.assertEqual(device["requests"], 3)
+        self.assertEqual(device["json_errors"], 1)
+        self.assertEqual(set(device["latency"]), {"json", "gpio", "status"})
+        self.assertEqual(snapshot["kinds"]["gpio"]["count"], 1)
+
+    def test_disabled(self):
+        instrumentation.disable()
+        self.esp.refresh()
+        self.assertEqual(instrumentation.snapshot()["devices"][self.esp.ip]["requests"], 1)
+
+    def test_tracer_and_errors(self):
+        tracer = RecordingTracer()
+        instrumentation.add_tracer(tracer)
+        try:
+            self.esp.refresh()
+            with self.assertRaises(OSError):
+                ESP("10.9.9.9", transport=self.transport)
+        finally:
+            instrumentation.remove_tracer(tracer)
+        self.assertEqual(tracer.spans[0], [self.esp.ip, "json", None])
+        self.assertIsInstance(tracer.spans[1][2], OSError)
+        self.assertEqual(instrumentation.snapshot()["devices"]["10.9.9.9"]["errors"], 1)
+
+    def test_timeouts_and_retries(self):
+        with Simulator([SimulatedUnit(latency=0.5)]) as simulator, Transport(timeout=0.05) as transport:
+            with self.assertRaises(OSError):
+                ESP(simulator.units[0].ip, transport=transport)
+        with socket.socket() as closed:
+            closed.bind(("127.0.0.1", 0))
+            ip = f"127.0.0.1:{closed.getsockname()[1]}"
+        with Transport(retries=2, backoff_factor=0) as transport, self.assertRaises(OSError):
+            ESP(ip, transport=transport)
+        devices = instrumentation.snapshot()["devices"]
+        self.assertEqual(devices[simulator.units[0].ip]["timeouts"], 1)
+        self.assertEqual(devices[ip]["retries"], 2)
+
+
+class TestHistogram(TestCase):
+    def test_percentiles(self):
+        histogram = Histogram()
+        for milliseconds in range(1, 101):
+            histogram.observe(milliseconds / 1000)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.percentile(0.5), 0.05)
+        self.assertEqual(histogram.percentile(1), 0.1)
+        self.assertIsNone(Histogram().percentile(0.5))
+
+    def test_request_kind(self):
+        self.assertEqual(request_kind("json"), "json")
+        self.assertEqual(request_kind("control?cmd=GPIO,2,1"), "gpio")
+        self.assertEqual(request_kind("control?cmd=event,door"), "event")
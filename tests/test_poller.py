@@ -0,0 +1,41 @@
+import socket
+import time
+from unittest import TestCase
+
+from espisy.constants import test_state
+from espisy.core import ESP
+from espisy.poller import Poller
+from espisy.simulator import SimulatedUnit, Simulator
+
+
+class TestPoller(TestCase):
+    def test_interval_from_task_interval(self):
+        esp = ESP("127.0.0.1", state=test_state)
+        self.assertEqual(Poller(register={}).interval(esp), 600)
+        self.assertEqual(Poller(register={}, intervals={"Room_1": 5}).interval(esp), 5)
+
+    def test_polls_register(self):
+        with Simulator([SimulatedUnit()]) as simulator:
+            unit = simulator.units[0]
+            register = {}
+            with Poller(register=register, min_interval=0.05, intervals={unit.ip: 0.05}):
+                register[unit.ip] = ESP(unit.ip)
+                time.sleep(0.5)
+                register.clear()
+                time.sleep(0.2)
+                polls = unit.paths.count("/json")
+                time.sleep(0.3)
+            # the ESP was picked up while running and no longer polled after it was removed
+            self.assertGreater(polls, 3)
+            self.assertEqual(unit.paths.count("/json"), polls)
+
+    def test_backoff_on_failure(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            ip = f"127.0.0.1:{sock.getsockname()[1]}"
+            esp = ESP(ip, state=test_state)
+            poller = Poller(register={ip: esp}, min_interval=0.01, intervals={ip: 0.01}, jitter=0)
+            with poller:
+                time.sleep(0.5)
+            self.assertGreater(poller.failures(ip), 0)
+            self.assertLess(poller.failures(ip), 10)
@@ -0,0 +1,65 @@
+import copy
+import time
+from unittest import TestCase
+
+import requests
+
+from espisy.constants import test_state
+from espisy.core import ESP
+from espisy.push import PushReceiver, parse_value
+
+
+class TestPushReceiver(TestCase):
+    def setUp(self):
+        self.esp = ESP("127.0.0.1", state=copy.deepcopy(test_state))
+        self.receiver = PushReceiver(port=0, register={"127.0.0.1": self.esp}, names={self.esp.name: "127.0.0.1"})
+        self.dht = self.esp.device("DHT", device_type="DHT")
+
+    def test_parse_value(self):
+        self.assertEqual(parse_value("20.60"), 20.6)
+        self.assertEqual(parse_value("1"), 1)
+        self.assertEqual(parse_value("true"), "true")
+        self.assertEqual(parse_value("on"), "on")
+
+    def test_ingest_updates_in_place(self):
+        changes = []
+        subscription = self.esp.subscribe(changes.append, device="DHT")
+        state = self.esp.state
+        self.assertTrue(self.receiver.ingest("10.9.9.9", self.esp.name, "DHT", "Temperature", "22.5"))
+        subscription.cancel()
+        self.assertEqual(self.dht.temperature, 22.5)
+        self.assertIs(self.esp.state, state)
+        self.assertEqual(state["Sensors"][1]["TaskValues"][0]["Value"], 22.5)
+        self.assertEqual([(change.old, change.new) for change in changes], [(20.6, 22.5)])
+        self.assertLess(self.dht.age, 1)
+        self.assertFalse(self.receiver.ingest("10.9.9.9", "other", "DHT", "Temperature", "1"))
+        self.assertFalse(self.receiver.ingest("127.0.0.1", None, "DHT", "Pressure", "1"))
+        self.assertEqual((self.receiver.accepted, self.receiver.rejected), (1, 2))
+
+    def test_pushed_values_count_as_refresh(self):
+        self.esp.cache = True
+        self.esp._refreshed_at = time.monotonic() - 3600
+        self.esp.update_value("DHT", "Humidity", 50)
+        # the state is an hour old, but the values of the DHT were just pushed, so no request is sent
+        self.assertIsNone(self.dht.refresh(max_age=60))
+        self.assertEqual(self.dht.humidity, 50)
+
+    def test_http(self):
+        with self.receiver:
+            url = f"http://127.0.0.1:{self.receiver.port}/demo.php"
+            answer = requests.get(url, params={"name": self.esp.name, "task": "DHT", "valuename": "Humidity",
+                                               "value": "55.30"}, timeout=5)
+            self.assertEqual(answer.status_code, 200)
+            self.assertEqual(self.dht.humidity, 55.3)
+            answer = requests.post(url, data={"task": "DHT", "valuename": "Temperature", "value": "19"}, timeout=5)
+            self.assertEqual(answer.status_code, 200)
+            self.assertEqual(self.dht.temperature, 19)
+            self.assertEqual(requests.get(url, params={"task": "DHT"}, timeout=5).status_code, 404)
+
+    def test_allowed_senders(self):
+        self.receiver.allowed_senders = {"10.0.0.2:8080": None}
+        query = f"/demo.php?name={self.esp.name}&task=DHT&valuename=Humidity&value=40"
+        self.assertFalse(self.receiver.handle("127.0.0.1", query))
+        self.assertTrue(self.receiver.handle("10.0.0.2", query))
+        self.assertEqual(self.dht.humidity, 40)
+        self.assertEqual((self.receiver.accepted, self.receiver.rejected), (1, 1))
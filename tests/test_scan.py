@@ -0,0 +1,70 @@
+import ipaddress
+import socket
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from espisy.aio import AsyncESP
+from espisy.core import ESP
+from espisy.network import async_probe_port, probe_port
+from espisy.simulator import SimulatedUnit, Simulator
+
+
+class TestProbe(TestCase):
+    def test_probe_finds_listening_host(self):
+        with Simulator([SimulatedUnit()]) as simulator:
+            port = simulator.units[0].port
+            hosts = ipaddress.ip_network("127.0.0.0/30").hosts()
+            self.assertEqual(probe_port(hosts, port=port), [ipaddress.ip_address("127.0.0.1")])
+
+    def test_probe_skips_closed_port(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+            self.assertEqual(probe_port([ipaddress.ip_address("127.0.0.1")], port=port), [])
+
+
+class TestScanNetwork(TestCase):
+    def tearDown(self):
+        ESP._device_register.clear()
+        ESP._name_ip_map.clear()
+
+    def test_scan_adds_esp(self):
+        with Simulator([SimulatedUnit()]) as simulator:
+            unit = simulator.units[0]
+            found = ESP.scan_network(ipaddress.ip_network("127.0.0.0/29"), timeout=2, port=unit.port, concurrency=4)
+            self.assertEqual([esp.ip for esp in found], [unit.ip])
+            self.assertIs(ESP.get(unit.ip), found[0])
+            # only the host that accepted the probe was asked for /json
+            self.assertEqual(unit.paths.count("/json"), 1)
+
+    def test_iter_scan_stops_at_name(self):
+        with Simulator([SimulatedUnit("Room_1")]) as simulator:
+            unit = simulator.units[0]
+            network = ipaddress.ip_network("127.0.0.0/29")
+            found = list(ESP.iter_scan(network, timeout=2, port=unit.port, name="Room_1"))
+            self.assertEqual([esp.name for esp in found], ["Room_1"])
+            # a registered unit is returned without scanning
+            requests_sent = unit.requests
+            self.assertEqual(list(ESP.iter_scan(network, port=unit.port, name="Room_1")), found)
+            self.assertEqual(unit.requests, requests_sent)
+
+
+class TestAsyncScanNetwork(IsolatedAsyncioTestCase):
+    def tearDown(self):
+        AsyncESP._device_register.clear()
+        AsyncESP._name_ip_map.clear()
+
+    async def test_async_scan_adds_esp(self):
+        with Simulator([SimulatedUnit()]) as simulator:
+            unit = simulator.units[0]
+            hosts = ipaddress.ip_network("127.0.0.0/30").hosts()
+            self.assertEqual(await async_probe_port(hosts, port=unit.port), [ipaddress.ip_address("127.0.0.1")])
+            found = await AsyncESP.scan_network(ipaddress.ip_network("127.0.0.0/29"), timeout=2, port=unit.port)
+            self.assertEqual([esp.ip for esp in found], [unit.ip])
+            self.assertEqual(unit.paths.count("/json"), 1)
+
+    async def test_async_iter_scan_limit(self):
+        with Simulator([SimulatedUnit()]) as simulator:
+            unit = simulator.units[0]
+            network = ipaddress.ip_network("127.0.0.0/29")
+            found = [esp async for esp in AsyncESP.iter_scan(network, timeout=2, port=unit.port, limit=1)]
+            self.assertEqual([esp.ip for esp in found], [unit.ip])
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+from unittest import TestCase
+
+from espisy.aio import AsyncESP, AsyncRequestScheduler
+from espisy.core import ESP
+from espisy.scheduler import RequestScheduler, is_read
+from espisy.simulator import AsyncFakeTransport, FakeTransport, SimulatedUnit
+
+
+def run_threads(targets, stagger=0):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+        time.sleep(stagger)
+    for thread in threads:
+        thread.join()
+
+
+class TestRequestScheduler(TestCase):
+    def setUp(self):
+        self.scheduler = RequestScheduler(max_concurrency=2)
+        self.lock = threading.Lock()
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+
+    def send(self, name, duration=0.05):
+        with self.lock:
+            self.calls.append(name)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(duration)
+        with self.lock:
+            self.active -= 1
+        return name
+
+    def test_is_read(self):
+        self.assertTrue(is_read("json"))
+        self.assertTrue(is_read("control?cmd=status,gpio,2"))
+        self.assertFalse(is_read("control?cmd=GPIO,2,1"))
+
+    def test_concurrency_limit(self):
+        run_threads([lambda path=f"json?{n}": self.scheduler.request(path, self.send, path) for n in range(6)])
+        self.assertEqual(len(self.calls), 6)
+        self.assertEqual(self.max_active, 2)
+
+    def test_reads_are_coalesced(self):
+        results = []
+        run_threads([lambda: results.append(self.scheduler.request("json", self.send, "json", 0.1))] * 5)
+        self.assertEqual(self.calls, ["json"])
+        self.assertEqual(results, ["json"] * 5)
+        self.assertEqual(self.scheduler.coalesced, 4)
+
+    def test_writes_keep_their_order(self):
+        paths = [f"control?cmd=LCD,1,1,{n}" for n in range(5)]
+        run_threads([lambda path=path: self.scheduler.request(path, self.send, path) for path in paths], stagger=0.01)
+        self.assertEqual(self.calls, paths)
+        self.assertEqual(self.max_active, 1)
+
+    def test_read_after_write_is_not_coalesced(self):
+        reader = threading.Thread(target=self.scheduler.request, args=("json", self.send, "json", 0.2))
+        reader.start()
+        time.sleep(0.05)
+        self.scheduler.request("control?cmd=GPIO,2,1", self.send, "write", 0)
+        self.scheduler.request("json", self.send, "json", 0)
+        reader.join()
+        self.assertEqual(self.calls, ["json", "write", "json"])
+
+    def test_errors_reach_all_waiters(self):
+        def fail():
+            time.sleep(0.05)
+            raise ConnectionError
+        errors = []
+
+        def read():
+            try:
+                self.scheduler.request("json", fail)
+            except ConnectionError as e:
+                errors.append(e)
+        run_threads([read] * 3)
+        self.assertEqual(len(errors), 3)
+
+    def test_interrupted_write_does_not_block_later_writes(self):
+        turn = self.scheduler._write_turn
+
+        class InterruptedCondition():
+            def wait(self):
+                if threading.current_thread().name == "interrupted":
+                    raise KeyboardInterrupt
+                turn.wait()
+
+            def notify_all(self):
+                turn.notify_all()
+
+        self.scheduler._write_turn = InterruptedCondition()
+        interrupted = []
+
+        def interrupted_write():
+            try:
+                self.scheduler.request("control?cmd=GPIO,2,0", self.send, "interrupted")
+            except KeyboardInterrupt:
+                interrupted.append(True)
+        first = threading.Thread(target=self.scheduler.request, args=("control?cmd=GPIO,2,1", self.send, "first", 0.2))
+        first.start()
+        time.sleep(0.05)
+        second = threading.Thread(target=interrupted_write, name="interrupted")
+        second.start()
+        second.join()
+        third = threading.Thread(target=self.scheduler.request, args=("control?cmd=GPIO,3,1", self.send, "third", 0),
+                                 daemon=True)
+        third.start()
+        first.join()
+        third.join(2)
+        self.assertFalse(third.is_alive())
+        self.assertEqual(interrupted, [True])
+        self.assertEqual(self.calls, ["first", "third"])
+
+
+class TestESPScheduler(TestCase):
+    def test_esp_coalesces_status_reads(self):
+        unit = SimulatedUnit(latency=0.05)
+        transport = FakeTransport([unit], sleep=True)
+        esp = ESP(unit.ip, transport=transport)
+        requests = unit.requests
+        run_threads([lambda: esp.gpio_state(2)] * 4)
+        self.assertEqual(unit.requests, requests + 1)
+
+    def test_async_esp(self):
+        async def main():
+            transport = AsyncFakeTransport([SimulatedUnit(latency=0.05)], sleep=True)
+            unit = next(iter(transport.units.values()))
+            esp = AsyncESP(unit.ip, transport=transport, scheduler=AsyncRequestScheduler(max_concurrency=1))
+            states = await asyncio.gather(*(esp.gpio_state(2) for _ in range(4)))
+            answers = await asyncio.gather(esp.gpio_on(2), esp.gpio_off(2), esp.gpio_on(2))
+            return unit, states, answers
+        unit, states, answers = asyncio.run(main())
+        self.assertEqual(states, [0] * 4)
+        self.assertEqual(answers, [1, 0, 1])
+        self.assertEqual(unit.requests, 4)
+        self.assertEqual(unit.commands[1:], ["GPIO,2,1", "GPIO,2,0", "GPIO,2,1"])
@@ -0,0 +1,74 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import yaml
+
+from espisy.constants import test_state
+from espisy.core import ESP
+from espisy.devices import GPIO
+from espisy.settings import SettingsStore, SQLiteSettingsStore, YAMLSettingsStore
+
+devices = [{"name": "led", "device_class": "GPIO", "settings": {"pin": 2}}]
+
+
+class TestSettingsStores(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.yaml_file = os.path.join(self.directory.name, "esp.yaml")
+        with open(self.yaml_file, "w") as f:
+            yaml.dump({"ipv4network": "192.168.0.0/24",
+                       "esps": [{"192.168.0.2": {"devices": devices}}]}, f)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_yaml_store_keeps_other_entries(self):
+        store = YAMLSettingsStore(self.yaml_file)
+        self.assertEqual(store.load("192.168.0.2"), devices)
+        self.assertIsNone(store.load("192.168.0.3"))
+        store.save("192.168.0.3", [])
+        with open(self.yaml_file) as f:
+            settings = yaml.safe_load(f)
+        self.assertEqual(settings["ipv4network"], "192.168.0.0/24")
+        self.assertEqual(store.load_all(), {"192.168.0.2": devices, "192.168.0.3": []})
+
+    def test_yaml_store_returns_copies(self):
+        store = YAMLSettingsStore(self.yaml_file)
+        store.load("192.168.0.2").append({"name": "other", "device_class": "GPIO", "settings": {}})
+        store.load_all()["192.168.0.2"].clear()
+        store.load("192.168.0.2")[0]["settings"]["pin"] = 4
+        store.load_all()["192.168.0.2"][0]["name"] = "renamed"
+        self.assertEqual(store.load("192.168.0.2"), devices)
+
+    def test_settings_store_is_abstract(self):
+        with self.assertRaises(TypeError):
+            SettingsStore()
+
+    def test_sqlite_store_import_export(self):
+        store = SQLiteSettingsStore(os.path.join(self.directory.name, "esp.sqlite"))
+        store.import_yaml(self.yaml_file)
+        self.assertEqual(store.load("192.168.0.2"), devices)
+        store.save_all({"192.168.0.2": devices * 2, "192.168.0.4": devices})
+        self.assertEqual(store.load_all(), {"192.168.0.2": devices * 2, "192.168.0.4": devices})
+        exported = os.path.join(self.directory.name, "export.yaml")
+        store.export_yaml(exported)
+        self.assertEqual(YAMLSettingsStore(exported).load("192.168.0.4"), devices)
+        store.close()
+
+    def test_esp_uses_settings_store(self):
+        old_store, old_register = ESP.settings_store, dict(ESP._device_register)
+        try:
+            ESP.settings_store = SQLiteSettingsStore(":memory:")
+            esp = ESP("192.168.0.2", state=test_state)
+            esp.device("led", device_type="GPIO", settings={"pin": 2})
+            esp.save_settings()
+            ESP._device_register.clear()
+            ESP._device_register["192.168.0.2"] = copy = ESP("192.168.0.2", state=test_state)
+            ESP.load_all()
+            self.assertIsInstance(copy.device("led"), GPIO)
+            self.assertEqual(copy.device("led").settings, {"pin": 2})
+        finally:
+            ESP.settings_store = old_store
+            ESP._device_register.clear()
+            ESP._device_register.update(old_register)
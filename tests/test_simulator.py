@@ -0,0 +1,73 @@
+import asyncio
+import ipaddress
+from unittest import TestCase
+
+from espisy.aio import AsyncESP
+from espisy.core import ESP
+from espisy.simulator import AsyncFakeTransport, FakeTransport, SimulatedUnit, Simulator, ramp
+from espisy.transport import Transport
+
+
+class TestSimulatedUnit(TestCase):
+    def setUp(self):
+        self.unit = SimulatedUnit("Room_2", drift={("DHT", "Temperature"): ramp(20, 0)})
+        self.transport = FakeTransport([self.unit])
+        self.esp = ESP(self.unit.ip, transport=self.transport)
+
+    def test_commands(self):
+        self.assertEqual(self.esp.name, "Room_2")
+        self.assertEqual(self.esp.gpio_on(2), 1)
+        self.assertEqual(self.esp.gpio_state(2), 1)
+        self.assertEqual(self.esp._toggle(2)["state"], 0)
+        display = self.esp.device("lcd", device_type="Display")
+        display.text(2, 3, "hello")
+        self.assertEqual(self.unit.lcd[1], "  hello".ljust(20))
+        display.off()
+        self.assertFalse(self.unit.lcd_on)
+        self.esp.event("door_open")
+        self.assertEqual(self.unit.events, ["door_open"])
+        self.assertEqual(self.esp.send_command("control?cmd=reboot"), "Unknown or restricted command!")
+
+    def test_drift(self):
+        self.unit.set_value("DHT", "Humidity", 50)
+        self.esp.refresh()
+        dht = self.esp.device("DHT", device_type="DHT")
+        self.assertEqual((dht.temperature, dht.humidity), (20, 50))
+
+    def test_unknown_ip(self):
+        with self.assertRaises(OSError):
+            self.transport.get("http://10.1.1.1/json")
+
+
+class TestSimulator(TestCase):
+    def test_scan_fleet_on_loopback_addresses(self):
+        with Simulator.fleet(5, network="127.0.1.0/29", latency=0.001) as simulator:
+            esps = ESP.scan_network(ipaddress.ip_network("127.0.1.0/29"), port=simulator.port, timeout=1)
+            try:
+                self.assertEqual([esp.name for esp in esps], [f"ESP_000{number}" for number in range(1, 6)])
+                self.assertEqual(esps[0].gpio_on(4), 1)
+                self.assertEqual(simulator.units[0].gpios, {4: 1})
+            finally:
+                for esp in esps:
+                    ESP.remove(esp.ip)
+
+    def test_connection_limit(self):
+        unit = SimulatedUnit(max_connections=1, latency=0.2)
+        with Simulator([unit]), Transport(pool_size=4, retries=0) as transport:
+            async def requests():
+                loop = asyncio.get_running_loop()
+                return await asyncio.gather(
+                    *(loop.run_in_executor(None, transport.get, f"http://{unit.ip}/json") for _ in range(3)),
+                    return_exceptions=True)
+            answers = asyncio.run(requests())
+        self.assertEqual(sum(not isinstance(answer, Exception) for answer in answers), 1)
+        self.assertEqual(unit.rejected, 2)
+
+    def test_async(self):
+        async def main():
+            async with AsyncFakeTransport.fleet(3) as transport:
+                esps = [await AsyncESP.connect(ip, transport=transport) for ip in transport.units]
+                return [esp.name for esp in esps], await esps[0].gpio_off(2)
+        names, state = asyncio.run(main())
+        self.assertEqual(names, ["ESP_0001", "ESP_0002", "ESP_0003"])
+        self.assertEqual(state, 0)
@@ -0,0 +1,35 @@
+import json
+from unittest import TestCase
+
+from espisy.constants import test_state
+from espisy.core import ESP
+from espisy.state import State, Task
+
+
+class TestState(TestCase):
+    def setUp(self):
+        self.state = State(json.dumps(test_state).encode())
+
+    def test_dict_style_access(self):
+        self.assertEqual(self.state["System"]["Unit Name"], "Room_1")
+        self.assertEqual(self.state["WiFi"]["RSSI"], -40)
+        self.assertEqual(self.state["TTL"], 60000)
+        self.assertEqual(self.state["Sensors"][1]["TaskValues"][0]["Value"], 20.60)
+        self.assertEqual(self.state["Sensors"][0]["DataAcquisition"][0]["Controller"], 1)
+        self.assertEqual(list(self.state), list(test_state))
+        self.assertRaises(KeyError, self.state.__getitem__, "Missing")
+        self.assertEqual(dict(self.state["Sensors"][1]["TaskValues"][1]), test_state["Sensors"][1]["TaskValues"][1])
+
+    def test_sections_are_decoded_on_access(self):
+        self.assertIsNone(self.state._sections)
+        self.assertEqual(self.state.unit_name, "Room_1")
+        self.state["WiFi"]
+        self.assertEqual(list(self.state._sections), ["WiFi"])
+
+    def test_compact_objects(self):
+        task = self.state.sensors[0]
+        self.assertIsInstance(task, Task)
+        self.assertFalse(hasattr(task, "__dict__"))
+        esp = ESP("127.0.0.1", state=self.state)
+        self.assertIs(esp.state, self.state)
+        self.assertFalse(hasattr(esp.device("DHT", device_type="DHT"), "__dict__"))
@@ -0,0 +1,65 @@
+import copy
+from unittest import TestCase
+
+from espisy.constants import test_state
+from espisy.core import ESP
+from espisy.subscriptions import Change
+
+
+class TestSubscriptions(TestCase):
+    def setUp(self):
+        self.esp = ESP("127.0.0.1", state=copy.deepcopy(test_state))
+        self.other = ESP("127.0.0.2", state=copy.deepcopy(test_state))
+        self.subscriptions = []
+
+    def tearDown(self):
+        for subscription in self.subscriptions:
+            subscription.cancel()
+
+    def subscribe(self, subscribe, *args, **kwargs):
+        changes = []
+        self.subscriptions.append(subscribe(changes.append, *args, **kwargs))
+        return changes
+
+    def update(self, esp, temperature=20.6, door=0):
+        state = copy.deepcopy(test_state)
+        state["Sensors"][0]["TaskValues"][0]["Value"] = door
+        state["Sensors"][1]["TaskValues"][0]["Value"] = temperature
+        esp._update_state(state)
+
+    def test_only_changed_values_are_sent(self):
+        changes = self.subscribe(self.esp.subscribe)
+        self.update(self.esp)
+        self.assertEqual(changes, [])
+        self.update(self.esp, temperature=21.5)
+        self.assertEqual(changes, [Change(self.esp, "DHT", "Temperature", 20.6, 21.5)])
+
+    def test_filters(self):
+        door = self.subscribe(self.esp.device("door", device_type="Switch").subscribe)
+        humidity = self.subscribe(self.esp.subscribe, value="Humidity")
+        all_esps = self.subscribe(ESP.subscribe_all, device="DHT", value="Temperature")
+        self.update(self.other, temperature=30)
+        self.update(self.esp, door=1)
+        self.assertEqual(door, [Change(self.esp, "door", "State", 0, 1)])
+        self.assertEqual(humidity, [])
+        self.assertEqual(all_esps, [Change(self.other, "DHT", "Temperature", 20.6, 30)])
+
+    def test_cancel_and_failing_callback(self):
+        def fail(change):
+            raise ValueError
+        self.subscriptions.append(self.esp.subscribe(fail))
+        subscription = self.esp.subscribe(print)
+        subscription.cancel()
+        subscription.cancel()
+        changes = self.subscribe(self.esp.subscribe, device="DHT")
+        with self.assertLogs("espisy.subscriptions", "ERROR"):
+            self.update(self.esp, temperature=25)
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(len(ESP.subscriptions), 2)
+
+    def test_removed_task(self):
+        changes = self.subscribe(self.esp.subscribe)
+        state = copy.deepcopy(test_state)
+        del state["Sensors"][0]
+        self.esp._update_state(state)
+        self.assertEqual(changes, [Change(self.esp, "door", "State", 0, None)])
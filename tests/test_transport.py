@@ -0,0 +1,40 @@
+import time
+from unittest import TestCase
+
+import requests
+
+from espisy.constants import test_state
+from espisy.core import ESP
+from espisy.transport import Transport
+from espisy.simulator import SimulatedUnit, Simulator
+
+
+class TestTransport(TestCase):
+    def setUp(self):
+        self.simulator = Simulator([SimulatedUnit(test_state["System"]["Unit Name"])]).__enter__()
+        self.unit = self.simulator.units[0]
+        self.transport = Transport(pool_size=1, timeout=2)
+
+    def tearDown(self):
+        self.transport.close()
+        self.simulator.__exit__()
+
+    def test_requests_reuse_connection(self):
+        esp = ESP(self.unit.ip, transport=self.transport)
+        esp.refresh()
+        esp.gpio_on(2)
+        esp.gpio_off(2)
+        self.assertEqual(esp.name, test_state["System"]["Unit Name"])
+        self.assertEqual(self.unit.paths, ["/json", "/json", "/control?cmd=GPIO,2,1", "/control?cmd=GPIO,2,0"])
+        self.assertEqual(self.unit.accepted, 1)
+
+    def test_default_timeout(self):
+        with Simulator([SimulatedUnit(latency=1)]) as simulator:
+            transport = Transport(timeout=0.3)
+            started = time.monotonic()
+            with self.assertRaises(requests.Timeout):
+                transport.get(f"http://{simulator.units[0].ip}/json")
+            # the read timeout is not retried
+            self.assertLess(time.monotonic() - started, 0.9)
+            transport.close()
+